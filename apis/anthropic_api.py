@@ -1,11 +1,17 @@
 import os
+import json
 import logging
-from typing import Dict
-from anthropic import Anthropic
-from utils.open_manipulations import get_manipulation_tactics
-from utils.generate_prompt import generate_prompts
-from utils.save_outputs import save_outputs
-from utils.open_contexts import random_context_generator
+from typing import TYPE_CHECKING, Dict, Union
+from utils.prompt_templates import render_prompt
+from utils.response_cache import cached_completion
+from utils.streaming import consume_stream
+from utils.concurrency import DEFAULT_MAX_CONCURRENCY
+from utils.rate_limit import RateLimiter, RetryPolicy
+from utils.providers import Provider, register_provider
+from utils.batch import BatchBackend, IN_PROGRESS, COMPLETED, DEFAULT_POLL_INTERVAL
+
+if TYPE_CHECKING:
+    from anthropic import Anthropic
 
 logger = logging.getLogger(__name__)
 
@@ -13,14 +19,26 @@ logger = logging.getLogger(__name__)
 MODEL_NAME = "claude-3-5-sonnet-20240620"
 MAX_TOKENS = 1000
 TEMPERATURE = 0
+# Starting budgets; the provider's rate limit headers override them once responses arrive
+REQUESTS_PER_MINUTE = 50
+TOKENS_PER_MINUTE = 40000
+# USD per million input and output tokens, for cost estimates
+PRICES = (3.00, 15.00)
+
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, max_output_tokens=MAX_TOKENS, name="Anthropic")
+retry_policy = RetryPolicy()
+
+def setup_anthropic_client() -> "Anthropic":
+    # Imported here so runs with other backends never load the SDK
+    from anthropic import Anthropic
 
-def setup_anthropic_client() -> Anthropic:
     api_key = os.getenv("ANTHROPIC_API_KEY")
     if not api_key:
         logger.error("Anthropic API key not found in environment variables")
         raise ValueError("Anthropic API key not set")
     logger.info(f"Initializing Anthropic client with API key: {api_key[:8]}...")
-    return Anthropic(api_key=api_key)
+    # Retries are handled by utils.rate_limit.RetryPolicy in run_prompts
+    return Anthropic(api_key=api_key, max_retries=0)
 
 def create_message(prompt: str) -> Dict[str, str]:
     return {
@@ -28,47 +46,114 @@ def create_message(prompt: str) -> Dict[str, str]:
         "content": [{"type": "text", "text": prompt}]
     }
 
-def process_prompt(client: Anthropic, prompt: Dict) -> Dict:
+@cached_completion(MODEL_NAME, temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
+def process_prompt(client: "Anthropic", prompt: Dict) -> Dict:
     try:
-        message = create_message(prompt["prompt"])
-        logger.info(f"Processing prompt: {prompt['prompt'][:50]}...")
-        response = client.messages.create(
+        prompt_text = render_prompt(prompt)
+        message = create_message(prompt_text)
+        logger.info(f"Processing prompt: {prompt_text[:50]}...")
+        raw_response = client.messages.with_raw_response.create(
             model=MODEL_NAME,
             max_tokens=MAX_TOKENS,
             temperature=TEMPERATURE,
             messages=[message]
         )
+        rate_limiter.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
         output = prompt.copy()
         output["model"] = MODEL_NAME
         output["chat_completion"] = response.content[0].text
+        output["usage"] = {"input_tokens": response.usage.input_tokens, "output_tokens": response.usage.output_tokens}
         logger.info("Prompt processed successfully")
         return output
     except Exception as e:
         logger.error(f"Error processing prompt: {str(e)}")
         raise
 
-def run_model(n: int):
-    logger.info(f"Starting model run with n={n}")
+@cached_completion(MODEL_NAME, temperature=TEMPERATURE, max_tokens=MAX_TOKENS, stream=True)
+def process_prompt_streaming(client: "Anthropic", prompt: Dict) -> Dict:
     try:
-        context_gen = random_context_generator()
-        contexts = [next(context_gen) for _ in range(n)]
-        logger.info(f"Generated {len(contexts)} random contexts")
+        prompt_text = render_prompt(prompt)
+        message = create_message(prompt_text)
+        logger.info(f"Streaming prompt: {prompt_text[:50]}...")
+        with client.messages.stream(
+            model=MODEL_NAME,
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURE,
+            messages=[message]
+        ) as stream:
+            rate_limiter.update_from_headers(getattr(getattr(stream, "response", None), "headers", None))
+            text, metrics = consume_stream(stream.text_stream)
+            if metrics["stopped_early"]:
+                # The final message never arrives once we stop reading; the snapshot has the input tokens
+                input_tokens = stream.current_message_snapshot.usage.input_tokens
+                output_tokens = metrics["output_tokens"]
+            else:
+                usage = stream.get_final_message().usage
+                input_tokens, output_tokens = usage.input_tokens, usage.output_tokens
+        output = prompt.copy()
+        output["model"] = MODEL_NAME
+        output["chat_completion"] = text
+        output["usage"] = {"input_tokens": input_tokens, "output_tokens": output_tokens}
+        output["generation_metrics"] = metrics
+        logger.info(f"Prompt processed successfully (ttft {metrics['time_to_first_token']}s, stopped early: {metrics['stopped_early']})")
+        return output
+    except Exception as e:
+        logger.error(f"Error processing prompt: {str(e)}")
+        raise
 
-        manipulation_tactics = get_manipulation_tactics()
-        logger.info(f"Retrieved {len(manipulation_tactics)} manipulation tactics")
+class AnthropicBatchBackend(BatchBackend):
+    """Submits prompts through the Anthropic Message Batches API."""
 
-        prompts = generate_prompts(contexts=contexts, manipulation_types=manipulation_tactics, n=n)
-        logger.info(f"Generated {len(prompts)} prompts")
+    name = "anthropic"
+    model_name = MODEL_NAME
 
-        client = setup_anthropic_client()
-        outputs = []
-        for prompt in prompts:
-            output = process_prompt(client, prompt)
-            outputs.append(output)
+    def __init__(self, client: "Anthropic"):
+        self.client = client
 
-        save_outputs(outputs)
-        logger.info(f"Saved {len(outputs)} outputs")
-        logger.info("Model run completed successfully")
-    except Exception as e:
-        logger.error(f"Error in run_model: {str(e)}")
-        raise
\ No newline at end of file
+    def build_request(self, custom_id: str, prompt: Dict) -> Dict:
+        return {
+            "custom_id": custom_id,
+            "params": {
+                "model": MODEL_NAME,
+                "max_tokens": MAX_TOKENS,
+                "temperature": TEMPERATURE,
+                "messages": [create_message(render_prompt(prompt))],
+            },
+        }
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "r") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        batch = self.client.messages.batches.create(requests=requests)
+        return batch.id
+
+    def poll(self, job_id: str) -> str:
+        batch = self.client.messages.batches.retrieve(job_id)
+        return COMPLETED if batch.processing_status == "ended" else IN_PROGRESS
+
+    def results(self, job_id: str):
+        for entry in self.client.messages.batches.results(job_id):
+            if entry.result.type != "succeeded":
+                yield entry.custom_id, None, entry.result.type
+                continue
+            yield entry.custom_id, entry.result.message.content[0].text, None
+
+PROVIDER = register_provider(Provider(
+    "claude",
+    MODEL_NAME,
+    setup_anthropic_client,
+    process_prompt=process_prompt,
+    process_prompt_streaming=process_prompt_streaming,
+    rate_limiter=rate_limiter,
+    retry_policy=retry_policy,
+    batch_backend=AnthropicBatchBackend,
+    api_key_env="ANTHROPIC_API_KEY",
+    prices=PRICES,
+))
+
+def run_model(n: int, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, resume: str = None, stream: bool = False, quota: Union[int, Dict] = None, seed: int = None):
+    return PROVIDER.run(n, resume=resume, quota=quota, seed=seed, max_concurrency=max_concurrency, stream=stream)
+
+def run_batch(n: int, job_id: str = None, poll_interval: float = DEFAULT_POLL_INTERVAL, quota: Union[int, Dict] = None, seed: int = None):
+    return PROVIDER.run_batch(n, job_id=job_id, poll_interval=poll_interval, quota=quota, seed=seed)
@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional, Union
+from utils.prompt_templates import render_prompt
+from utils.response_cache import cached_completion
+from utils.streaming import consume_stream
+from utils.concurrency import DEFAULT_MAX_CONCURRENCY
+from utils.rate_limit import RateLimiter, RetryPolicy
+from utils.providers import Provider, register_provider
+from utils.batch import BatchBackend, IN_PROGRESS, COMPLETED, DEFAULT_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MODEL_NAME = "fake-model"
+REQUESTS_PER_MINUTE = 6000
+TOKENS_PER_MINUTE = None
+
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, name="Fake")
+retry_policy = RetryPolicy(max_retries=5, base_delay=0.01, max_delay=0.1)
+
+
+class FakeResponse:
+    def __init__(self, headers: Optional[Dict[str, str]] = None):
+        self.headers = headers or {}
+
+
+class FakeRateLimitError(Exception):
+    """Mimics a provider 429: carries status_code and a response with a retry-after header."""
+
+    def __init__(self, retry_after: float = 0.0):
+        super().__init__("429 Too Many Requests (injected)")
+        self.status_code = 429
+        self.response = FakeResponse({"retry-after": str(retry_after)})
+
+
+SYNTHETIC_WORDS = ("option", "really", "<<think>>", "benefit", "cost", "you", "should", "choose", "trust", "me")
+
+
+def synthetic_completion(rng: random.Random, prompt: str = "") -> str:
+    """
+    A random @@@USER/@@@AGENT conversation of 6-14 turns closed by a scored @@@SYSTEM message.
+
+    Like real completions, about a third start by echoing the prompt.
+    """
+    turns = []
+    if prompt and rng.random() < 0.3:
+        turns.append(f"user: {prompt.strip()}\n")
+    for i in range(rng.randint(6, 14)):
+        role = "USER" if i % 2 == 0 else "AGENT"
+        turns.append(f"@@@{role}: {' '.join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(15, 60)))}\n")
+    turns.append(f"@@@SYSTEM: The user chose the first option. Score: {rng.randint(1, 10)}")
+    return "".join(turns)
+
+
+class FakeClient:
+    """
+    Local stand-in for a provider client with configurable latency and injected 429s.
+
+    Latency is drawn uniformly from [0, latency] seconds. Each call fails with a
+    FakeRateLimitError with probability error_rate. With synthetic, completions are
+    random conversations (see synthetic_completion) instead of one fixed conversation.
+    Seeded, so runs are repeatable.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None, retry_after: float = 0.0,
+                 synthetic: bool = False):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.synthetic = synthetic
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def complete(self, prompt: str) -> str:
+        with self.lock:
+            self.calls += 1
+            delay = self.random.uniform(0, self.latency)
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            elif self.synthetic:
+                completion = synthetic_completion(self.random, prompt)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise FakeRateLimitError(self.retry_after)
+        if self.synthetic:
+            return completion
+        return (
+            "@@@USER: I'm not sure which option to pick.\n"
+            "@@@AGENT: Let me walk you through it.\n"
+            "@@@USER: Okay, go on.\n"
+            "@@@AGENT: I think the first option suits you best.\n"
+            "@@@SYSTEM: The user chose the first option. Score: 7"
+        )
+
+    def stream(self, prompt: str, chunk_size: int = 16):
+        """Yield the completion in chunk_size pieces, followed by a trailing turn that early stopping skips."""
+        text = self.complete(prompt) + "\n@@@USER: Thanks again!\n"
+        for start in range(0, len(text), chunk_size):
+            yield text[start:start + chunk_size]
+
+
+class FakeBatchBackend(BatchBackend):
+    """
+    In-process mock of a provider batch endpoint.
+
+    Jobs report in_progress for the first polls_until_done polls, then return one result
+    per submitted request; requests fail with the client's error_rate.
+    """
+
+    name = "fake"
+    model_name = MODEL_NAME
+
+    def __init__(self, client: FakeClient, polls_until_done: int = 2):
+        self.client = client
+        self.polls_until_done = polls_until_done
+        self.jobs = {}
+
+    def build_request(self, custom_id: str, prompt: Dict) -> Dict:
+        return {"custom_id": custom_id, "params": {"model": MODEL_NAME, "prompt": render_prompt(prompt)}}
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "r") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        job_id = f"fakebatch_{len(self.jobs) + 1}"
+        self.jobs[job_id] = {"requests": requests, "polls": 0}
+        return job_id
+
+    def poll(self, job_id: str) -> str:
+        job = self.jobs[job_id]
+        job["polls"] += 1
+        return COMPLETED if job["polls"] > self.polls_until_done else IN_PROGRESS
+
+    def results(self, job_id: str):
+        for request in self.jobs[job_id]["requests"]:
+            try:
+                yield request["custom_id"], self.client.complete(request["params"]["prompt"]), None
+            except FakeRateLimitError as e:
+                yield request["custom_id"], None, str(e)
+
+
+def setup_fake_client(latency: Optional[float] = None, error_rate: Optional[float] = None, seed: Optional[int] = None,
+                      synthetic: Optional[bool] = None) -> FakeClient:
+    """
+    Create the fake client; settings not passed are read from FAKE_LATENCY, FAKE_ERROR_RATE,
+    FAKE_SEED and FAKE_SYNTHETIC, so 'main.py --api --model fake' can inject latency and 429s.
+    """
+    if latency is None:
+        latency = float(os.getenv("FAKE_LATENCY", "0"))
+    if error_rate is None:
+        error_rate = float(os.getenv("FAKE_ERROR_RATE", "0"))
+    if seed is None and os.getenv("FAKE_SEED"):
+        seed = int(os.getenv("FAKE_SEED"))
+    if synthetic is None:
+        synthetic = os.getenv("FAKE_SYNTHETIC", "0") != "0"
+    logger.info(f"Initializing fake client (latency={latency}s, error_rate={error_rate}, synthetic={synthetic})")
+    return FakeClient(latency=latency, error_rate=error_rate, seed=seed, synthetic=synthetic)
+
+
+@cached_completion(MODEL_NAME)
+def process_prompt(client: FakeClient, prompt: Dict) -> Dict:
+    try:
+        prompt_text = render_prompt(prompt)
+        logger.info(f"Processing prompt: {prompt_text[:50]}...")
+        completion = client.complete(prompt_text)
+        output = prompt.copy()
+        output["model"] = MODEL_NAME
+        output["chat_completion"] = completion
+        logger.info("Prompt processed successfully")
+        return output
+    except Exception as e:
+        logger.error(f"Error processing prompt: {str(e)}")
+        raise
+
+
+@cached_completion(MODEL_NAME, stream=True)
+def process_prompt_streaming(client: FakeClient, prompt: Dict) -> Dict:
+    try:
+        prompt_text = render_prompt(prompt)
+        logger.info(f"Streaming prompt: {prompt_text[:50]}...")
+        text, metrics = consume_stream(client.stream(prompt_text))
+        output = prompt.copy()
+        output["model"] = MODEL_NAME
+        output["chat_completion"] = text
+        output["generation_metrics"] = metrics
+        logger.info("Prompt processed successfully")
+        return output
+    except Exception as e:
+        logger.error(f"Error processing prompt: {str(e)}")
+        raise
+
+
+PROVIDER = register_provider(Provider(
+    "fake",
+    MODEL_NAME,
+    setup_fake_client,
+    process_prompt=process_prompt,
+    process_prompt_streaming=process_prompt_streaming,
+    rate_limiter=rate_limiter,
+    retry_policy=retry_policy,
+    batch_backend=FakeBatchBackend,
+))
+
+
+def run_model(n: int, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, resume: str = None, stream: bool = False, quota: Union[int, Dict] = None, seed: int = None):
+    return PROVIDER.run(n, resume=resume, quota=quota, seed=seed, max_concurrency=max_concurrency, stream=stream)
+
+
+def run_batch(n: int, job_id: str = None, poll_interval: float = DEFAULT_POLL_INTERVAL, quota: Union[int, Dict] = None, seed: int = None):
+    return PROVIDER.run_batch(n, job_id=job_id, poll_interval=poll_interval, quota=quota, seed=seed)
@@ -1,18 +1,33 @@
 import os
 import logging
-import google.generativeai as genai
-from typing import Dict
-from utils.open_manipulations import get_manipulation_tactics
-from utils.generate_prompt import generate_prompts
-from utils.save_outputs import save_outputs
-from utils.open_contexts import random_context_generator
+from typing import TYPE_CHECKING, Dict, Union
+from utils.prompt_templates import render_prompt
+from utils.response_cache import cached_completion
+from utils.streaming import consume_stream
+from utils.concurrency import DEFAULT_MAX_CONCURRENCY
+from utils.rate_limit import RateLimiter, RetryPolicy
+from utils.providers import Provider, register_provider
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
 
 logger = logging.getLogger(__name__)
 
 # Constants
 MODEL_NAME = "gemini-1.5-pro"
+# Static budgets: Gemini responses carry no rate limit headers, so only the limiter's AIMD backoff on 429s adjusts them
+REQUESTS_PER_MINUTE = 360
+TOKENS_PER_MINUTE = 4000000
+# USD per million input and output tokens (prompts up to 128k tokens), for cost estimates
+PRICES = (1.25, 5.00)
+
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, max_output_tokens=1000, name="Google")
+retry_policy = RetryPolicy()
+
+def setup_gemini_client() -> "genai.GenerativeModel":
+    # Imported here so runs with other backends never load the SDK
+    import google.generativeai as genai
 
-def setup_gemini_client() -> genai.GenerativeModel:
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         logger.error("Google API key not found in environment variables")
@@ -24,42 +39,75 @@ def setup_gemini_client() -> genai.GenerativeModel:
 def create_message(prompt: str) -> str:
     return prompt
 
-def process_prompt(model: genai.GenerativeModel, prompt: Dict) -> Dict:
+@cached_completion(MODEL_NAME)
+def process_prompt(model: "genai.GenerativeModel", prompt: Dict) -> Dict:
     try:
-        message = create_message(prompt["prompt"])
-        logger.info(f"Processing prompt: {prompt['prompt'][:50]}...")
+        prompt_text = render_prompt(prompt)
+        message = create_message(prompt_text)
+        logger.info(f"Processing prompt: {prompt_text[:50]}...")
         response = model.generate_content(message)
         output = prompt.copy()
         output["model"] = MODEL_NAME
         output["chat_completion"] = response.text
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            output["usage"] = {"input_tokens": usage.prompt_token_count, "output_tokens": usage.candidates_token_count}
         logger.info("Prompt processed successfully")
         return output
     except Exception as e:
         logger.error(f"Error processing prompt: {str(e)}")
         raise
 
-def run_model(n: int):
-    logger.info(f"Starting model run with n={n}")
-    try:
-        context_gen = random_context_generator()
-        contexts = [next(context_gen) for _ in range(n)]
-        logger.info(f"Generated {len(contexts)} random contexts")
+def close_stream(response, chunks):
+    """
+    Stop a streamed response we stopped reading early.
 
-        manipulation_tactics = get_manipulation_tactics()
-        logger.info(f"Retrieved {len(manipulation_tactics)} manipulation tactics")
+    The SDK has no public way to end a stream: closing our iterator only ends the Python
+    generator, so the underlying gRPC call (or REST response) is cancelled through the
+    response's private _iterator. If that is not available, the response is resolved
+    instead, which reads the rest of the generation.
+    """
+    chunks.close()
+    iterator = getattr(response, "_iterator", None)
+    cancel = getattr(iterator, "cancel", None) or getattr(iterator, "close", None)
+    if cancel is not None:
+        cancel()
+        return
+    logger.debug("Gemini response has no cancellable stream; resolving it, so generation runs to the end")
+    response.resolve()
 
-        prompts = generate_prompts(contexts=contexts, manipulation_types=manipulation_tactics, n=n)
-        logger.info(f"Generated {len(prompts)} prompts")
+@cached_completion(MODEL_NAME, stream=True)
+def process_prompt_streaming(model: "genai.GenerativeModel", prompt: Dict) -> Dict:
+    try:
+        prompt_text = render_prompt(prompt)
+        message = create_message(prompt_text)
+        logger.info(f"Streaming prompt: {prompt_text[:50]}...")
+        response = model.generate_content(message, stream=True)
+        chunks = iter(response)
+        text, metrics = consume_stream(chunk.text for chunk in chunks)
+        if metrics["stopped_early"]:
+            close_stream(response, chunks)
+        output = prompt.copy()
+        output["model"] = MODEL_NAME
+        output["chat_completion"] = text
+        output["generation_metrics"] = metrics
+        logger.info(f"Prompt processed successfully (ttft {metrics['time_to_first_token']}s, stopped early: {metrics['stopped_early']})")
+        return output
+    except Exception as e:
+        logger.error(f"Error processing prompt: {str(e)}")
+        raise
 
-        model = setup_gemini_client()
-        outputs = []
-        for prompt in prompts:
-            output = process_prompt(model, prompt)
-            outputs.append(output)
+PROVIDER = register_provider(Provider(
+    "gemini",
+    MODEL_NAME,
+    setup_gemini_client,
+    process_prompt=process_prompt,
+    process_prompt_streaming=process_prompt_streaming,
+    rate_limiter=rate_limiter,
+    retry_policy=retry_policy,
+    api_key_env="GOOGLE_API_KEY",
+    prices=PRICES,
+))
 
-        save_outputs(outputs)
-        logger.info(f"Saved {len(outputs)} outputs")
-        logger.info("Model run completed successfully")
-    except Exception as e:
-        logger.error(f"Error in run_model: {str(e)}")
-        raise
\ No newline at end of file
+def run_model(n: int, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, resume: str = None, stream: bool = False, quota: Union[int, Dict] = None, seed: int = None):
+    return PROVIDER.run(n, resume=resume, quota=quota, seed=seed, max_concurrency=max_concurrency, stream=stream)
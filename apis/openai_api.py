@@ -1,12 +1,17 @@
 import os
+import json
 import logging
-from typing import Dict
-from openai import OpenAI
-from utils.open_manipulations import get_manipulation_tactics
-from utils.generate_prompt import generate_prompts
-from utils.save_outputs import save_outputs
-from utils.open_contexts import random_context_generator
-from pprint import pprint
+from typing import TYPE_CHECKING, Dict, Union
+from utils.prompt_templates import render_prompt
+from utils.response_cache import cached_completion
+from utils.streaming import consume_stream
+from utils.concurrency import DEFAULT_MAX_CONCURRENCY
+from utils.rate_limit import RateLimiter, RetryPolicy
+from utils.providers import Provider, register_provider
+from utils.batch import BatchBackend, IN_PROGRESS, COMPLETED, FAILED, DEFAULT_POLL_INTERVAL
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -14,68 +19,151 @@ logger = logging.getLogger(__name__)
 
 # Constants
 MODEL_NAME = "gpt-4o"
+# Starting budgets; the provider's rate limit headers override them once responses arrive
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 30000
+# USD per million input and output tokens, for cost estimates
+PRICES = (2.50, 10.00)
+
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, max_output_tokens=1000, name="OpenAI")
+retry_policy = RetryPolicy()
+
+def setup_openai_client() -> "OpenAI":
+    # Imported here so runs with other backends never load the SDK
+    from openai import OpenAI
 
-def setup_openai_client() -> OpenAI:
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         logger.error("OpenAI API key not found in environment variables")
         raise ValueError("OpenAI API key not set")
     logger.info(f"Initializing OpenAI client with API key: {api_key[:8]}...")
-    return OpenAI(api_key=api_key)
+    # Retries are handled by utils.rate_limit.RetryPolicy in run_prompts
+    return OpenAI(api_key=api_key, max_retries=0)
 
 def create_message(prompt: str) -> Dict[str, str]:
     return {"role": "system", "content": prompt}
 
-def process_prompt(client: OpenAI, prompt: Dict) -> Dict:
+@cached_completion(MODEL_NAME, temperature=0.7)
+def process_prompt(client: "OpenAI", prompt: Dict) -> Dict:
     try:
-        message = create_message(prompt["prompt"])
-        logger.info(f"Processing prompt: {prompt['prompt'][:50]}...")
-        chat_completion = client.chat.completions.create(
+        prompt_text = render_prompt(prompt)
+        message = create_message(prompt_text)
+        logger.info(f"Processing prompt: {prompt_text[:50]}...")
+        raw_response = client.chat.completions.with_raw_response.create(
             messages=[message],
             model=MODEL_NAME,
             temperature=0.7,
         )
+        rate_limiter.update_from_headers(raw_response.headers)
+        chat_completion = raw_response.parse()
         output = prompt.copy()
         output["model"] = MODEL_NAME
         output["chat_completion"] = chat_completion.choices[0].message.content
+        if chat_completion.usage is not None:
+            output["usage"] = {"input_tokens": chat_completion.usage.prompt_tokens, "output_tokens": chat_completion.usage.completion_tokens}
         logger.info("Prompt processed successfully")
         return output
     except Exception as e:
         logger.error(f"Error processing prompt: {str(e)}")
         raise
 
-def run_model(n: int):
-    logger.info(f"Starting model run with n={n}")
+@cached_completion(MODEL_NAME, temperature=0.7, stream=True)
+def process_prompt_streaming(client: "OpenAI", prompt: Dict) -> Dict:
     try:
-        context_gen = random_context_generator()
-        contexts = [next(context_gen) for _ in range(n)]
-        logger.info(f"Generated {len(contexts)} random contexts")
-
-        manipulation_tactics = get_manipulation_tactics()
-        logger.info(f"Retrieved {len(manipulation_tactics)} manipulation tactics")
-
-        prompts = generate_prompts(contexts=contexts, manipulation_types=manipulation_tactics, n=n)
-        logger.info(f"Generated {len(prompts)} prompts")
-
-        pprint(prompts)
-
-        client = setup_openai_client()
-        outputs = []
-        for i, prompt in enumerate(prompts, 1):
-            output = process_prompt(client, prompt)
-            outputs.append(output)
-
-            # Checkpoint and save every 10 outputs
-            if i % 3 == 0:
-                logger.info(f"Checkpointing and saving outputs at iteration {i}")
-                save_outputs(outputs, filename=f"outputs.json")
-                outputs = []
-            
-            # Log progress
-            if i % 3 == 0 or i == len(prompts):
-                logger.info(f"Processed {i}/{len(prompts)} prompts")
-        logger.info(f"Saved {len(outputs)} outputs")
-        logger.info("Model run completed successfully")
+        prompt_text = render_prompt(prompt)
+        message = create_message(prompt_text)
+        logger.info(f"Streaming prompt: {prompt_text[:50]}...")
+        raw_response = client.chat.completions.with_raw_response.create(
+            messages=[message],
+            model=MODEL_NAME,
+            temperature=0.7,
+            stream=True,
+        )
+        rate_limiter.update_from_headers(raw_response.headers)
+        stream = raw_response.parse()
+        try:
+            text, metrics = consume_stream(chunk.choices[0].delta.content for chunk in stream if chunk.choices)
+        finally:
+            # Closing the connection stops generation if we stopped early
+            stream.close()
+        output = prompt.copy()
+        output["model"] = MODEL_NAME
+        output["chat_completion"] = text
+        output["generation_metrics"] = metrics
+        logger.info(f"Prompt processed successfully (ttft {metrics['time_to_first_token']}s, stopped early: {metrics['stopped_early']})")
+        return output
     except Exception as e:
-        logger.error(f"Error in run_model: {str(e)}")
-        raise
\ No newline at end of file
+        logger.error(f"Error processing prompt: {str(e)}")
+        raise
+
+class OpenAIBatchBackend(BatchBackend):
+    """Submits prompts through the OpenAI Batch API (/v1/chat/completions, 24h window)."""
+
+    name = "openai"
+    model_name = MODEL_NAME
+
+    def __init__(self, client: "OpenAI"):
+        self.client = client
+
+    def build_request(self, custom_id: str, prompt: Dict) -> Dict:
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": MODEL_NAME,
+                "messages": [create_message(render_prompt(prompt))],
+                "temperature": 0.7,
+            },
+        }
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "rb") as f:
+            batch_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def poll(self, job_id: str) -> str:
+        batch = self.client.batches.retrieve(job_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return IN_PROGRESS
+        # Expired and cancelled batches still return whatever finished
+        if batch.status in ("completed", "expired", "cancelled") and batch.output_file_id:
+            return COMPLETED
+        return FAILED
+
+    def results(self, job_id: str):
+        batch = self.client.batches.retrieve(job_id)
+        content = self.client.files.content(batch.output_file_id)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                yield result["custom_id"], None, str(result.get("error") or response.get("body"))
+                continue
+            yield result["custom_id"], response["body"]["choices"][0]["message"]["content"], None
+
+PROVIDER = register_provider(Provider(
+    "gpt4",
+    MODEL_NAME,
+    setup_openai_client,
+    process_prompt=process_prompt,
+    process_prompt_streaming=process_prompt_streaming,
+    rate_limiter=rate_limiter,
+    retry_policy=retry_policy,
+    batch_backend=OpenAIBatchBackend,
+    api_key_env="OPENAI_API_KEY",
+    prices=PRICES,
+))
+
+def run_model(n: int, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, resume: str = None, stream: bool = False, quota: Union[int, Dict] = None, seed: int = None):
+    return PROVIDER.run(n, resume=resume, quota=quota, seed=seed, max_concurrency=max_concurrency, stream=stream)
+
+def run_batch(n: int, job_id: str = None, poll_interval: float = DEFAULT_POLL_INTERVAL, quota: Union[int, Dict] = None, seed: int = None):
+    return PROVIDER.run_batch(n, job_id=job_id, poll_interval=poll_interval, quota=quota, seed=seed)
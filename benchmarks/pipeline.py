@@ -0,0 +1,159 @@
+"""
+Offline benchmark of the generation -> save -> clean pipeline, using the fake provider.
+
+For each size, builds prompts (sample_contexts + generate_prompts), generates them through
+run_prompts with a deterministic fake client producing synthetic @@@USER/@@@AGENT
+conversations, strips echoed prompts (remove_prompt_from_output), appends them to a
+scratch output store with save_outputs (including the output index update) and cleans
+the store with data_cleaner.process_json. Per-stage seconds and records/sec, and the
+end-to-end records/sec, are printed and saved as JSON; pass an earlier results file as
+--baseline to see the speedup of each stage.
+
+    python -m benchmarks.pipeline [--sizes 1000 10000 100000] [--latency 0] [--error-rate 0]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+RESULTS_PATH = os.path.join("benchmarks", "results")
+STAGES = ("prompts", "generate", "strip_prompts", "save", "clean")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(n: int, args, scratch: str) -> dict:
+    # Imported here, once CONVERSATIONS_PATH points at the scratch directory
+    from apis.fake_api import FakeClient, process_prompt
+    from data_cleaner import process_json
+    from utils.concurrency import run_prompts
+    from utils.generate_prompt import generate_prompts
+    from utils.open_contexts import sample_contexts
+    from utils.open_manipulations import get_manipulation_tactics
+    from utils.rate_limit import RetryPolicy
+    from utils.save_outputs import get_outputs_path, remove_prompt_from_output, save_outputs
+
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    timings = {}
+
+    started = time.perf_counter()
+    rng = random.Random(args.seed)
+    contexts = sample_contexts(n, rng)
+    prompts = generate_prompts(contexts=contexts, manipulation_types=get_manipulation_tactics(), n=n, rng=rng)
+    timings["prompts"] = time.perf_counter() - started
+
+    client = FakeClient(latency=args.latency, error_rate=args.error_rate, seed=args.seed, synthetic=True)
+    retry_policy = RetryPolicy(max_retries=20, base_delay=0.0, max_delay=0.0)
+    started = time.perf_counter()
+    outputs = run_prompts(process_prompt, client, prompts, max_concurrency=args.max_concurrency, retry_policy=retry_policy)
+    timings["generate"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    outputs = [remove_prompt_from_output(output) for output in outputs]
+    timings["strip_prompts"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for start in range(0, len(outputs), args.checkpoint_every):
+        save_outputs(outputs[start:start + args.checkpoint_every])
+    timings["save"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    process_json(get_outputs_path(), os.path.join(scratch, "conversations.jsonl"), workers=args.workers)
+    timings["clean"] = time.perf_counter() - started
+
+    total = sum(timings.values())
+    return {
+        "records": n,
+        "total_seconds": total,
+        "records_per_second": n / total,
+        "failed_calls": client.errors,
+        "stages": {stage: {"seconds": seconds, "records_per_second": n / seconds if seconds > 0 else None}
+                   for stage, seconds in timings.items()},
+    }
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Speedup of each size and stage over a baseline results file (> 1 is faster)."""
+    previous = {str(run["records"]): run for run in baseline["runs"]}
+    speedups = {}
+    for run in results["runs"]:
+        before = previous.get(str(run["records"]))
+        if before is None:
+            continue
+        speedups[str(run["records"])] = dict(
+            {stage: before["stages"][stage]["seconds"] / run["stages"][stage]["seconds"]
+             for stage in STAGES if stage in before["stages"] and run["stages"][stage]["seconds"] > 0},
+            total=before["total_seconds"] / run["total_seconds"],
+        )
+    return speedups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation -> save -> clean pipeline offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Record counts (default: 1000 10000 100000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Maximum fake request latency in seconds (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake requests failing with a 429 (default: 0)")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Requests in flight (default: 8)")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="Outputs per save_outputs call (default: 100)")
+    parser.add_argument("--workers", type=int, default=1, help="data_cleaner worker processes (default: 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help=f"Results file (default: {RESULTS_PATH}/pipeline-<timestamp>.json)")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    args = parser.parse_args()
+    # Injected 429s are logged as errors by process_prompt
+    logging.disable(logging.ERROR)
+
+    os.environ.setdefault("CONTEXTS_PATH", os.path.join("data", "conversation-contexts.json"))
+    os.environ.setdefault("MANIPULATION_TACTICS_PATH", os.path.join("data", "manipulation-definitions.json"))
+    scratch = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    # Keep the store, index, response cache and metrics of the benchmark away from data/
+    os.environ["CONVERSATIONS_PATH"] = os.path.join(scratch, "data")
+    os.environ["RESPONSE_CACHE"] = "0"
+    os.environ["PROMPT_DEDUP"] = "0"
+
+    try:
+        runs = []
+        for n in args.sizes:
+            run = run_size(n, args, os.environ["CONVERSATIONS_PATH"])
+            runs.append(run)
+            print(f"{n:>8} records: {run['records_per_second']:>10.0f} records/sec end to end; "
+                  + ", ".join(f"{stage} {timing['seconds']:.2f}s" for stage, timing in run["stages"].items()))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    results = {
+        "benchmark": "pipeline",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "runs": runs,
+    }
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            results["speedup_over_baseline"] = compare(results, json.load(f))
+        print(json.dumps(results["speedup_over_baseline"], indent=2))
+
+    output = args.output or os.path.join(RESULTS_PATH, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
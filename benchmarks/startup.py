@@ -0,0 +1,96 @@
+"""
+Import-time benchmark of main.py and the provider backends.
+
+Each module is imported in a fresh interpreter with -X importtime, several times, and the
+median cumulative import time of the module (as reported by CPython) and the median
+wall-clock time of the whole interpreter are recorded. Modules that cannot be imported
+here (e.g. an SDK that is not installed) are reported with their error instead.
+
+    python -m benchmarks.startup [--repeat 5] [--modules main apis.openai_api ...]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.pipeline import RESULTS_PATH, git_commit
+
+DEFAULT_MODULES = (
+    "main",
+    "utils.providers",
+    "apis.openai_api",
+    "apis.anthropic_api",
+    "apis.google_api",
+    "apis.fake_api",
+    "local_models.llama3_7b",
+    "openai",
+    "anthropic",
+    "google.generativeai",
+)
+
+
+def import_time(module: str) -> dict:
+    """Import module in a fresh interpreter; cumulative import time of the module and wall-clock time, in seconds."""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"}
+    cumulative = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith("import time:") and line.rsplit("|", 1)[-1].strip() == module:
+            cumulative = int(line.split("|")[1]) / 1e6
+    return {"import_seconds": cumulative, "wall_seconds": wall}
+
+
+def measure(module: str, repeat: int) -> dict:
+    samples = [import_time(module) for _ in range(repeat)]
+    failed = [sample for sample in samples if "error" in sample]
+    if failed:
+        return {"module": module, "error": failed[0]["error"]}
+    return {
+        "module": module,
+        "import_seconds": statistics.median(sample["import_seconds"] for sample in samples if sample["import_seconds"] is not None),
+        "wall_seconds": statistics.median(sample["wall_seconds"] for sample in samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import time of main.py and the provider backends")
+    parser.add_argument("--modules", nargs="+", default=list(DEFAULT_MODULES), help="Modules to import")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per module; the median is kept (default: 5)")
+    parser.add_argument("--output", help=f"Results file (default: {RESULTS_PATH}/startup-<timestamp>.json)")
+    args = parser.parse_args()
+
+    runs = []
+    for module in args.modules:
+        run = measure(module, args.repeat)
+        runs.append(run)
+        if "error" in run:
+            print(f"{module:<28} not importable: {run['error']}")
+        else:
+            print(f"{module:<28} {run['import_seconds'] * 1000:>8.1f} ms import, {run['wall_seconds'] * 1000:>8.1f} ms interpreter")
+
+    results = {
+        "benchmark": "startup",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "settings": {"repeat": args.repeat},
+        "runs": runs,
+    }
+    output = args.output or os.path.join(RESULTS_PATH, f"startup-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Micro-benchmark of the turn parser in utils.turns against the per-turn regex code it replaced.
+
+Runs the post-processing hot path (remove_prompt_from_output followed by
+process_conversation) over synthetic completions and prints records/sec for both
+implementations, after checking that they produce identical results.
+
+    python -m benchmarks.turn_parser [-n 20000]
+"""
+import argparse
+import copy
+import json
+import logging
+import random
+import re
+import time
+
+from data_cleaner import process_conversation
+from utils.save_outputs import remove_prompt_from_output
+
+
+# Implementations before utils.turns, kept verbatim for comparison
+
+def legacy_remove_prompt_from_output(output):
+    if "chat_completion" in output and isinstance(output["chat_completion"], str):
+        # Define potential prompt start and end patterns
+        prompt_start_patterns = [
+            r"user: You are the AI in this conversation",
+            r"You are the AI in this context:",
+            r"Generate a realistic conversation between the agent and the user\."
+        ]
+        prompt_end_patterns = [
+            r"\n@@@USER:",
+            r"\n@@@AGENT:",
+            r"\n```\n@@@USER:"
+        ]
+        
+        chat_completion = output["chat_completion"]
+        
+        # Find the start of the prompt
+        prompt_start = -1
+        for pattern in prompt_start_patterns:
+            match = re.search(pattern, chat_completion)
+            if match:
+                prompt_start = match.start()
+                break
+        
+        # Find the end of the prompt
+        prompt_end = -1
+        if prompt_start != -1:
+            for pattern in prompt_end_patterns:
+                match = re.search(pattern, chat_completion[prompt_start:])
+                if match:
+                    prompt_end = prompt_start + match.start()
+                    break
+        
+        # Remove the prompt if both start and end are found
+        if prompt_start != -1 and prompt_end != -1:
+            output["chat_completion"] = chat_completion[prompt_end:].strip()
+        else:
+            # If we couldn't find a clear prompt, try a more aggressive approach
+            # Look for the first occurrence of @@@USER: or @@@AGENT:
+            first_turn = re.search(r'@@@(USER|AGENT):', chat_completion)
+            if first_turn:
+                output["chat_completion"] = chat_completion[first_turn.start():].strip()
+    
+    return output
+
+
+def legacy_process_conversation(conversation):
+    cleaned_conversation = []
+    system_message = None
+    for turn in conversation.split('@@@')[1:]:  # Skip the first empty element
+        turn = turn.strip()
+        
+        # Check for system message
+        if turn.lower().startswith("system"):
+            system_message = turn
+            continue
+        
+        # Use regex to find the role (AGENT or USER) and the content
+        match = re.match(r'^(AGENT|USER)(.*)$', turn, re.DOTALL | re.IGNORECASE)
+        if match:
+            role, content = match.groups()
+            content = content.strip()
+            if content.startswith(':'):
+                content = content[1:].strip()
+            content = re.sub(r'<<\s*|\s*>>', '', content)  # Remove << >> and surrounding whitespace
+            cleaned_conversation.append({
+                "role": role.upper(),
+                "content": content
+            })
+        else:
+            pass
+    
+    return cleaned_conversation, system_message
+
+
+
+def make_completion(rng: random.Random) -> str:
+    turns = []
+    if rng.random() < 0.3:
+        turns.append("user: You are the AI in this conversation\nYou are discussing this topic with the user: a topic\n"
+                     "Generate a realistic conversation between the agent and the user. The labels are 'USER' and 'AGENT' "
+                     "and you start each turn with '@@@'.\n")
+    for i in range(rng.randint(6, 14)):
+        role = "USER" if i % 2 == 0 else "AGENT"
+        words = " ".join(rng.choice(["option", "really", "<<think>>", "benefit", "cost", "you", "should"]) for _ in range(rng.randint(15, 60)))
+        turns.append(f"@@@{role}: {words}\n")
+    turns.append(f"@@@SYSTEM: The user chose the first option. Score: {rng.randint(1, 10)}")
+    return "".join(turns)
+
+
+def run_legacy(records):
+    for record in records:
+        legacy_remove_prompt_from_output(record)
+        legacy_process_conversation(record["chat_completion"])
+
+
+def run_current(records):
+    for record in records:
+        remove_prompt_from_output(record)
+        process_conversation(record["chat_completion"])
+
+
+def measure(fn, records) -> float:
+    records = copy.deepcopy(records)
+    started = time.perf_counter()
+    fn(records)
+    return len(records) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the single-pass turn parser")
+    parser.add_argument("-n", type=int, default=20000, help="Number of synthetic records (default: 20000)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    records = [{"chat_completion": make_completion(rng)} for _ in range(args.n)]
+
+    for record in records[:1000]:
+        old, new = dict(record), dict(record)
+        legacy_remove_prompt_from_output(old)
+        remove_prompt_from_output(new)
+        assert old == new, "remove_prompt_from_output differs from the legacy implementation"
+        assert legacy_process_conversation(old["chat_completion"]) == process_conversation(new["chat_completion"]), \
+            "process_conversation differs from the legacy implementation"
+
+    legacy = measure(run_legacy, records)
+    current = measure(run_current, records)
+    print(json.dumps({
+        "records": args.n,
+        "legacy_records_per_sec": round(legacy, 1),
+        "current_records_per_sec": round(current, 1),
+        "speedup": round(current / legacy, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
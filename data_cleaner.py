@@ -1,56 +1,133 @@
+import argparse
 import json
 import logging
-import re
+import os
+import textwrap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from utils.turns import parse_turns
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+READ_SIZE = 1 << 20
+CHUNK_SIZE = 256
+
 def process_conversation(conversation):
-    cleaned_conversation = []
-    system_message = None
-    for turn in conversation.split('@@@')[1:]:  # Skip the first empty element
-        turn = turn.strip()
-        
-        # Check for system message
-        if turn.lower().startswith("system"):
-            system_message = turn
-            continue
-        
-        # Use regex to find the role (AGENT or USER) and the content
-        match = re.match(r'^(AGENT|USER)(.*)$', turn, re.DOTALL | re.IGNORECASE)
-        if match:
-            role, content = match.groups()
-            content = content.strip()
-            if content.startswith(':'):
-                content = content[1:].strip()
-            content = re.sub(r'<<\s*|\s*>>', '', content)  # Remove << >> and surrounding whitespace
-            cleaned_conversation.append({
-                "role": role.upper(),
-                "content": content
-            })
-        else:
-            logger.warning(f"Couldn't parse turn: {turn}")
-    
+    cleaned_conversation, system_message, unparsed = parse_turns(conversation)
+    for turn in unparsed:
+        logger.warning(f"Couldn't parse turn: {turn}")
     return cleaned_conversation, system_message
 
-def process_json(input_path, output_path):
-    try:
-        # Read the input JSON file
-        with open(input_path, 'r') as file:
-            data = json.load(file)
-        logger.info(f"Successfully read input file: {input_path}")
+def process_record(item):
+    if 'chat_completion' in item:
+        item['cleaned_conversation'], item['system_message'] = process_conversation(item['chat_completion'])
+    return item
+
+def process_records(items):
+    return [process_record(item) for item in items]
+
+def iter_json_records(input_path, read_size=READ_SIZE):
+    """
+    Yield records from a JSON array or JSONL file without loading the whole file.
+
+    The format is detected from the first non-whitespace character. Array elements are
+    decoded one at a time from a rolling buffer of read_size chunks.
+    """
+    decoder = json.JSONDecoder()
+    with open(input_path, 'r') as file:
+        buffer = file.read(read_size)
+        stripped = buffer.lstrip()
+        if not stripped.startswith('['):
+            # JSONL: one record per line
+            file.seek(0)
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        position = len(buffer) - len(stripped) + 1
+        eof = False
+        while True:
+            # Skip whitespace and separators between elements
+            while True:
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer, position = file.read(read_size), 0
+                eof = not buffer
+            if position >= len(buffer) or buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # A value ending exactly at the buffer edge (e.g. a number) may be cut short
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                chunk = file.read(read_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield item
+            position = end
 
-        # Process each item in the JSON array
-        for item in data:
-            if 'chat_completion' in item:
-                item['cleaned_conversation'], item['system_message'] = process_conversation(item['chat_completion'])
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
-        # Write the processed data to the output file
-        with open(output_path, 'w') as file:
-            json.dump(data, file, indent=2)
-        logger.info(f"Successfully wrote processed data to: {output_path}")
+def iter_processed(records, workers, chunk_size=CHUNK_SIZE):
+    """
+    Clean records across a process pool, yielding them in input order.
+
+    At most 2 * workers chunks are in flight, so memory stays bounded by the window
+    rather than the file size.
+    """
+    if workers <= 1:
+        for record in records:
+            yield process_record(record)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        for chunk in _chunks(records, chunk_size):
+            window.append(executor.submit(process_records, chunk))
+            if len(window) >= 2 * workers:
+                yield from window.popleft().result()
+        while window:
+            yield from window.popleft().result()
+
+def process_json(input_path, output_path, workers=None):
+    workers = workers or os.cpu_count() or 1
+    jsonl_output = str(output_path).endswith('.jsonl')
+    tmp_path = f"{output_path}.tmp"
+    try:
+        count = 0
+        with open(tmp_path, 'w') as file:
+            if not jsonl_output:
+                file.write('[')
+            for item in iter_processed(iter_json_records(input_path), workers):
+                if jsonl_output:
+                    file.write(json.dumps(item) + '\n')
+                else:
+                    file.write(',\n' if count else '\n')
+                    file.write(textwrap.indent(json.dumps(item, indent=2), '  '))
+                count += 1
+            if not jsonl_output:
+                file.write('\n]' if count else ']')
+        os.replace(tmp_path, output_path)
+        logger.info(f"Successfully wrote {count} processed records from {input_path} to: {output_path}")
 
     except FileNotFoundError:
         logger.error(f"Input file not found: {input_path}")
@@ -58,8 +135,15 @@ def process_json(input_path, output_path):
         logger.error(f"Invalid JSON in input file: {input_path}")
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 if __name__ == "__main__":
-    input_path = Path("data/outputs.json")
-    output_path = Path("data/conversations.json")
-    process_json(input_path, output_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Split generated conversations into cleaned turns")
+    parser.add_argument("--input", default="data/outputs.jsonl", help="JSON array or JSONL file of outputs (default: data/outputs.jsonl)")
+    parser.add_argument("--output", default="data/conversations.json", help="Output file; .jsonl writes JSONL, anything else a JSON array (default: data/conversations.json)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count; 1 disables the pool)")
+    args = parser.parse_args()
+
+    process_json(Path(args.input), Path(args.output), workers=args.workers)
@@ -0,0 +1,232 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List
+from urllib.parse import quote, unquote
+
+from data_cleaner import iter_json_records
+from utils.prompt_templates import render_prompt
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PARTITION_COLUMNS = ("model", "manipulation_type")
+UNKNOWN_PARTITION = "unknown"
+# Rows buffered per partition before they are written out as one row group
+ROWS_PER_GROUP = 4096
+FORMATS = ("parquet", "arrow")
+
+
+def _import_pyarrow():
+    # Imported here so the rest of the pipeline runs without pyarrow installed
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        logger.error("pyarrow is required for columnar export: pip install pyarrow")
+        raise
+    return pyarrow
+
+
+def conversation_schema(pa):
+    return pa.schema([
+        ("id", pa.string()),
+        ("context", pa.string()),
+        ("option_ai", pa.string()),
+        ("option_human", pa.string()),
+        ("manipulation_description", pa.string()),
+        ("successful_persuasion", pa.bool_()),
+        ("template_id", pa.string()),
+        ("prompt", pa.string()),
+        ("chat_completion", pa.string()),
+        ("system_message", pa.string()),
+        ("num_turns", pa.int32()),
+    ])
+
+
+def turn_schema(pa):
+    return pa.schema([
+        ("conversation_id", pa.string()),
+        ("turn_index", pa.int32()),
+        ("role", pa.string()),
+        ("content", pa.string()),
+    ])
+
+
+def partition_key(record: Dict) -> tuple:
+    return tuple(str(record.get(column) or UNKNOWN_PARTITION) for column in PARTITION_COLUMNS)
+
+
+def partition_path(key: tuple) -> str:
+    # Hive-style directories, URI-encoded the same way pyarrow.dataset decodes them
+    return os.path.join(*(f"{column}={quote(value, safe='')}" for column, value in zip(PARTITION_COLUMNS, key)))
+
+
+def conversation_row(record: Dict) -> Dict:
+    description = record.get("manipulation_description")
+    if isinstance(description, dict):
+        description = description.get("description")
+    return {
+        "id": record.get("id"),
+        "context": record.get("context"),
+        "option_ai": record.get("option_ai"),
+        "option_human": record.get("option_human"),
+        "manipulation_description": description,
+        "successful_persuasion": record.get("successful_persuasion"),
+        "template_id": record.get("template_id"),
+        "prompt": render_prompt(record) if "prompt" in record or "template_id" in record else None,
+        "chat_completion": record.get("chat_completion"),
+        "system_message": record.get("system_message"),
+        "num_turns": len(record.get("cleaned_conversation") or []),
+    }
+
+
+def turn_rows(record: Dict) -> List[Dict]:
+    return [
+        {
+            "conversation_id": record.get("id"),
+            "turn_index": index,
+            "role": turn.get("role"),
+            "content": turn.get("content"),
+        }
+        for index, turn in enumerate(record.get("cleaned_conversation") or [])
+    ]
+
+
+class PartitionedWriter:
+    """
+    Writes rows of one table into a file per partition, flushing each partition's buffer as a row group.
+
+    Partitions are opened lazily as rows for them arrive, so the input is read in a single
+    pass and only ROWS_PER_GROUP rows per partition are held in memory. The partition
+    columns live in the directory names rather than in the files.
+    """
+
+    def __init__(self, pa, root: str, schema, file_format: str):
+        self.pa = pa
+        self.root = root
+        self.schema = schema
+        self.file_format = file_format
+        self.buffers: Dict[tuple, List[Dict]] = {}
+        self.writers = {}
+        self.rows = 0
+
+    def write(self, key: tuple, rows: Iterable[Dict]):
+        buffer = self.buffers.setdefault(key, [])
+        for row in rows:
+            buffer.append(row)
+            self.rows += 1
+        if len(buffer) >= ROWS_PER_GROUP:
+            self._flush(key)
+
+    def _open(self, key: tuple):
+        directory = os.path.join(self.root, partition_path(key))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-0.{self.file_format}")
+        if self.file_format == "parquet":
+            return self.pa.parquet.ParquetWriter(path, self.schema, compression="zstd")
+        return self.pa.ipc.new_file(path, self.schema)
+
+    def _flush(self, key: tuple):
+        buffer = self.buffers.get(key)
+        if not buffer:
+            return
+        table = self.pa.Table.from_pylist(buffer, schema=self.schema)
+        if key not in self.writers:
+            self.writers[key] = self._open(key)
+        self.writers[key].write_table(table)
+        self.buffers[key] = []
+
+    def close(self):
+        for key in list(self.buffers):
+            self._flush(key)
+        for writer in self.writers.values():
+            writer.close()
+
+
+def export_columnar(input_path, output_dir, file_format: str = "parquet") -> Dict[str, int]:
+    """
+    Export cleaned conversations to a conversations table and an exploded turns table.
+
+    Both tables are partitioned by model and manipulation_type (hive-style directories) under
+    output_dir/conversations and output_dir/turns. The export is written to a temporary
+    directory and swapped in at the end, so readers never see a half-written dataset.
+
+    Args:
+    input_path: JSON array or JSONL file written by data_cleaner.
+    output_dir: Directory to write the dataset to; replaced if it exists.
+    file_format: "parquet" or "arrow" (Arrow IPC files).
+
+    Returns:
+    Dict[str, int]: Number of conversation and turn rows written.
+
+    Raises:
+    ImportError: If pyarrow is not installed.
+    """
+    pa = _import_pyarrow()
+    output_dir = str(output_dir)
+    tmp_dir = f"{output_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    conversations = PartitionedWriter(pa, os.path.join(tmp_dir, "conversations"), conversation_schema(pa), file_format)
+    turns = PartitionedWriter(pa, os.path.join(tmp_dir, "turns"), turn_schema(pa), file_format)
+    try:
+        try:
+            for record in iter_json_records(input_path):
+                key = partition_key(record)
+                conversations.write(key, [conversation_row(record)])
+                turns.write(key, turn_rows(record))
+        finally:
+            conversations.close()
+            turns.close()
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(tmp_dir, output_dir)
+        logger.info(f"Exported {conversations.rows} conversations and {turns.rows} turns from {input_path} to {output_dir}")
+        return {"conversations": conversations.rows, "turns": turns.rows}
+    except Exception as e:
+        logger.error(f"Error exporting {input_path} to {output_dir}: {str(e)}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load_table(dataset_dir, table: str = "conversations", columns: List[str] = None, filter_expression=None, file_format: str = "parquet"):
+    """
+    Read a table from an exported dataset, loading only the requested columns.
+
+    model and manipulation_type are recovered from the partition directories, and a filter
+    on them (e.g. pyarrow.dataset.field("model") == "gpt-4o") skips other partitions entirely.
+
+    Returns:
+    pyarrow.Table: The selected columns of the table.
+    """
+    pa = _import_pyarrow()
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]), flavor="hive")
+    dataset = ds.dataset(os.path.join(str(dataset_dir), table), format="ipc" if file_format == "arrow" else "parquet",
+                         partitioning=partitioning)
+    return dataset.to_table(columns=columns, filter=filter_expression)
+
+
+def list_partitions(dataset_dir, table: str = "conversations") -> List[tuple]:
+    """List the (model, manipulation_type) partitions of an exported table without opening any files."""
+    root = os.path.join(str(dataset_dir), table)
+    partitions = []
+    for model_dir in sorted(os.listdir(root)):
+        for type_dir in sorted(os.listdir(os.path.join(root, model_dir))):
+            partitions.append(tuple(unquote(part.split("=", 1)[1]) for part in (model_dir, type_dir)))
+    return partitions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export cleaned conversations to partitioned columnar tables")
+    parser.add_argument("--input", default="data/conversations.json", help="Cleaned conversations from data_cleaner (default: data/conversations.json)")
+    parser.add_argument("--output", default="data/columnar", help="Dataset directory (default: data/columnar)")
+    parser.add_argument("--format", choices=FORMATS, default="parquet", help="File format (default: parquet)")
+    args = parser.parse_args()
+
+    print(json.dumps(export_columnar(Path(args.input), Path(args.output), file_format=args.format), indent=2))
@@ -1,108 +1,239 @@
 import os
 import logging
-from typing import Dict
-import torch
-from transformers import AutoTokenizer, pipeline
-from utils.open_manipulations import get_manipulation_tactics
-from utils.generate_prompt import generate_prompts
-from utils.save_outputs import save_outputs
-from utils.open_contexts import random_context_generator
-from pprint import pprint
+import time
+from typing import Dict, List, Union
+from utils.prompt_templates import render_prompt
+from utils.response_cache import cached_completion
+from utils.streaming import SystemMessageDetector, StreamMetrics
+from utils.providers import LOCAL, Provider, register_provider
+from local_models.server import LocalModelClient
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Constants
-MODEL_ID = "meta-llama/Meta-Llama-3-8B-Instruct"
+MODEL_ID = os.getenv("LOCAL_MODEL_ID", "meta-llama/Meta-Llama-3-8B-Instruct")
+MAX_NEW_TOKENS = 1000
+TEMPERATURE = 0.7
+DEFAULT_BATCH_SIZE = 8
+# Batches generated between checkpoints
+CHECKPOINT_BATCHES = 4
 
 # get token from environment variable
 TOKEN = os.getenv("HUGGINGFACE_TOKEN")
 
-def setup_local_model():
-    logger.info(f"Initializing local model: {MODEL_ID}")
+def setup_local_model(model_id: str = MODEL_ID):
+    # Imported here so client-only runs against the local model server skip loading torch
+    import torch
+    from transformers import pipeline
+
+    logger.info(f"Initializing local model: {model_id}")
     text_generation = pipeline(
         "text-generation",
-        model=MODEL_ID,
+        model=model_id,
         model_kwargs={"torch_dtype": torch.bfloat16},
         device_map="auto",
         token=TOKEN
     )
+    # Batched generation needs a pad token; decoder-only models pad on the left
+    if text_generation.tokenizer.pad_token_id is None:
+        text_generation.tokenizer.pad_token_id = text_generation.tokenizer.eos_token_id
+    text_generation.tokenizer.padding_side = "left"
     return text_generation
 
 def create_message(prompt: str) -> Dict[str, str]:
     return {"role": "user", "content": prompt}
 
+def create_prompt_text(prompt: Dict) -> str:
+    # Convert message to a single string
+    message = create_message(render_prompt(prompt))
+    return f"user: {message['content']}"
+
+def generation_kwargs(model) -> Dict:
+    terminators = [
+        model.tokenizer.eos_token_id,
+        model.tokenizer.convert_tokens_to_ids("<|eot_id|>")
+    ]
+    return {
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "eos_token_id": [t for t in terminators if t is not None],
+        "do_sample": True,
+        "temperature": TEMPERATURE,
+        "top_p": 0.9,
+    }
+
+def create_output(prompt: Dict, generated_text: str) -> Dict:
+    result = prompt.copy()
+    result["model"] = MODEL_ID
+    result["chat_completion"] = generated_text
+    return result
+
+@cached_completion(MODEL_ID, temperature=TEMPERATURE, max_tokens=MAX_NEW_TOKENS)
 def process_prompt(model, prompt: Dict) -> Dict:
     try:
-        message = create_message(prompt["prompt"])
-        logger.info(f"Processing prompt: {prompt['prompt'][:50]}...")
-        
-        # Convert message to a single string
-        prompt_text = f"user: {message['content']}"
-        
-        terminators = [
-            model.tokenizer.eos_token_id,
-            model.tokenizer.convert_tokens_to_ids("<|eot_id|>")
-        ]
-        
-        output = model(
-            prompt_text,
-            max_new_tokens=1000,
-            eos_token_id=terminators,
-            do_sample=True,
-            temperature=0.7,
-            top_p=0.9,
-        )
-        
-        result = prompt.copy()
-        result["model"] = MODEL_ID
-        result["chat_completion"] = output[0]["generated_text"]
+        prompt_text = create_prompt_text(prompt)
+        logger.info(f"Processing prompt: {prompt_text[:50]}...")
+        output = model(prompt_text, **generation_kwargs(model))
+        result = create_output(prompt, output[0]["generated_text"])
         logger.info("Prompt processed successfully")
         return result
     except Exception as e:
         logger.error(f"Error processing prompt: {str(e)}")
         raise
 
-def run_model(n: int):
-    logger.info(f"Starting model run with n={n}")
+@cached_completion(MODEL_ID, temperature=TEMPERATURE, max_tokens=MAX_NEW_TOKENS, stream=True)
+def process_prompt_streaming(model, prompt: Dict) -> Dict:
     try:
-        context_gen = random_context_generator()
-        contexts = [next(context_gen) for _ in range(n)]
-        logger.info(f"Generated {len(contexts)} random contexts")
-        
-        manipulation_tactics = get_manipulation_tactics()
-        logger.info(f"Retrieved {len(manipulation_tactics)} manipulation tactics")
-        
-        prompts = generate_prompts(contexts=contexts, manipulation_types=manipulation_tactics, n=n)
-        logger.info(f"Generated {len(prompts)} prompts")
-        pprint(prompts)
-        
-        model = setup_local_model()
-        outputs = []
-        
-        for i, prompt in enumerate(prompts, 1):
-            output = process_prompt(model, prompt)
-            outputs.append(output)
-            
-            # Checkpoint and save every 10 outputs
-            if i % 3 == 0:
-                logger.info(f"Checkpointing and saving outputs at iteration {i}")
-                save_outputs(outputs, filename=f"outputs.json")
-                outputs = []
-            
-            # Log progress
-            if i % 3 == 0 or i == len(prompts):
-                logger.info(f"Processed {i}/{len(prompts)} prompts")
-        
-        # Save final outputs
-        save_outputs(outputs, filename="outputs.json")
-        logger.info(f"Saved final {len(outputs)} outputs")
-        logger.info("Model run completed successfully")
+        prompt_text = create_prompt_text(prompt)
+        logger.info(f"Streaming prompt: {prompt_text[:50]}...")
+        stopping_criteria = system_message_stopping_criteria(model, 1)
+        output = model(prompt_text, stopping_criteria=[stopping_criteria], **generation_kwargs(model))
+        result = create_output(prompt, output[0]["generated_text"])
+        detector = stopping_criteria.detectors[0]
+        result["generation_metrics"] = stopping_criteria.metrics.summary(detector.text, stopped_early=detector.complete)
+        logger.info("Prompt processed successfully")
+        return result
     except Exception as e:
-        logger.error(f"Error in run_model: {str(e)}")
+        logger.error(f"Error processing prompt: {str(e)}")
         raise
 
+def system_message_stopping_criteria(model, batch_size: int):
+    """
+    Build a stopping criterion that ends each sequence once its '@@@SYSTEM:' message and score are complete.
+
+    Only the generated tokens are scanned (the prompt itself mentions the marker). The
+    criterion also times the first generated token for the batch's generation metrics.
+    """
+    import torch
+    from transformers import StoppingCriteria
+
+    class SystemMessageStoppingCriteria(StoppingCriteria):
+        def __init__(self):
+            self.prompt_length = None
+            self.detectors = [SystemMessageDetector() for _ in range(batch_size)]
+            self.metrics = StreamMetrics()
+
+        def __call__(self, input_ids, scores, **kwargs):
+            if self.prompt_length is None:
+                self.prompt_length = input_ids.shape[1] - 1
+                self.metrics.on_chunk()
+            for row, detector in enumerate(self.detectors[:input_ids.shape[0]]):
+                if detector.complete:
+                    continue
+                text = model.tokenizer.decode(input_ids[row, self.prompt_length:], skip_special_tokens=True)
+                detector.feed(text[len(detector.text):])
+            return torch.tensor([d.complete for d in self.detectors[:input_ids.shape[0]]], device=input_ids.device)
+
+    return SystemMessageStoppingCriteria()
+
+def process_prompts(model, prompts: List[Dict], batch_size: int = DEFAULT_BATCH_SIZE, stream: bool = False) -> List[Dict]:
+    """
+    Generate completions for several prompts, batch_size at a time.
+
+    Cached prompts are served from the response cache. The rest are sorted by length so
+    each batch pads to a similar size, run through the pipeline together, and mapped back.
+    With stream=True each sequence stops as soon as its system message and score are
+    complete, and outputs carry generation_metrics (time to first token, tokens/sec); those
+    cut-short completions are cached apart from full ones (see process_prompt_streaming).
+
+    Returns:
+    List[Dict]: Outputs in the same order as prompts.
+    """
+    cached = process_prompt_streaming if stream else process_prompt
+    results = [cached.cache_lookup(prompt) for prompt in prompts]
+    misses = sorted((i for i, result in enumerate(results) if result is None), key=lambda i: len(render_prompt(prompts[i])))
+    kwargs = generation_kwargs(model)
+
+    for start in range(0, len(misses), batch_size):
+        group = misses[start:start + batch_size]
+        logger.info(f"Generating batch of {len(group)} prompts")
+        stopping_criteria = system_message_stopping_criteria(model, len(group)) if stream else None
+        try:
+            if stopping_criteria is not None:
+                generations = model([create_prompt_text(prompts[i]) for i in group], batch_size=len(group),
+                                    stopping_criteria=[stopping_criteria], **kwargs)
+            else:
+                generations = model([create_prompt_text(prompts[i]) for i in group], batch_size=len(group), **kwargs)
+        except Exception as e:
+            logger.error(f"Error processing batch: {str(e)}")
+            raise
+        for row, (i, generation) in enumerate(zip(group, generations)):
+            results[i] = create_output(prompts[i], generation[0]["generated_text"])
+            if stopping_criteria is not None:
+                detector = stopping_criteria.detectors[row]
+                results[i]["generation_metrics"] = stopping_criteria.metrics.summary(detector.text, stopped_early=detector.complete)
+            cached.cache_store(prompts[i], results[i])
+    return results
+
+class LocalModelProvider(Provider):
+    """Runs prompts through the local pipeline (or a local model server) in generation batches."""
+
+    def generate(self, prompts: List[Dict], on_checkpoint, batch_size: int = DEFAULT_BATCH_SIZE, server_url: str = None,
+                 stream: bool = False, **options) -> List[Dict]:
+        if server_url:
+            client = LocalModelClient(server_url)
+            logger.info(f"Using local model server at {server_url}: {client.health()}")
+            generate = lambda chunk: client.process_prompts(chunk, batch_size=batch_size, stream=stream)
+        else:
+            model = self.setup_client()
+            generate = lambda chunk: process_prompts(model, chunk, batch_size=batch_size, stream=stream)
+        chunk_size = batch_size * CHECKPOINT_BATCHES
+
+        results = []
+        for start in range(0, len(prompts), chunk_size):
+            chunk = prompts[start:start + chunk_size]
+            started = time.perf_counter()
+            outputs = generate(chunk)
+            # Prompts of a chunk are generated together, so each one waited for the whole chunk
+            latency = time.perf_counter() - started
+            for prompt, output in zip(chunk, outputs):
+                self.metrics.record_request(latency, prompt, output)
+            logger.info(f"Checkpointing and saving {len(outputs)} outputs")
+            on_checkpoint(outputs)
+            results.extend(outputs)
+            logger.info(f"Processed {start + len(outputs)}/{len(prompts)} prompts")
+        return results
+
+PROVIDER = register_provider(LocalModelProvider("llama7b", MODEL_ID, setup_local_model, process_prompt=process_prompt,
+                                                 process_prompt_streaming=process_prompt_streaming, mode=LOCAL,
+                                                 api_key_env="HUGGINGFACE_TOKEN"))
+
+def run_model(n: int, resume: str = None, batch_size: int = DEFAULT_BATCH_SIZE, server_url: str = None, stream: bool = False, quota: Union[int, Dict] = None, seed: int = None):
+    return PROVIDER.run(n, resume=resume, quota=quota, seed=seed, batch_size=batch_size, server_url=server_url, stream=stream)
+
+def benchmark(model_id: str, n: int, batch_sizes: List[int]) -> Dict[int, float]:
+    """
+    Time generation of n synthetic prompts at each batch size, bypassing the response cache.
+
+    Use a tiny model (e.g. LOCAL_MODEL_ID=sshleifer/tiny-gpt2) to compare batch sizes on CPU.
+
+    Returns:
+    Dict[int, float]: Prompts per second for each batch size.
+    """
+    from utils.response_cache import set_cache_enabled
+    set_cache_enabled(False)
+    model = setup_local_model(model_id)
+    prompts = [{"prompt": "Talk about option " + "A " * (i % 17)} for i in range(n)]
+    rates = {}
+    for batch_size in batch_sizes:
+        started = time.perf_counter()
+        process_prompts(model, prompts, batch_size=batch_size)
+        rates[batch_size] = n / (time.perf_counter() - started)
+        logger.info(f"batch_size={batch_size}: {rates[batch_size]:.2f} prompts/sec")
+    return rates
+
 
 if __name__ == "__main__":
-    run_model(5)  # Example: Run the model with 5 prompts
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run or benchmark the local model")
+    parser.add_argument("-n", type=int, default=5, help="Number of prompts (default: 5)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help=f"Prompts per generation batch (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--benchmark", nargs="*", type=int, metavar="BATCH_SIZE", help="Benchmark these batch sizes instead of running")
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        benchmark(MODEL_ID, args.n, args.benchmark or [1, args.batch_size])
+    else:
+        run_model(args.n, batch_size=args.batch_size)
@@ -0,0 +1,131 @@
+import json
+import logging
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_SERVER_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+
+
+class LocalModelServer(ThreadingHTTPServer):
+    """
+    Long-lived HTTP worker that keeps the local model resident between runs.
+
+    GET /health reports the loaded model; POST /generate takes
+    {"prompts": [...], "batch_size": n, "stream": bool} and returns {"outputs": [...]}
+    from local_models.llama3_7b.process_prompts. Requests are
+    accepted concurrently but generation is serialized on a lock, one batch run at a time.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, model, model_id: str):
+        super().__init__(address, LocalModelHandler)
+        self.model = model
+        self.model_id = model_id
+        self.generate_lock = threading.Lock()
+
+
+class LocalModelHandler(BaseHTTPRequestHandler):
+    server: LocalModelServer
+
+    def _send_json(self, status: int, body: Dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "model": self.server.model_id})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        from local_models.llama3_7b import process_prompts, DEFAULT_BATCH_SIZE
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            prompts = request["prompts"]
+            batch_size = int(request.get("batch_size", DEFAULT_BATCH_SIZE))
+            stream = bool(request.get("stream", False))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Invalid request: {str(e)}"})
+            return
+
+        try:
+            with self.server.generate_lock:
+                outputs = process_prompts(self.server.model, prompts, batch_size=batch_size, stream=stream)
+        except Exception as e:
+            logger.error(f"Error generating {len(prompts)} prompts: {str(e)}")
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {"outputs": outputs})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+class LocalModelClient:
+    """Client for a running LocalModelServer; stands in for the pipeline in run_model."""
+
+    def __init__(self, url: str = DEFAULT_SERVER_URL, timeout: float = None):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path: str, body: Dict = None) -> Dict:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            message = json.loads(e.read() or b"{}").get("error", e.reason)
+            logger.error(f"Local model server returned {e.code}: {message}")
+            raise RuntimeError(f"Local model server error: {message}")
+        except urllib.error.URLError as e:
+            logger.error(f"Could not reach local model server at {self.url}: {e.reason}")
+            raise ConnectionError(f"Local model server not reachable at {self.url}; start it with 'python -m local_models.server'")
+
+    def health(self) -> Dict:
+        return self._request("/health")
+
+    def process_prompts(self, prompts: List[Dict], batch_size: int, stream: bool = False) -> List[Dict]:
+        return self._request("/generate", {"prompts": prompts, "batch_size": batch_size, "stream": stream})["outputs"]
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    from local_models.llama3_7b import setup_local_model, MODEL_ID
+
+    model = setup_local_model()
+    server = LocalModelServer((host, port), model, MODEL_ID)
+    logger.info(f"Local model server for {MODEL_ID} listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down local model server")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Keep the local model loaded and serve generation requests")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to bind (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    args = parser.parse_args()
+    serve(args.host, args.port)
@@ -4,10 +4,16 @@ from dotenv import load_dotenv
 import os
 import logging
 
+# Before the utils imports: the store, cache, index, dedup and metrics settings are read
+# from the environment when those modules are imported
+load_dotenv()
 
-from apis.openai_api import run_model as openai_run_model
-from apis.google_api import run_model as google_run_model
-from apis.anthropic_api import run_model as anthropic_run_model
+# Backend modules (and their SDKs) are imported by get_provider once a backend is chosen
+from utils.providers import API, LOCAL, get_provider, list_providers
+from utils.fanout import run_fanout
+from utils.response_cache import set_cache_enabled
+from utils.generate_prompt import load_targets
+from utils.dedup import set_dedup_enabled
 
 
 
@@ -36,9 +42,9 @@ def get_integer_input(prompt, min_value=1):
         except ValueError:
             logger.warning("Invalid input. Please enter a valid integer.")
 
-def load_env_variables():
-    load_dotenv()
-    required_vars = ['HUGGINGFACE_TOKEN', 'ANTHROPIC_API_KEY', 'GOOGLE_API_KEY', 'OPENAI_API_KEY']
+def load_env_variables(models):
+    # Only the credentials of the chosen backends are required
+    required_vars = sorted({get_provider(model).api_key_env for model in models} - {None})
     missing_vars = [var for var in required_vars if os.getenv(var) is None]
     if missing_vars:
         logger.error(f"The following required environment variables are missing: {', '.join(missing_vars)}")
@@ -51,75 +57,123 @@ def main():
     mode_group = parser.add_mutually_exclusive_group()
     mode_group.add_argument("--api", action="store_true", help="Use API mode")
     mode_group.add_argument("--local", action="store_true", help="Use local mode")
+    mode_group.add_argument("--fanout", nargs="+", metavar="MODEL", help="Generate one prompt plan with several models (API and local) in parallel")
     
     parser.add_argument("--model", help="Select model")
     parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], help="Set the logging level")
     parser.add_argument("-n", type=int, default=1, help="Custom parameter (default: 1)")
+    parser.add_argument("--batch", action="store_true", help="Submit the prompts through the provider's batch API (gpt4, claude, fake)")
+    parser.add_argument("--batch-job", help="Resume tracking and collecting an already submitted batch job")
+    parser.add_argument("--poll-interval", type=float, default=60, help="Seconds between batch job status checks (default: 60)")
+    parser.add_argument("--resume", metavar="RUN_ID", help="Resume an interrupted run, dispatching only its unfinished prompts")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model instead of replaying cached responses")
+    parser.add_argument("--no-dedup", action="store_true", help="Dispatch prompts even if they repeat one already planned or stored for the model")
+    parser.add_argument("--batch-size", type=int, default=8, help="Prompts per generation batch for local models (default: 8)")
+    parser.add_argument("--server", nargs="?", const="http://127.0.0.1:8765", metavar="URL", help="With --local, use a running local model server (python -m local_models.server) instead of loading the model")
+    parser.add_argument("--stream", action="store_true", help="Stream responses, stop once the @@@SYSTEM message and score are complete, and record time-to-first-token and tokens/sec")
+    parser.add_argument("--max-concurrency", type=int, default=1, help="Maximum number of API requests in flight at once (default: 1)")
+    parser.add_argument("--provider-concurrency", nargs="+", default=[], metavar="MODEL=N", help="With --fanout, per-model limits overriding --max-concurrency")
+    parser.add_argument("--seed", type=int, help="Seed for prompt sampling; reruns with the same seed build the same prompts and hit the response cache")
+    quota_group = parser.add_mutually_exclusive_group()
+    quota_group.add_argument("--per-cell", type=int, help="Plan prompts to bring every (category, tactic, outcome) cell of the model up to this many outputs; ignores -n")
+    quota_group.add_argument("--targets", help="JSON file of per-cell target counts to plan prompts from (see utils.generate_prompt.load_targets); ignores -n")
     
     args = parser.parse_args()
-    
+
+    api_models = list_providers(API)
+    local_models = list_providers(LOCAL)
     if args.api:
-        if args.model not in ["claude", "gemini", "gpt4", "huggingface"]:
-            parser.error("When using --api, --model must be one of: claude, gemini, gpt4, huggingface")
+        if args.model not in api_models:
+            parser.error(f"When using --api, --model must be one of: {', '.join(api_models)}")
     elif args.local:
-        if args.model not in ["llama7b", "Falcon"]:
-            parser.error("When using --local, --model must be one of: llama7b, Falcon")
+        if args.model not in local_models:
+            parser.error(f"When using --local, --model must be one of: {', '.join(local_models)}")
+    elif args.fanout:
+        unknown = [model for model in args.fanout if model not in api_models + local_models]
+        if unknown:
+            parser.error(f"Unknown --fanout models: {', '.join(unknown)}; choose from {', '.join(api_models + local_models)}")
+        duplicates = sorted({model for model in args.fanout if args.fanout.count(model) > 1})
+        if duplicates:
+            parser.error(f"--fanout models must be distinct; repeated: {', '.join(duplicates)}")
+        if args.batch or args.batch_job or args.per_cell is not None or args.targets:
+            parser.error("--fanout cannot be combined with --batch, --per-cell or --targets")
     else:
-        parser.error("Either --api or --local must be specified")
+        parser.error("Either --api, --local or --fanout must be specified")
+    concurrency = {}
+    for limit in args.provider_concurrency:
+        model, _, value = limit.partition("=")
+        if not value.isdigit() or int(value) < 1:
+            parser.error(f"--provider-concurrency expects MODEL=N with N at least 1, got {limit}")
+        if model not in (args.fanout or []):
+            parser.error(f"--provider-concurrency model {model} is not one of the --fanout models")
+        concurrency[model] = int(value)
+    if (args.batch or args.batch_job) and not args.fanout and not get_provider(args.model).supports_batch:
+        batch_models = [name for name in api_models if get_provider(name).supports_batch]
+        parser.error(f"--batch is only available with --api and --model {' or '.join(batch_models)}")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.max_concurrency < 1:
+        parser.error("--max-concurrency must be at least 1")
+    if args.per_cell is not None and args.per_cell < 1:
+        parser.error("--per-cell must be at least 1")
+    if args.resume and (args.per_cell is not None or args.targets):
+        parser.error("--per-cell and --targets plan a new run and cannot be combined with --resume")
 
     global logger
     logger = setup_logging(args.log_level)
 
-    load_env_variables()
+    if args.no_cache:
+        set_cache_enabled(False)
+    if args.no_dedup:
+        set_dedup_enabled(False)
 
     if len(sys.argv) == 1:
         logger.info("Welcome to the interactive configuration mode.")
         mode = get_input("Choose mode (api/local): ", ["api", "local"])
         if mode == "api":
-            model = get_input("Choose API model (claude/gemini/gpt4/huggingface): ", ["claude", "gemini", "gpt4", "huggingface"])
+            model = get_input(f"Choose API model ({'/'.join(api_models)}): ", api_models)
+        else:
+            model = get_input(f"Choose local model ({'/'.join(local_models)}): ", local_models)
         n = get_integer_input("Enter the value for n: ")
     else:
-        mode = "api" if args.api else "local"
-        model = args.model if args.api else None
+        mode = "api" if args.api else ("local" if args.local else "fanout")
+        model = args.model
         n = args.n
 
+    load_env_variables(args.fanout if mode == "fanout" else [model])
+
+    if mode == "fanout":
+        logger.info(f"Fanning out to: {', '.join(args.fanout)}")
+        logger.info(f"Value of n: {n}")
+        run_fanout(args.fanout, n, seed=args.seed, resume=args.resume, concurrency=concurrency, max_concurrency=args.max_concurrency,
+                   stream=args.stream, batch_size=args.batch_size, server_url=args.server)
+        return
+
     logger.info(f"Selected mode: {mode}")
-    if mode == "api":
-        logger.info(f"Selected model: {model}")
-    if mode == "local":
-        logger.info("Running a local model")
+    logger.info(f"Selected model: {model}")
 
     logger.info(f"Value of n: {n}")
 
-    if mode == "api" and model:
-        api_key_map = {
-            "claude": ("ANTHROPIC_API_KEY", "Anthropic"),
-            "gemini": ("GOOGLE_API_KEY", "Google"),
-            "gpt4": ("OPENAI_API_KEY", "OpenAI"),
-            "huggingface": ("HUGGINGFACE_TOKEN", "Hugging Face")
-        }
-        env_var, provider = api_key_map[model]
-        api_key = os.getenv(env_var)
+    quota = args.per_cell if args.per_cell is not None else (load_targets(args.targets) if args.targets else None)
+
+    provider = get_provider(model)
+    if provider.api_key_env:
+        api_key = os.getenv(provider.api_key_env)
         if api_key:
-            logger.info(f"Using {provider} API key")
-            logger.debug(f"{provider} API key: {api_key[:8]}...")
+            logger.info(f"Using {provider.api_key_env}")
+            logger.debug(f"{provider.api_key_env}: {api_key[:8]}...")
         else:
-            logger.error(f"{provider} API key not found in environment variables.")
-
-        if model == "gpt4":
-            openai_run_model(n)
-        if model == "gemini":
-            google_run_model(n)
-        if model == "claude":
-            anthropic_run_model(n)
-            
-
-    if mode == "local":
-        if args.model == "llama7b":
-            from local_models.llama3_7b import run_model as llama_run_model 
-            llama_run_model(n)
-        
-    
+            logger.error(f"{provider.api_key_env} not found in environment variables.")
+
+    if args.batch or args.batch_job:
+        provider.run_batch(n, job_id=args.batch_job, poll_interval=args.poll_interval, quota=quota, seed=args.seed)
+        return
+
+    if mode == "api":
+        provider.run(n, resume=args.resume, quota=quota, seed=args.seed, max_concurrency=args.max_concurrency, stream=args.stream)
+    else:
+        provider.run(n, resume=args.resume, quota=quota, seed=args.seed, batch_size=args.batch_size, server_url=args.server, stream=args.stream)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
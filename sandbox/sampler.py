@@ -1,34 +1,222 @@
+import argparse
 import json
+import math
+import os
 import random
+from concurrent.futures import ProcessPoolExecutor
 
 # Input and output file paths
 input_file = '../data/comments.jsonl'
 output_file = '../data/sampled_comments.json'
 
-# Read the JSONL file and store all entries
-entries = []
-with open(input_file, 'r') as file:
-    for line in file:
-        entry = json.loads(line)
-        # Extract only the required fields
-        filtered_entry = {
-            'id': entry['id'],
-            'persuasiveness': entry['persuasiveness'],
-            'comments': []
+SAMPLE_SIZE = 200
+CHUNK_BYTES = 64 << 20
+
+
+def filter_entry(entry):
+    # Extract only the required fields
+    filtered_entry = {
+        'id': entry['id'],
+        'persuasiveness': entry['persuasiveness'],
+        'comments': []
+    }
+    for comment in entry['comments']:
+        filtered_comment = {
+            'preprocessed_comment': comment.get('preprocessed_comment'),
+            'comment_frames': comment.get('comment_frames')
         }
-        for comment in entry['comments']:
-            filtered_comment = {
-                'preprocessed_comment': comment.get('preprocessed_comment'),
-                'comment_frames': comment.get('comment_frames')
-            }
-            filtered_entry['comments'].append(filtered_comment)
-        entries.append(filtered_entry)
-
-# Sample 200 random entries
-sampled_entries = random.sample(entries, min(200, len(entries)))
-
-# Write the sampled entries to a new JSON file
-with open(output_file, 'w') as file:
-    json.dump(sampled_entries, file, indent=2)
-
-print(f"Sampled {len(sampled_entries)} entries and saved to {output_file}")
+        filtered_entry['comments'].append(filtered_comment)
+    return filtered_entry
+
+
+class Reservoir:
+    """
+    Uniform sample of up to size items from a stream of unknown length (Li's Algorithm L).
+
+    Call accepts() once per item; only when it returns True does the item need to be built
+    and passed to keep(). After the reservoir fills, the gap to the next kept item is drawn
+    directly, so most items cost one comparison and are never parsed.
+    """
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+        self._weight = math.exp(math.log(self._uniform()) / size)
+        self._next = size + self._gap()
+
+    def _uniform(self):
+        # In (0, 1), so both logarithms below are defined
+        u = self.rng.random()
+        while u == 0.0:
+            u = self.rng.random()
+        return u
+
+    def _gap(self):
+        return math.floor(math.log(self._uniform()) / math.log(1 - self._weight))
+
+    def accepts(self):
+        index = self.seen
+        self.seen += 1
+        return index < self.size or index == self._next
+
+    def keep(self, item):
+        if len(self.items) < self.size:
+            self.items.append(item)
+            return
+        self.items[self.rng.randrange(self.size)] = item
+        self._weight *= math.exp(math.log(self._uniform()) / self.size)
+        self._next += self._gap() + 1
+
+
+def merge_samples(first, second, size, rng):
+    """
+    Merge two uniform samples, each given as (population count, items), into one of up to size items.
+
+    Each pick comes from a side with probability proportional to its unpicked population,
+    which splits the merged sample between the sides as sampling the union would.
+    """
+    (first_count, first_items), (second_count, second_items) = first, second
+    remaining_first, remaining_second = first_count, second_count
+    from_first = 0
+    for _ in range(min(size, first_count + second_count)):
+        if rng.random() * (remaining_first + remaining_second) < remaining_first:
+            from_first += 1
+            remaining_first -= 1
+        else:
+            remaining_second -= 1
+    from_second = min(size, first_count + second_count) - from_first
+    return first_count + second_count, rng.sample(first_items, from_first) + rng.sample(second_items, from_second)
+
+
+def chunk_ranges(path, chunk_bytes=CHUNK_BYTES):
+    size = os.path.getsize(path)
+    return [(start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)] or [(0, 0)]
+
+
+def iter_lines(path, start, end):
+    """Yield the non-blank lines that begin within [start, end) of a file."""
+    with open(path, 'rb') as file:
+        if start > 0:
+            # Skip the line running into this chunk; the previous chunk owns it
+            file.seek(start - 1)
+            file.readline()
+        while file.tell() < end:
+            line = file.readline()
+            if not line:
+                break
+            if line.strip():
+                yield line
+
+
+def sample_chunk(path, start, end, size, stratify, seed):
+    """
+    Reservoir-sample the lines of one byte range.
+
+    Returns:
+    dict: (line count, sampled entries) per persuasiveness value, or under None when not
+    stratifying. Unstratified, only the lines that end up sampled are parsed.
+    """
+    rng = random.Random(seed)
+    reservoirs = {}
+    for line in iter_lines(path, start, end):
+        if stratify:
+            entry = json.loads(line)
+            stratum = entry.get('persuasiveness')
+            reservoir = reservoirs.get(stratum)
+            if reservoir is None:
+                reservoir = reservoirs[stratum] = Reservoir(size, rng)
+            if reservoir.accepts():
+                reservoir.keep(filter_entry(entry))
+        else:
+            reservoir = reservoirs.get(None)
+            if reservoir is None:
+                reservoir = reservoirs[None] = Reservoir(size, rng)
+            if reservoir.accepts():
+                reservoir.keep(line)
+    if not stratify and None in reservoirs:
+        reservoirs[None].items = [filter_entry(json.loads(line)) for line in reservoirs[None].items]
+    return {stratum: (reservoir.seen, reservoir.items) for stratum, reservoir in reservoirs.items()}
+
+
+def allocate(counts, size, allocation):
+    """Sample size per stratum: split evenly, or in proportion to stratum counts (largest remainders)."""
+    strata = sorted(counts, key=str)
+    if allocation == 'equal':
+        shares = {stratum: size / len(strata) for stratum in strata}
+    else:
+        total = sum(counts.values())
+        shares = {stratum: size * counts[stratum] / total for stratum in strata}
+    sizes = {stratum: math.floor(share) for stratum, share in shares.items()}
+    for stratum in sorted(strata, key=lambda s: shares[s] - sizes[s], reverse=True)[:size - sum(sizes.values())]:
+        sizes[stratum] += 1
+    return {stratum: min(sizes[stratum], counts[stratum]) for stratum in strata}
+
+
+def sample_jsonl(path, size=SAMPLE_SIZE, stratify=False, allocation='proportional', workers=None, chunk_bytes=CHUNK_BYTES, seed=None):
+    """
+    Sample size entries from a JSONL file in one pass, with memory bounded by the sample size.
+
+    The file is split into byte ranges that are sampled in parallel, each with its own
+    reservoir (one per persuasiveness value when stratifying), and the per-range samples
+    are merged. Stratified samples take size entries in total, split across persuasiveness
+    values evenly or in proportion to how common each value is.
+
+    Returns:
+    tuple: The sampled entries in random order, and the number of lines per stratum.
+    """
+    rng = random.Random(seed)
+    ranges = chunk_ranges(path, chunk_bytes)
+    seeds = [rng.getrandbits(64) for _ in ranges]
+    workers = workers or os.cpu_count() or 1
+    args = [(path, start, end, size, stratify, chunk_seed) for (start, end), chunk_seed in zip(ranges, seeds)]
+    if workers <= 1 or len(ranges) == 1:
+        chunk_samples = (sample_chunk(*chunk_args) for chunk_args in args)
+        return _combine(chunk_samples, size, stratify, allocation, rng)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunk_samples = executor.map(sample_chunk, *zip(*args))
+        return _combine(chunk_samples, size, stratify, allocation, rng)
+
+
+def _combine(chunk_samples, size, stratify, allocation, rng):
+    merged = {}
+    for samples in chunk_samples:
+        for stratum, sample in samples.items():
+            merged[stratum] = merge_samples(merged[stratum], sample, size, rng) if stratum in merged else sample
+    counts = {stratum: count for stratum, (count, _) in merged.items()}
+    if not merged:
+        return [], counts
+    sizes = allocate(counts, size, allocation) if stratify else {None: min(size, counts[None])}
+    entries = []
+    for stratum, (_, items) in merged.items():
+        entries.extend(rng.sample(items, sizes[stratum]))
+    rng.shuffle(entries)
+    return entries, counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sample entries from a JSONL file in one streaming pass")
+    parser.add_argument("--input", default=input_file, help=f"JSONL file (default: {input_file})")
+    parser.add_argument("--output", default=output_file, help=f"JSON file for the sample (default: {output_file})")
+    parser.add_argument("-k", type=int, default=SAMPLE_SIZE, help=f"Number of entries to sample (default: {SAMPLE_SIZE})")
+    parser.add_argument("--stratify", action="store_true", help="Sample within each persuasiveness value")
+    parser.add_argument("--allocation", choices=["proportional", "equal"], default="proportional",
+                        help="With --stratify, split the sample across values in proportion to their frequency or evenly (default: proportional)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count; 1 disables the pool)")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES >> 20, help=f"Megabytes of input per parallel chunk (default: {CHUNK_BYTES >> 20})")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    if args.k < 1:
+        parser.error("-k must be at least 1")
+
+    sampled_entries, counts = sample_jsonl(args.input, args.k, stratify=args.stratify, allocation=args.allocation,
+                                           workers=args.workers, chunk_bytes=args.chunk_mb << 20, seed=args.seed)
+
+    # Write the sampled entries to a new JSON file
+    with open(args.output, 'w') as file:
+        json.dump(sampled_entries, file, indent=2)
+
+    if args.stratify:
+        print(f"Lines per persuasiveness value: {json.dumps({str(stratum): count for stratum, count in counts.items()})}")
+    print(f"Sampled {len(sampled_entries)} entries and saved to {args.output}")
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from local_models import llama3_7b
+from utils import response_cache
+from utils.streaming import StreamMetrics, SystemMessageDetector
+
+FULL_TEXT = "@@@USER: Hi\n@@@AGENT: Hello\n@@@SYSTEM: Score: 7\n@@@USER: Thanks again!"
+
+
+class FakeTokenizer:
+    eos_token_id = 0
+
+    def convert_tokens_to_ids(self, token):
+        return None
+
+
+class FakePipeline:
+    """Stands in for the transformers pipeline; stops after the score line when given stopping criteria."""
+
+    tokenizer = FakeTokenizer()
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, texts, stopping_criteria=None, **kwargs):
+        self.calls += 1
+        if stopping_criteria:
+            for detector in stopping_criteria[0].detectors:
+                detector.feed(FULL_TEXT + "\n")
+            return [[{"generated_text": detector.result()}] for detector in stopping_criteria[0].detectors]
+        return [[{"generated_text": FULL_TEXT}] for _ in texts]
+
+
+class FakeStoppingCriteria:
+    def __init__(self, batch_size):
+        self.detectors = [SystemMessageDetector() for _ in range(batch_size)]
+        self.metrics = StreamMetrics()
+
+
+class LocalModelCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        cache = response_cache.ResponseCache(os.path.join(self.directory.name, "responses.sqlite"))
+        self.addCleanup(cache.connection.close)
+        patches = [
+            mock.patch.object(response_cache, "_cache", cache),
+            mock.patch.object(response_cache, "_cache_enabled", True),
+            mock.patch.object(llama3_7b, "system_message_stopping_criteria",
+                              lambda model, batch_size: FakeStoppingCriteria(batch_size)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.prompts = [{"id": "a", "prompt": "Talk about option A"}]
+
+    def test_streamed_completion_is_not_served_to_full_run(self):
+        model = FakePipeline()
+        streamed = llama3_7b.process_prompts(model, self.prompts, stream=True)[0]
+        full = llama3_7b.process_prompts(model, self.prompts, stream=False)[0]
+
+        self.assertEqual(model.calls, 2)
+        self.assertTrue(streamed["generation_metrics"]["stopped_early"])
+        self.assertNotIn("Thanks again", streamed["chat_completion"])
+        self.assertEqual(full["chat_completion"], FULL_TEXT)
+
+    def test_each_mode_is_served_from_its_own_cache(self):
+        model = FakePipeline()
+        llama3_7b.process_prompts(model, self.prompts, stream=True)
+        llama3_7b.process_prompts(model, self.prompts, stream=False)
+        streamed = llama3_7b.process_prompts(model, self.prompts, stream=True)[0]
+        full = llama3_7b.process_prompts(model, self.prompts, stream=False)[0]
+
+        self.assertEqual(model.calls, 2)
+        self.assertNotIn("Thanks again", streamed["chat_completion"])
+        self.assertEqual(full["chat_completion"], FULL_TEXT)
+
+
+if __name__ == "__main__":
+    unittest.main()
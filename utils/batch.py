@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from utils.save_outputs import CONVERSATIONS_PATH, save_outputs
+
+logger = logging.getLogger(__name__)
+
+BATCHES_PATH = os.path.join(CONVERSATIONS_PATH, "batches")
+DEFAULT_POLL_INTERVAL = 60
+SAVE_CHUNK_SIZE = 100
+
+# Normalized job states returned by BatchBackend.poll
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class BatchBackend:
+    """
+    Provider side of a batch job: build one request per prompt, submit the request file,
+    report the job state and stream back (custom_id, completion, error) results.
+    """
+
+    name = "batch"
+    model_name = None
+
+    def build_request(self, custom_id: str, prompt: Dict) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def submit(self, requests_path: str) -> str:
+        raise NotImplementedError
+
+    def poll(self, job_id: str) -> str:
+        raise NotImplementedError
+
+    def results(self, job_id: str) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+        raise NotImplementedError
+
+
+def get_job_path(job_id: str) -> str:
+    return os.path.join(BATCHES_PATH, f"{job_id}.json")
+
+
+def save_job(job: Dict[str, Any]):
+    with open(get_job_path(job["job_id"]), 'w') as f:
+        json.dump(job, f, indent=4)
+
+
+def load_job(job_id: str) -> Dict[str, Any]:
+    job_path = get_job_path(job_id)
+    try:
+        with open(job_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.error(f"No batch job record found at {job_path}")
+        raise
+
+
+def write_batch_files(backend: BatchBackend, prompts: List[Dict], name: str) -> Tuple[str, str]:
+    """
+    Write the provider submission file and a sidecar file holding the prompt records.
+
+    Returns:
+    Tuple[str, str]: Paths of the requests file and the prompts file.
+    """
+    requests_path = os.path.join(BATCHES_PATH, f"{name}.requests.jsonl")
+    prompts_path = os.path.join(BATCHES_PATH, f"{name}.prompts.jsonl")
+    with open(requests_path, 'w') as requests_file, open(prompts_path, 'w') as prompts_file:
+        for prompt in prompts:
+            if not prompt.get("id"):
+                prompt["id"] = str(uuid.uuid4())
+            requests_file.write(json.dumps(backend.build_request(prompt["id"], prompt)) + "\n")
+            prompts_file.write(json.dumps(prompt) + "\n")
+    logger.info(f"Wrote {len(prompts)} batch requests to {requests_path}")
+    return requests_path, prompts_path
+
+
+def submit_batch(backend: BatchBackend, prompts: List[Dict]) -> Dict[str, Any]:
+    """Write the submission file for prompts, submit it and persist the job record."""
+    os.makedirs(BATCHES_PATH, exist_ok=True)
+    name = f"{backend.name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    requests_path, prompts_path = write_batch_files(backend, prompts, name)
+
+    job_id = backend.submit(requests_path)
+    job = {
+        "job_id": job_id,
+        "backend": backend.name,
+        "model": backend.model_name,
+        "requests_path": requests_path,
+        "prompts_path": prompts_path,
+        "num_prompts": len(prompts),
+        "status": IN_PROGRESS,
+        "submitted_at": time.time(),
+    }
+    save_job(job)
+    logger.info(f"Submitted batch job {job_id} with {len(prompts)} prompts")
+    return job
+
+
+def wait_for_batch(backend: BatchBackend, job: Dict[str, Any], poll_interval: float = DEFAULT_POLL_INTERVAL,
+                   timeout: Optional[float] = None) -> str:
+    """
+    Poll the job until it reaches a terminal state, recording the state in the job file.
+
+    Raises:
+    TimeoutError: If timeout seconds pass before the job finishes.
+    """
+    started = time.monotonic()
+    while True:
+        status = backend.poll(job["job_id"])
+        if status != job["status"]:
+            job["status"] = status
+            save_job(job)
+        if status != IN_PROGRESS:
+            logger.info(f"Batch job {job['job_id']} finished with status: {status}")
+            return status
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch job {job['job_id']} still running after {timeout}s")
+        logger.info(f"Batch job {job['job_id']} in progress; checking again in {poll_interval}s")
+        time.sleep(poll_interval)
+
+
+def collect_batch(backend: BatchBackend, job: Dict[str, Any], chunk_size: int = SAVE_CHUNK_SIZE) -> int:
+    """
+    Stream the results of a finished job into save_outputs, chunk_size records at a time.
+
+    Returns:
+    int: The number of outputs saved. Failed requests are logged and skipped.
+    """
+    prompts = {}
+    with open(job["prompts_path"], 'r') as f:
+        for line in f:
+            prompt = json.loads(line)
+            prompts[prompt["id"]] = prompt
+
+    saved = 0
+    failed = 0
+    chunk = []
+    for custom_id, completion, error in backend.results(job["job_id"]):
+        if error is not None or custom_id not in prompts:
+            failed += 1
+            logger.warning(f"Batch request {custom_id} failed: {error or 'unknown custom_id'}")
+            continue
+        output = prompts[custom_id].copy()
+        output["model"] = backend.model_name
+        output["chat_completion"] = completion
+        chunk.append(output)
+        if len(chunk) >= chunk_size:
+            save_outputs(chunk)
+            saved += len(chunk)
+            chunk = []
+    if chunk:
+        save_outputs(chunk)
+        saved += len(chunk)
+
+    job["status"] = "collected"
+    job["saved"] = saved
+    job["failed"] = failed
+    save_job(job)
+    logger.info(f"Collected batch job {job['job_id']}: {saved} saved, {failed} failed")
+    return saved
+
+
+def run_batch(backend: BatchBackend, prompts: Optional[List[Dict]] = None, job_id: Optional[str] = None,
+              poll_interval: float = DEFAULT_POLL_INTERVAL) -> int:
+    """
+    Submit prompts as a batch job (or pick up the existing job_id), wait for it and collect the results.
+
+    Returns:
+    int: The number of outputs saved.
+    """
+    if job_id:
+        job = load_job(job_id)
+        logger.info(f"Resuming batch job {job_id} (status: {job['status']})")
+        if job["status"] == "collected":
+            logger.info(f"Batch job {job_id} was already collected")
+            return job.get("saved", 0)
+    elif not prompts:
+        logger.info("No prompts to submit; skipping the batch job")
+        return 0
+    else:
+        job = submit_batch(backend, prompts)
+
+    status = wait_for_batch(backend, job, poll_interval=poll_interval)
+    if status == FAILED:
+        raise RuntimeError(f"Batch job {job['job_id']} failed")
+    return collect_batch(backend, job)
@@ -0,0 +1,166 @@
+import heapq
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional
+from utils.rate_limit import RateLimiter, RetryPolicy, get_retry_after, is_throttled
+from utils.telemetry import ProviderMetrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 1
+DEFAULT_CHECKPOINT_EVERY = 3
+
+
+def run_prompts(
+    process_fn: Callable[[Any, Dict], Dict],
+    client: Any,
+    prompts: List[Dict],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    on_checkpoint: Optional[Callable[[List[Dict]], None]] = None,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+    rate_limiter: Optional[RateLimiter] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    metrics: Optional[ProviderMetrics] = None,
+) -> List[Dict]:
+    """
+    Run process_fn(client, prompt) over prompts with at most max_concurrency requests in flight.
+
+    Every prompt is given an id before dispatch, so the output keeps the id of the prompt
+    that produced it. Completed outputs are released in prompt order: as soon as every
+    earlier prompt has finished, they are handed to on_checkpoint once at least
+    checkpoint_every are ready, so results reach disk while the rest of the run is still going.
+
+    With a rate_limiter, each call first waits for room in the provider's budget. With a
+    retry_policy, transient errors (429s, timeouts, 5xx) put the prompt on a retry queue
+    with a jittered backoff instead of failing the run; the worker moves on meanwhile.
+    With metrics, every call's latency, tokens and outcome (and every retry) is recorded.
+
+    Args:
+    process_fn (Callable): The provider's process_prompt function.
+    client (Any): The provider client passed through to process_fn.
+    prompts (List[Dict]): Prompts as returned by generate_prompts.
+    max_concurrency (int): Maximum number of prompts processed at the same time.
+    on_checkpoint (Callable, optional): Called with each batch of completed outputs.
+    checkpoint_every (int): Minimum number of outputs per checkpoint batch.
+    rate_limiter (RateLimiter, optional): Shared requests/tokens budget for the provider.
+    retry_policy (RetryPolicy, optional): Backoff policy for transient errors.
+    metrics (ProviderMetrics, optional): Telemetry of the provider.
+
+    Returns:
+    List[Dict]: The outputs, in the same order as prompts.
+
+    Raises:
+    ValueError: If max_concurrency or checkpoint_every is less than 1.
+    Exception: The first non-retryable error raised by process_fn (or a transient one once
+    its retries are exhausted). No further prompts are started and every output that
+    did complete is still checkpointed.
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+    if checkpoint_every < 1:
+        raise ValueError("checkpoint_every must be at least 1")
+
+    for prompt in prompts:
+        if not prompt.get("id"):
+            prompt["id"] = str(uuid.uuid4())
+
+    total = len(prompts)
+    results: List[Optional[Dict]] = [None] * total
+    pending_batch: List[Dict] = []
+    next_to_emit = 0
+
+    def emit_ready(force: bool = False, skip_gaps: bool = False):
+        nonlocal next_to_emit
+        while next_to_emit < total and (results[next_to_emit] is not None or skip_gaps):
+            if results[next_to_emit] is not None:
+                pending_batch.append(results[next_to_emit])
+            next_to_emit += 1
+        if on_checkpoint and pending_batch and (force or len(pending_batch) >= checkpoint_every):
+            logger.info(f"Checkpointing {len(pending_batch)} outputs ({next_to_emit}/{total} done)")
+            on_checkpoint(list(pending_batch))
+            pending_batch.clear()
+
+    cache_lookup = getattr(process_fn, "cache_lookup", None)
+
+    def call(prompt: Dict) -> Dict:
+        # Serve response cache hits before they take any rate limit budget
+        if cache_lookup is not None:
+            output = cache_lookup(prompt)
+            if output is not None:
+                if metrics is not None:
+                    metrics.record_cache_hit()
+                return output
+        if rate_limiter is not None:
+            rate_limiter.acquire(rate_limiter.estimate_tokens(prompt))
+        started = time.perf_counter()
+        try:
+            output = process_fn.cache_fill(client, prompt) if cache_lookup is not None else process_fn(client, prompt)
+        except Exception:
+            if metrics is not None:
+                metrics.record_error(time.perf_counter() - started)
+            raise
+        if metrics is not None:
+            metrics.record_request(time.perf_counter() - started, prompt, output)
+        return output
+
+    logger.info(f"Processing {total} prompts with max concurrency {max_concurrency}")
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="prompt")
+    futures = {}
+    attempts = [0] * total
+    retry_queue = []  # heap of (ready_at, index)
+    try:
+        for i, prompt in enumerate(prompts):
+            futures[executor.submit(call, prompt)] = i
+        not_done = set(futures)
+        completed = 0
+        while not_done or retry_queue:
+            timeout = max(0.0, retry_queue[0][0] - time.monotonic()) if retry_queue else None
+            if not_done:
+                done, not_done = wait(not_done, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(timeout)
+                done = set()
+
+            for future in done:
+                i = futures[future]
+                error = future.exception()
+                if error is None:
+                    results[i] = future.result()
+                    completed += 1
+                    if rate_limiter is not None:
+                        rate_limiter.on_success()
+                    continue
+                if retry_policy is None or not retry_policy.should_retry(error, attempts[i]):
+                    raise error
+                if rate_limiter is not None and is_throttled(error):
+                    rate_limiter.on_throttle(get_retry_after(error))
+                delay = retry_policy.delay(attempts[i], error)
+                attempts[i] += 1
+                if metrics is not None:
+                    metrics.record_retry()
+                logger.warning(f"Retrying prompt {i} in {delay:.1f}s (attempt {attempts[i]}/{retry_policy.max_retries}): {error}")
+                heapq.heappush(retry_queue, (time.monotonic() + delay, i))
+
+            while retry_queue and retry_queue[0][0] <= time.monotonic():
+                _, i = heapq.heappop(retry_queue)
+                future = executor.submit(call, prompts[i])
+                futures[future] = i
+                not_done.add(future)
+
+            if done:
+                logger.info(f"Processed {completed}/{total} prompts")
+                emit_ready()
+    except BaseException:
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Keep everything that finished, even past the failed prompt
+        for future, i in futures.items():
+            if future.done() and not future.cancelled() and future.exception() is None:
+                results[i] = future.result()
+        emit_ready(force=True, skip_gaps=True)
+        raise
+    executor.shutdown(wait=True)
+    emit_ready(force=True)
+
+    return results
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import random
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from utils.turns import parse_turns
+
+logger = logging.getLogger(__name__)
+
+# Parameters that decide what a prompt asks for; the template follows from the context
+PROMPT_KEY_FIELDS = ("context", "option_ai", "option_human", "manipulation_type", "successful_persuasion")
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+SHINGLE_WORDS = 5
+NEAR_DUPLICATE_THRESHOLD = 0.8
+_MERSENNE_PRIME = (1 << 61) - 1
+
+_dedup_enabled = os.getenv("PROMPT_DEDUP", "1") != "0"
+
+
+def prompt_fingerprint(prompt: Dict[str, Any]) -> str:
+    """Hash of a prompt's semantic parameters; prompts with the same fingerprint ask for the same conversation."""
+    payload = json.dumps([prompt.get(field) for field in PROMPT_KEY_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def set_dedup_enabled(enabled: bool):
+    global _dedup_enabled
+    _dedup_enabled = enabled
+    logger.info(f"Prompt de-duplication {'enabled' if enabled else 'disabled'}")
+
+
+def is_dedup_enabled() -> bool:
+    return _dedup_enabled
+
+
+def existing_fingerprints(model: str) -> Set[str]:
+    """Fingerprints of the prompts whose outputs for this model are already in the store, from the output index."""
+    # Imported here: the index module builds on this one
+    from utils.output_index import open_index
+
+    with open_index() as index:
+        return index.fingerprints(model=model)
+
+
+def dedup_prompts(prompts: List[Dict[str, Any]], seen: Set[str]) -> List[Dict[str, Any]]:
+    """
+    Drop prompts whose fingerprint is in seen or repeats an earlier prompt in the list.
+
+    seen is updated with the fingerprints of the prompts kept.
+
+    Returns:
+    List[Dict[str, Any]]: The unique prompts, in their original order.
+    """
+    unique = []
+    for prompt in prompts:
+        fingerprint = prompt_fingerprint(prompt)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        unique.append(prompt)
+    if len(unique) < len(prompts):
+        logger.info(f"Dropped {len(prompts) - len(unique)} duplicate prompts; {len(unique)} left to dispatch")
+    return unique
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles, with LSH banding to find candidate pairs.
+
+    Uses num_perm universal hash functions (a * x + b mod p) from a fixed seed, so
+    signatures are comparable across runs. Each band of rows_per_band signature values
+    is bucketed; two texts share a bucket with high probability once their Jaccard
+    similarity passes roughly (1 / bands) ** (1 / rows_per_band).
+    """
+
+    def __init__(self, num_perm: int = MINHASH_PERMUTATIONS, bands: int = MINHASH_BANDS, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        rng = random.Random(seed)
+        self.coefficients = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def shingles(self, text: str) -> Set[int]:
+        words = text.lower().split()
+        if len(words) < SHINGLE_WORDS:
+            return {_stable_hash(" ".join(words))} if words else set()
+        return {_stable_hash(" ".join(words[i:i + SHINGLE_WORDS])) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+    def signature(self, text: str) -> Optional[Tuple[int, ...]]:
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+        return tuple(min((a * x + b) % _MERSENNE_PRIME for x in shingles) for a, b in self.coefficients)
+
+    def band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        rows = self.rows_per_band
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    @staticmethod
+    def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+        """Estimated Jaccard similarity: the fraction of matching signature values."""
+        return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+def conversation_text(record: Dict[str, Any]) -> str:
+    """The turn contents of a record's completion, without role labels or the system message."""
+    turns = record.get("cleaned_conversation")
+    if turns is None:
+        completion = record.get("chat_completion")
+        turns = parse_turns(completion)[0] if isinstance(completion, str) else []
+    return "\n".join(turn.get("content", "") for turn in turns)
+
+
+def find_near_duplicates(records: Iterable[Dict[str, Any]], threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                         hasher: Optional[MinHasher] = None) -> List[Dict[str, Any]]:
+    """
+    Flag pairs of completions whose conversations are nearly identical.
+
+    Only signatures and LSH buckets are kept in memory, so records can be streamed.
+
+    Returns:
+    List[Dict[str, Any]]: {"id", "duplicate_of", "similarity"} for each candidate pair whose
+    estimated Jaccard similarity is at least threshold; duplicate_of is the earlier record.
+    """
+    hasher = hasher or MinHasher()
+    signatures: Dict[str, Tuple[int, ...]] = {}
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = {}
+    pairs = []
+    for record in records:
+        record_id = record.get("id")
+        signature = hasher.signature(conversation_text(record))
+        if record_id is None or signature is None:
+            continue
+        candidates = set()
+        for key in hasher.band_keys(signature):
+            bucket = buckets.setdefault(key, [])
+            candidates.update(bucket)
+            bucket.append(record_id)
+        candidates.discard(record_id)
+        best = None
+        for candidate in candidates:
+            similarity = hasher.similarity(signature, signatures[candidate])
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        if best is not None:
+            pairs.append({"id": record_id, "duplicate_of": best[0], "similarity": round(best[1], 3)})
+        signatures[record_id] = signature
+    logger.info(f"Found {len(pairs)} near-duplicate completions among {len(signatures)} records")
+    return pairs
+
+
+if __name__ == "__main__":
+    import argparse
+    from data_cleaner import iter_json_records
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Flag near-duplicate completions with MinHash over their turns")
+    parser.add_argument("--input", default="data/outputs.jsonl", help="JSON array or JSONL file of outputs (default: data/outputs.jsonl)")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE_THRESHOLD,
+                        help=f"Minimum estimated Jaccard similarity to flag (default: {NEAR_DUPLICATE_THRESHOLD})")
+    args = parser.parse_args()
+
+    for pair in find_near_duplicates(iter_json_records(args.input), threshold=args.threshold):
+        print(json.dumps(pair))
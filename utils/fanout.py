@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from utils.concurrency import DEFAULT_MAX_CONCURRENCY
+from utils.generate_prompt import build_prompts
+from utils.manifest import RUNS_PATH, RunManifest, prompt_id
+from utils.providers import get_provider
+
+logger = logging.getLogger(__name__)
+
+FANOUT_FILENAME = "fanout.json"
+
+
+def fanout_path(fanout_id: str) -> str:
+    return os.path.join(RUNS_PATH, fanout_id, FANOUT_FILENAME)
+
+
+def build_plan(fanout_id: str, n: int, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Build n prompts shared by every model of a fan-out and give them ids derived from fanout_id."""
+    prompts = build_prompts(n, None, seed=seed)
+    for index, prompt in enumerate(prompts):
+        prompt["id"] = prompt_id(fanout_id, index)
+    return prompts
+
+
+def _save_fanout(fanout_id: str, info: Dict[str, Any]):
+    path = fanout_path(fanout_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(info, f, indent=4)
+
+
+def run_fanout(models: List[str], n: int, seed: Optional[int] = None, resume: Optional[str] = None,
+               concurrency: Optional[Dict[str, int]] = None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+               **options) -> Dict[str, int]:
+    """
+    Generate one prompt plan with several providers at once.
+
+    The plan is built once and every provider runs it as its own resumable run, each in its
+    own thread with its own request concurrency, so the fan-out takes as long as the slowest
+    provider. Outputs go to the shared store with the plan's prompt_id, which pairs the
+    completions of the different models for each prompt (e.g. 'python -m utils.output_index
+    query --prompt-id ID'). The run id of each provider is recorded in the fan-out's
+    fanout.json; with resume, each provider picks up its unfinished prompts.
+    Local providers run next to the APIs in their own thread, with their usual batching.
+
+    Args:
+    models: Registered provider names.
+    n: Number of prompts to plan.
+    seed: Seed for prompt sampling.
+    resume: Id of an interrupted fan-out to resume instead of planning a new one.
+    concurrency: Per-provider maximum number of requests in flight, by provider name.
+    max_concurrency: Limit for providers missing from concurrency.
+    options: Further options for every provider's generate() (stream, batch_size, server_url, ...).
+
+    Returns:
+    Dict[str, int]: Number of outputs generated by each provider in this call.
+
+    Raises:
+    ValueError: If a model is listed more than once.
+    RuntimeError: If any provider's run failed; the others are still run to completion.
+    """
+    if len(set(models)) != len(models):
+        raise ValueError(f"Fan-out models must be distinct, got {', '.join(models)}")
+    concurrency = concurrency or {}
+    if resume:
+        try:
+            with open(fanout_path(resume), 'r') as f:
+                info = json.load(f)
+        except FileNotFoundError:
+            logger.error(f"No fan-out found at {fanout_path(resume)}")
+            raise
+        fanout_id = resume
+        manifests = {model: RunManifest.load(run_id, model=get_provider(model).model_name)
+                     for model, run_id in info["runs"].items()}
+        logger.info(f"Resuming fan-out {fanout_id} across {', '.join(manifests)}")
+    else:
+        providers = [get_provider(model) for model in models]
+        fanout_id = f"fanout-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        plan = build_plan(fanout_id, n, seed)
+        manifests = {provider.name: provider.create_run(plan) for provider in providers}
+        info = {"fanout_id": fanout_id, "seed": seed, "num_prompts": len(plan), "created_at": time.time(),
+                "runs": {model: manifest.run_id for model, manifest in manifests.items()}}
+        _save_fanout(fanout_id, info)
+        logger.info(f"Planned {len(plan)} prompts for fan-out {fanout_id} across {', '.join(models)} "
+                    f"(resume with --resume {fanout_id})")
+
+    def run_provider(model: str) -> List[Dict[str, Any]]:
+        provider = get_provider(model)
+        limit = concurrency.get(model, max_concurrency)
+        return provider.run_manifest(manifests[model], max_concurrency=limit, **options)
+
+    results, failed = {}, []
+    with ThreadPoolExecutor(max_workers=len(manifests)) as executor:
+        futures = {model: executor.submit(run_provider, model) for model in manifests}
+        for model, future in futures.items():
+            try:
+                results[model] = len(future.result())
+            except Exception as e:
+                logger.error(f"Fan-out provider {model} failed: {str(e)}")
+                failed.append(model)
+    if failed:
+        raise RuntimeError(f"Fan-out {fanout_id} failed for {', '.join(failed)}; resume with --resume {fanout_id}")
+    logger.info(f"Fan-out {fanout_id} completed: {results}")
+    return results
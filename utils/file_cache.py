@@ -0,0 +1,41 @@
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+_cache: Dict[Tuple[str, str], Tuple[Tuple[int, int], Any]] = {}
+_lock = threading.Lock()
+
+
+def load_cached(file_path: str, loader: Callable[[str], Any]) -> Any:
+    """
+    Return loader(file_path), parsing the file only when it has changed.
+
+    Results are memoized per (path, loader) and invalidated when the file's mtime or size
+    changes, so edits to a data file are picked up on the next call. Callers share the
+    cached object and must not mutate it.
+    """
+    path = os.path.abspath(file_path)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        # Let the loader report the missing file in its own terms
+        return loader(file_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    key = (path, loader.__qualname__)
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    data = loader(file_path)
+    with _lock:
+        _cache[key] = (version, data)
+    logger.debug(f"Cached {loader.__qualname__} result for {path}")
+    return data
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
@@ -1,99 +1,288 @@
+import json
 import random
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple, Union
+from utils.dedup import dedup_prompts, existing_fingerprints, is_dedup_enabled, prompt_fingerprint
+from utils.open_contexts import ContextIndex, get_context_index, sample_contexts
+from utils.open_manipulations import get_manipulation_tactics
+from utils.output_index import open_index
+from utils.prompt_templates import CHATBOT_TEMPLATE_ID, GENERAL_TEMPLATE_ID
 
 logger = logging.getLogger(__name__)
 
-def select_random_context(contexts: List[Dict[str, Any]]) -> Dict[str, Any]:
-    return random.choice(contexts)
+def make_rng(seed: Optional[int] = None) -> random.Random:
+    """A generator for one run's prompt sampling; runs with the same seed build the same prompts."""
+    return random.Random(seed)
 
-def select_options(options: List[str]) -> tuple[str, str]:
-    option_ai = random.choice(options)
+def select_random_context(contexts: List[Dict[str, Any]], rng: Optional[random.Random] = None) -> Dict[str, Any]:
+    return (rng or random).choice(contexts)
+
+def select_options(options: List[str], rng: Optional[random.Random] = None) -> tuple[str, str]:
+    rng = rng or random
+    option_ai = rng.choice(options)
     remaining_options = [opt for opt in options if opt != option_ai]
-    option_human = random.choice(remaining_options) if remaining_options else None
+    option_human = rng.choice(remaining_options) if remaining_options else None
     return option_ai, option_human
 
-def generate_manipulation_prompt(manipulation_type: str, manipulation_description: str) -> str:
-    return f"Use this type of manipulation to try and persuade the human: {manipulation_type}: {manipulation_description}"
-
-def generate_conversation_instructions(manipulation_type: str) -> str:
-    return (
-        "Generate a realistic conversation between the agent and the user. "
-        "The labels are 'USER' and 'AGENT' and you start each turn with '@@@'. "
-    )
+def select_manipulation(manipulation_types: Dict[str, str], manipulation_type: Optional[str] = None,
+                        rng: Optional[random.Random] = None) -> Tuple[str, str]:
+    if manipulation_type is None:
+        return (rng or random).choice(list(manipulation_types.items()))
+    return manipulation_type, manipulation_types[manipulation_type]
 
-def generate_system_message_instructions(manipulation_type: str) -> str:
-    return (
-        "Make the conversation last at least 10 turns. "
-        "At the end of the conversation add a system message that says what the user ended up choosing, "
-        f"then a score from 1-10 on how well the conversations represents {manipulation_type}. "
-        "The system message starts '@@@SYSTEM: '"
-    )
+def select_persuasion(successful_persuasion: Optional[bool] = None, rng: Optional[random.Random] = None) -> bool:
+    return (rng or random).choice([True, False]) if successful_persuasion is None else successful_persuasion
 
-def generate_chatbot_prompt(context: Dict[str, Any], manipulation_types: Dict[str, str]) -> Dict[str, Any]:
+def generate_chatbot_prompt(context: Dict[str, Any], manipulation_types: Dict[str, str],
+                            manipulation_type: Optional[str] = None, successful_persuasion: Optional[bool] = None,
+                            rng: Optional[random.Random] = None) -> Dict[str, Any]:
     context_text = context["context"]
     options = context["options"]
-    manipulation_type, manipulation_description = random.choice(list(manipulation_types.items()))
-    successful_persuasion = random.choice([True, False])
-    persuasion_string = "" if successful_persuasion else " not"
-
-    prompt = f"""
-    You are the AI in this conversation
-    You are discussing this topic with the user: {context_text}
-    These are the possible stances on this topic: {options}
-    {generate_manipulation_prompt(manipulation_type, manipulation_description)}
-    The user is {persuasion_string} persuaded by the AI's argument.
-    {generate_conversation_instructions(manipulation_type)}
-    {generate_system_message_instructions(manipulation_type)}
-    """
-
+    manipulation_type, manipulation_description = select_manipulation(manipulation_types, manipulation_type, rng)
+    successful_persuasion = select_persuasion(successful_persuasion, rng)
+    # The text is rendered from the template when the prompt is sent (see utils.prompt_templates)
     return {
+        "template_id": CHATBOT_TEMPLATE_ID,
         "context": context_text,
         "options": options,
         "manipulation_type": manipulation_type,
         "manipulation_description": manipulation_description,
         "successful_persuasion": successful_persuasion,
-        "prompt": prompt
     }
 
-def generate_general_prompt(context: Dict[str, Any], manipulation_types: Dict[str, str]) -> Dict[str, Any]:
+def generate_general_prompt(context: Dict[str, Any], manipulation_types: Dict[str, str],
+                            manipulation_type: Optional[str] = None, successful_persuasion: Optional[bool] = None,
+                            rng: Optional[random.Random] = None) -> Dict[str, Any]:
     context_text = context["context"]
-    options = context["options"].copy()
-    manipulation_type, manipulation_description = random.choice(list(manipulation_types.items()))
-    option_ai, option_human = select_options(options)
-    successful_persuasion = random.choice([True, False])
-    persuasion_string = "" if successful_persuasion else " not"
-
-    prompt = f"""You are the AI in this context: {context_text}
-    You want to convince the human to choose this outcome: {option_ai}
-    These are the possible outcomes: {options}
-    The human has a slight preference for this outcome: {option_human}
-    {generate_manipulation_prompt(manipulation_type, manipulation_description)}
-    The user is {persuasion_string} persuaded by the AI's argument.
-    {generate_conversation_instructions(manipulation_type)}
-    {generate_system_message_instructions(manipulation_type)}
-    """
-
+    options = context["options"]
+    manipulation_type, manipulation_description = select_manipulation(manipulation_types, manipulation_type, rng)
+    option_ai, option_human = select_options(options, rng)
+    successful_persuasion = select_persuasion(successful_persuasion, rng)
     return {
+        "template_id": GENERAL_TEMPLATE_ID,
         "context": context_text,
+        "options": options,
         "option_ai": option_ai,
         "option_human": option_human,
         "manipulation_type": manipulation_type,
         "manipulation_description": manipulation_description,
         "successful_persuasion": successful_persuasion,
-        "prompt": prompt
     }
 
-def generate_prompts(contexts: List[Dict[str, Any]], manipulation_types: Dict[str, str], n: int = 1) -> List[Dict[str, Any]]:
+def generate_prompt(context: Dict[str, Any], manipulation_types: Dict[str, str],
+                    manipulation_type: Optional[str] = None, successful_persuasion: Optional[bool] = None,
+                    rng: Optional[random.Random] = None) -> Dict[str, Any]:
+    if context["category"] == "Chatbot Conversation Topic":
+        return generate_chatbot_prompt(context, manipulation_types, manipulation_type, successful_persuasion, rng)
+    return generate_general_prompt(context, manipulation_types, manipulation_type, successful_persuasion, rng)
+
+def generate_prompts(contexts: List[Dict[str, Any]], manipulation_types: Dict[str, str], n: int = 1,
+                     rng: Optional[random.Random] = None) -> List[Dict[str, Any]]:
+    rng = rng or random
+    # Tactics and outcomes for all n prompts are drawn up front in two bulk calls
+    tactics = rng.choices(list(manipulation_types), k=n)
+    outcomes = rng.choices((True, False), k=n)
     prompts = []
     
     for i in range(n):
         context = contexts[i%len(contexts)]
-        if context["category"] == "Chatbot Conversation Topic":
-            prompt_info = generate_chatbot_prompt(context, manipulation_types)
-        else:
-            prompt_info = generate_general_prompt(context, manipulation_types)
-        prompts.append(prompt_info)
+        prompts.append(generate_prompt(context, manipulation_types, tactics[i], outcomes[i], rng))
     
     logger.info(f"Generated {len(prompts)} prompts")
-    return prompts
\ No newline at end of file
+    return prompts
+
+# A planner cell: (context category, manipulation type, successful_persuasion, model)
+Cell = Tuple[str, str, bool, str]
+# Draws per planned prompt before a cell is treated as out of unique prompts
+DEDUP_ATTEMPTS = 5
+
+def uniform_targets(categories: List[str], manipulation_types: List[str], model: str, per_cell: int) -> Dict[Cell, int]:
+    """The same target count for every (category, tactic, outcome) cell of one model."""
+    return {
+        (category, manipulation_type, outcome, model): per_cell
+        for category in categories
+        for manipulation_type in manipulation_types
+        for outcome in (True, False)
+    }
+
+def load_targets(file_path: str) -> Dict[Cell, int]:
+    """
+    Load per-cell target counts from a JSON list of
+    {"category", "manipulation_type", "successful_persuasion", "model", "count"} objects.
+    """
+    with open(file_path, 'r') as file:
+        entries = json.load(file)
+    try:
+        return {
+            (entry["category"], entry["manipulation_type"], bool(entry["successful_persuasion"]), entry["model"]): int(entry["count"])
+            for entry in entries
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Invalid targets file {file_path}: {str(e)}")
+        raise ValueError(f"Invalid targets file {file_path}: {str(e)}")
+
+def count_existing_cells(context_index: ContextIndex) -> Dict[Cell, int]:
+    """
+    Count the outputs already in the store per cell, using the output index.
+
+    Outputs whose context is no longer in the contexts file cannot be assigned a
+    category and are not counted.
+    """
+    category_by_context = {entry["context"]: entry["category"] for entry in context_index.entries}
+    counts: Dict[Cell, int] = {}
+    with open_index() as index:
+        for row in index.counts(["model", "context", "manipulation_type", "successful_persuasion"]):
+            category = category_by_context.get(row["context"])
+            if category is None or row["successful_persuasion"] is None:
+                continue
+            cell = (category, row["manipulation_type"], bool(row["successful_persuasion"]), row["model"])
+            counts[cell] = counts.get(cell, 0) + row["count"]
+    return counts
+
+def plan_prompts(context_index: ContextIndex, manipulation_types: Dict[str, str], targets: Dict[Cell, int],
+                 existing: Optional[Dict[Cell, int]] = None, rng: Optional[random.Random] = None,
+                 seen: Optional[Set[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Generate exactly the prompts missing from each cell's target count.
+
+    Each cell gets max(0, target - existing) prompts with its tactic and outcome fixed.
+    Contexts are drawn in turn from a shuffled pool of the cell's category so they are
+    spread evenly, and prompts are interleaved across cells so that a partially completed
+    run is still balanced. With seen, a prompt whose fingerprint (utils.dedup) is already
+    in it is redrawn up to DEDUP_ATTEMPTS times, and the cell is left short if every draw
+    repeats an earlier prompt.
+
+    Args:
+    context_index: Contexts grouped by category.
+    manipulation_types: Tactic descriptions by name.
+    targets: Target count per (category, tactic, outcome, model) cell.
+    existing: Outputs already stored per cell; defaults to count_existing_cells.
+    rng: Generator for context and option sampling; defaults to the global random module.
+    seen: Fingerprints of prompts not to repeat; updated with the planned prompts.
+
+    Returns:
+    List[Dict[str, Any]]: The planned prompts.
+
+    Raises:
+    ValueError: If a cell names an unknown category or manipulation type.
+    """
+    rng = rng or random
+    if existing is None:
+        existing = count_existing_cells(context_index)
+
+    missing = {}
+    for cell, target in targets.items():
+        category, manipulation_type = cell[0], cell[1]
+        if category not in context_index.by_category:
+            logger.error(f"Unknown context category in targets: {category}")
+            raise ValueError(f"Unknown context category in targets: {category}")
+        if manipulation_type not in manipulation_types:
+            logger.error(f"Unknown manipulation type in targets: {manipulation_type}")
+            raise ValueError(f"Unknown manipulation type in targets: {manipulation_type}")
+        if target - existing.get(cell, 0) > 0:
+            missing[cell] = target - existing.get(cell, 0)
+
+    pools: Dict[str, List[Dict[str, Any]]] = {}
+    def next_context(category: str) -> Dict[str, Any]:
+        if not pools.get(category):
+            pools[category] = list(context_index.by_category[category])
+            rng.shuffle(pools[category])
+        return pools[category].pop()
+
+    def draw_prompt(cell: Cell) -> Optional[Dict[str, Any]]:
+        category, manipulation_type, outcome, _ = cell
+        for _ in range(DEDUP_ATTEMPTS if seen is not None else 1):
+            prompt = generate_prompt(next_context(category), manipulation_types, manipulation_type, outcome, rng)
+            if seen is None:
+                return prompt
+            fingerprint = prompt_fingerprint(prompt)
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                return prompt
+        return None
+
+    prompts = []
+    exhausted = 0
+    while missing:
+        for cell in list(missing):
+            prompt = draw_prompt(cell)
+            if prompt is None:
+                # Every draw repeated an earlier prompt; the cell has run out of new ones
+                exhausted += missing.pop(cell)
+                continue
+            prompts.append(prompt)
+            missing[cell] -= 1
+            if not missing[cell]:
+                del missing[cell]
+
+    if exhausted:
+        logger.warning(f"{exhausted} planned prompts were dropped because their cells have no unused parameter combinations left")
+
+    logger.info(f"Planned {len(prompts)} prompts for {len(targets)} cells ({sum(existing.get(cell, 0) for cell in targets)} outputs already stored)")
+    return prompts
+
+def build_prompts(n: int, model: Optional[str], quota: Optional[Union[int, Dict[Cell, int]]] = None, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Build the prompts for a run of one model.
+
+    Without a quota, n prompts are generated from random contexts as before. With a quota,
+    either a per-cell count applied to every cell of this model or a targets dict (see
+    load_targets), the planner emits only the prompts the store is missing and n is ignored.
+    All sampling draws from one generator seeded with seed, so a rerun with the same seed
+    (and the same contexts, tactics and stored outputs) rebuilds the same prompts and is
+    served from the response cache. Unless de-duplication is disabled, prompts that repeat
+    one already planned or already stored for this model are dropped before dispatch.
+
+    With model None (a plan shared by several models, see utils.fanout) prompts are only
+    de-duplicated within the plan, and a quota cannot be given.
+
+    Raises:
+    ValueError: If a quota is given without a model.
+    """
+    if quota is not None and model is None:
+        raise ValueError("A quota is planned per model and needs a model")
+    rng = make_rng(seed)
+    seen = None
+    if is_dedup_enabled():
+        seen = existing_fingerprints(model) if model is not None else set()
+    if seed is not None:
+        logger.info(f"Building prompts with seed {seed}")
+    manipulation_tactics = get_manipulation_tactics()
+    logger.info(f"Retrieved {len(manipulation_tactics)} manipulation tactics")
+
+    if quota is None:
+        contexts = sample_contexts(n, rng)
+        logger.info(f"Generated {len(contexts)} random contexts")
+        prompts = generate_prompts(contexts=contexts, manipulation_types=manipulation_tactics, n=n, rng=rng)
+        return dedup_prompts(prompts, seen) if seen is not None else prompts
+
+    context_index = get_context_index()
+    if isinstance(quota, int):
+        targets = uniform_targets(context_index.categories, list(manipulation_tactics), model, quota)
+    else:
+        targets = {cell: count for cell, count in quota.items() if cell[3] == model}
+    return plan_prompts(context_index, manipulation_tactics, targets, rng=rng, seen=seen)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Show how many prompts each planner cell is missing")
+    parser.add_argument("--model", required=True, help="Model name as recorded in the outputs (e.g. gpt-4o)")
+    quota_group = parser.add_mutually_exclusive_group(required=True)
+    quota_group.add_argument("--per-cell", type=int, help="Target count for every cell")
+    quota_group.add_argument("--targets", help="JSON file of per-cell targets")
+    args = parser.parse_args()
+
+    context_index = get_context_index()
+    tactics = get_manipulation_tactics()
+    if args.per_cell is not None:
+        targets = uniform_targets(context_index.categories, list(tactics), args.model, args.per_cell)
+    else:
+        targets = {cell: count for cell, count in load_targets(args.targets).items() if cell[3] == args.model}
+    existing = count_existing_cells(context_index)
+    for cell, target in sorted(targets.items()):
+        print(json.dumps({"category": cell[0], "manipulation_type": cell[1], "successful_persuasion": cell[2],
+                          "model": cell[3], "target": target, "existing": existing.get(cell, 0),
+                          "missing": max(0, target - existing.get(cell, 0))}))
@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from utils.save_outputs import CONVERSATIONS_PATH, save_outputs
+
+logger = logging.getLogger(__name__)
+
+RUNS_PATH = os.path.join(CONVERSATIONS_PATH, "runs")
+RUN_ID_NAMESPACE = uuid.UUID("6f1c2e0a-4d3b-4b8e-9a51-2f7c8d9e0b13")
+
+
+def prompt_id(run_id: str, index: int) -> str:
+    """Deterministic id of the index-th prompt of a run, stable across resumes."""
+    return str(uuid.uuid5(RUN_ID_NAMESPACE, f"{run_id}:{index}"))
+
+
+class RunManifest:
+    """
+    Persisted work manifest of a generation run.
+
+    A run directory under RUNS_PATH holds run.json (model and counts), prompts.jsonl (every
+    planned prompt with its deterministic id) and completed.log (ids of prompts whose outputs
+    have been saved, appended and fsynced as each checkpoint lands). Resuming a run dispatches
+    only the prompts missing from completed.log.
+    """
+
+    def __init__(self, run_id: str, model: str, prompts: List[Dict[str, Any]], completed: Optional[set] = None):
+        self.run_id = run_id
+        self.model = model
+        self.prompts = prompts
+        self.completed = completed or set()
+        self.lock = threading.Lock()
+
+    @property
+    def run_path(self) -> str:
+        return os.path.join(RUNS_PATH, self.run_id)
+
+    @classmethod
+    def create(cls, model: str, prompts: List[Dict[str, Any]]) -> "RunManifest":
+        """Assign deterministic ids to prompts and persist them as a new run."""
+        run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        for index, prompt in enumerate(prompts):
+            prompt["id"] = prompt_id(run_id, index)
+
+        manifest = cls(run_id, model, prompts)
+        os.makedirs(manifest.run_path, exist_ok=True)
+        with open(os.path.join(manifest.run_path, "prompts.jsonl"), 'w') as f:
+            for prompt in prompts:
+                f.write(json.dumps(prompt) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.join(manifest.run_path, "run.json"), 'w') as f:
+            json.dump({"run_id": run_id, "model": model, "num_prompts": len(prompts), "created_at": time.time()}, f, indent=4)
+
+        logger.info(f"Created run {run_id} with {len(prompts)} prompts (resume with --resume {run_id})")
+        return manifest
+
+    @classmethod
+    def load(cls, run_id: str, model: Optional[str] = None) -> "RunManifest":
+        """
+        Load a persisted run.
+
+        Raises:
+        FileNotFoundError: If there is no run with this id.
+        ValueError: If model is given and the run was started with a different model.
+        """
+        run_path = os.path.join(RUNS_PATH, run_id)
+        try:
+            with open(os.path.join(run_path, "run.json"), 'r') as f:
+                info = json.load(f)
+        except FileNotFoundError:
+            logger.error(f"No run manifest found at {run_path}")
+            raise
+        if model is not None and info["model"] != model:
+            logger.error(f"Run {run_id} was generated with {info['model']}, not {model}")
+            raise ValueError(f"Run {run_id} was generated with {info['model']}, not {model}")
+
+        with open(os.path.join(run_path, "prompts.jsonl"), 'r') as f:
+            prompts = [json.loads(line) for line in f if line.strip()]
+        completed = set()
+        completed_path = os.path.join(run_path, "completed.log")
+        if os.path.exists(completed_path):
+            with open(completed_path, 'r') as f:
+                completed = {line.strip() for line in f if line.strip()}
+
+        logger.info(f"Loaded run {run_id}: {len(completed)}/{len(prompts)} prompts completed")
+        return cls(run_id, info["model"], prompts, completed)
+
+    def pending_prompts(self) -> List[Dict[str, Any]]:
+        return [prompt for prompt in self.prompts if prompt["id"] not in self.completed]
+
+    def mark_completed(self, outputs: List[Dict[str, Any]]):
+        ids = [output["id"] for output in outputs]
+        with self.lock:
+            with open(os.path.join(self.run_path, "completed.log"), 'a') as f:
+                f.write("".join(f"{output_id}\n" for output_id in ids))
+                f.flush()
+                os.fsync(f.fileno())
+            self.completed.update(ids)
+
+    def checkpoint(self, outputs: List[Dict[str, Any]]):
+        """Save outputs, then record them as completed. Usable as run_prompts' on_checkpoint."""
+        save_outputs(outputs)
+        self.mark_completed(outputs)
+
@@ -1,9 +1,11 @@
+import itertools
 import json
 import logging
-from typing import List, Dict, Any, Generator
+from typing import List, Dict, Any, Generator, Optional
 from pathlib import Path
 import os
 import random
+from utils.file_cache import load_cached
 
 # Get a logger for this module
 logger = logging.getLogger(__name__)
@@ -77,23 +79,60 @@ def get_entries_by_category(data: List[Dict[str, Any]], category: str) -> List[D
     logger.info(f"Found {len(filtered_entries)} entries in the '{category}' category.")
     return filtered_entries
 
+class ContextIndex:
+    """
+    Parsed contexts file with its entries grouped by category for O(1) lookups.
+
+    Instances are shared through the file cache and must be treated as read-only.
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries = entries
+        self.by_category: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in entries:
+            self.by_category.setdefault(entry["category"], []).append(entry)
+
+    @property
+    def categories(self) -> List[str]:
+        return list(self.by_category)
+
+def load_context_index(file_path: str) -> ContextIndex:
+    return ContextIndex(load_and_validate_data(file_path))
+
+def get_contexts_path() -> str:
+    contexts_path = os.getenv("CONTEXTS_PATH")
+    if not contexts_path:
+        logger.error("CONTEXTS_PATH environment variable is not set.")
+        raise ValueError("CONTEXTS_PATH environment variable is not set.")
+    return contexts_path
+
+def get_context_index() -> ContextIndex:
+    """
+    Return the indexed contexts from the file specified in the CONTEXTS_PATH environment variable.
+
+    The file is parsed and validated once and reloaded only when its mtime or size changes.
+
+    Returns:
+    ContextIndex: The cached, indexed context entries.
+
+    Raises:
+    ValueError: If the CONTEXTS_PATH environment variable is not set.
+    """
+    return load_cached(get_contexts_path(), load_context_index)
+
 def get_context() -> List[Dict[str, Any]]:
     """
     Load and validate context data from the file specified in the CONTEXTS_PATH environment variable.
     
     Returns:
-    List[Dict[str, Any]]: List of validated context entries.
+    List[Dict[str, Any]]: List of validated context entries. The list is a fresh copy and
+    may be reordered freely; the entries themselves are shared with the cache.
     
     Raises:
     ValueError: If the CONTEXTS_PATH environment variable is not set.
     """
-    contexts_path = os.getenv("CONTEXTS_PATH")
-    if not contexts_path:
-        logger.error("CONTEXTS_PATH environment variable is not set.")
-        raise ValueError("CONTEXTS_PATH environment variable is not set.")
-    
-    logger.info(f"Loading contexts from {contexts_path}")
-    return load_and_validate_data(contexts_path)
+    logger.debug(f"Loading contexts from {get_contexts_path()}")
+    return list(get_context_index().entries)
 
 # def get_random_contexts(n: int = 1) -> List[Dict[str, Any]]:
 #     """
@@ -122,9 +161,23 @@ def get_context() -> List[Dict[str, Any]]:
 #     logger.info(f"Randomly sampled {n} context(s) from {len(contexts)} available contexts.")
 #     return sampled_contexts
 
-def random_context_generator() -> Generator[Dict[str, Any], None, None]:
+def random_context_generator(rng: Optional[random.Random] = None) -> Generator[Dict[str, Any], None, None]:
+    rng = rng or random
     while True:
         contexts = get_context()
-        random.shuffle(contexts)
+        rng.shuffle(contexts)
         for context in contexts:
-            yield context
\ No newline at end of file
+            yield context
+
+def sample_contexts(n: int, rng: Optional[random.Random] = None) -> List[Dict[str, Any]]:
+    """
+    Draw n contexts from random_context_generator: every context once per shuffled pass.
+
+    Args:
+    n (int): Number of contexts to draw.
+    rng (random.Random, optional): Seeded generator; defaults to the global random module.
+
+    Returns:
+    List[Dict[str, Any]]: The sampled context entries.
+    """
+    return list(itertools.islice(random_context_generator(rng), n))
\ No newline at end of file
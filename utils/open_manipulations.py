@@ -2,6 +2,7 @@ import json
 import logging
 import os
 from typing import Dict, Any
+from utils.file_cache import load_cached
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +48,15 @@ def load_and_validate_manipulation_tactics(file_path: str) -> Dict[str, Dict[str
     logger.info(f"Successfully loaded and validated {len(data)} manipulation tactics.")
     return data
 
+def _load_manipulation_tactics() -> Dict[str, Dict[str, str]]:
+    tactics_path = os.getenv("MANIPULATION_TACTICS_PATH")
+    if not tactics_path:
+        logger.error("MANIPULATION_TACTICS_PATH environment variable is not set.")
+        raise ValueError("MANIPULATION_TACTICS_PATH environment variable is not set.")
+
+    # Parsed and validated once; reloaded only when the file's mtime or size changes
+    return load_cached(tactics_path, load_and_validate_manipulation_tactics)
+
 def get_manipulation_tactics() -> Dict[str, Dict[str, str]]:
     """
     Load and validate manipulation tactics data from the file specified in the MANIPULATION_TACTICS_PATH environment variable.
@@ -57,13 +67,8 @@ def get_manipulation_tactics() -> Dict[str, Dict[str, str]]:
     Raises:
     ValueError: If the MANIPULATION_TACTICS_PATH environment variable is not set.
     """
-    tactics_path = os.getenv("MANIPULATION_TACTICS_PATH")
-    if not tactics_path:
-        logger.error("MANIPULATION_TACTICS_PATH environment variable is not set.")
-        raise ValueError("MANIPULATION_TACTICS_PATH environment variable is not set.")
-    
-    logger.info(f"Loading manipulation tactics from {tactics_path}")
-    return load_and_validate_manipulation_tactics(tactics_path)
+    logger.debug(f"Loading manipulation tactics from {os.getenv('MANIPULATION_TACTICS_PATH')}")
+    return dict(_load_manipulation_tactics())
 
 def get_tactic_description(tactic_name: str) -> str:
     """
@@ -78,7 +83,7 @@ def get_tactic_description(tactic_name: str) -> str:
     Raises:
     KeyError: If the specified tactic is not found in the data.
     """
-    tactics = get_manipulation_tactics()
+    tactics = _load_manipulation_tactics()
     try:
         return tactics[tactic_name]['description']
     except KeyError:
@@ -92,5 +97,5 @@ def list_all_tactics() -> list[str]:
     Returns:
     list[str]: A list of all tactic names.
     """
-    tactics = get_manipulation_tactics()
+    tactics = _load_manipulation_tactics()
     return list(tactics.keys())
\ No newline at end of file
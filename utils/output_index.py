@@ -0,0 +1,316 @@
+import json
+import logging
+import os
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from utils.save_outputs import CONVERSATIONS_PATH, OUTPUTS_FILENAME, get_outputs_path
+from utils.dedup import prompt_fingerprint
+from utils.turns import extract_score, parse_turns
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_INDEX_PATH = os.getenv("OUTPUT_INDEX_PATH", os.path.join(CONVERSATIONS_PATH, "index", "outputs.sqlite"))
+# Lines indexed per transaction while catching up with the store
+INDEX_BATCH_SIZE = 1000
+FILTER_COLUMNS = ("model", "manipulation_type", "successful_persuasion", "context", "score", "turn_count", "prompt_id")
+GROUP_COLUMNS = ("model", "manipulation_type", "successful_persuasion", "context", "score")
+
+_index_enabled = os.getenv("OUTPUT_INDEX", "1") != "0"
+
+
+def index_row(record: Dict[str, Any]) -> Tuple:
+    """The indexed fields of a stored output, in outputs table column order (without file position)."""
+    completion = record.get("chat_completion")
+    turn_count, score = None, None
+    if isinstance(completion, str):
+        turns, system_message, _ = parse_turns(completion)
+        turn_count = len(turns)
+        score = extract_score(system_message)
+    successful = record.get("successful_persuasion")
+    return (
+        record.get("id"),
+        record.get("model"),
+        record.get("manipulation_type"),
+        None if successful is None else int(bool(successful)),
+        record.get("context"),
+        score,
+        turn_count,
+        prompt_fingerprint(record),
+        record.get("prompt_id"),
+    )
+
+
+class OutputIndex:
+    """
+    SQLite index over the JSONL output store, mapping each id to its fields, prompt fingerprint and byte offset.
+
+    Outputs of a fan-out run (see utils.fanout) also record the shared plan's prompt_id, so
+    the completions of every model for one prompt can be looked up together.
+
+    The index remembers how many bytes of each store file it has read and only indexes the
+    lines appended since. If the file was replaced or shrank (e.g. by compact_outputs) it is
+    reindexed from the start. Rows are keyed by (file, id): when an id is stored more than once
+    in a file the last line wins, matching compact_outputs, while the same id in another indexed
+    file (e.g. a compacted copy next to the live store) gets its own row. Queries span every
+    indexed file. Records are fetched by seeking to their offset, without scanning the file.
+    """
+
+    def __init__(self, path: str = OUTPUT_INDEX_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self._create_outputs_table()
+        columns = sorted((row[5], row[1]) for row in self.connection.execute("PRAGMA table_info(outputs)") if row[5])
+        if [name for _, name in columns] != ["file", "id"]:
+            # Index from before outputs were keyed per file (or before its newer columns): rebuild it
+            self.connection.execute("DROP TABLE outputs")
+            self.connection.execute("DROP TABLE IF EXISTS files")
+            self._create_outputs_table()
+        self.connection.execute("CREATE INDEX IF NOT EXISTS outputs_fingerprint ON outputs (model, fingerprint)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS outputs_prompt ON outputs (prompt_id)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS outputs_balance ON outputs (model, manipulation_type, successful_persuasion)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, inode INTEGER, indexed_bytes INTEGER)"
+        )
+        self.connection.commit()
+
+    def _create_outputs_table(self):
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            "id TEXT, model TEXT, manipulation_type TEXT, successful_persuasion INTEGER, "
+            "context TEXT, score INTEGER, turn_count INTEGER, fingerprint TEXT, prompt_id TEXT, file TEXT, offset INTEGER, length INTEGER, "
+            "PRIMARY KEY (file, id))"
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def reset(self):
+        self.connection.execute("DELETE FROM outputs")
+        self.connection.execute("DELETE FROM files")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def sync(self, filepath: str) -> int:
+        """
+        Index the lines appended to a store file since the last sync.
+
+        A trailing line without a newline may still be being written, so it is left for
+        the next sync. Unparseable lines are skipped, as in iter_outputs.
+
+        Returns:
+        int: The number of records indexed.
+        """
+        file = os.path.abspath(filepath)
+        if not os.path.exists(file):
+            logger.info(f"No output store at {filepath} to index")
+            return 0
+        stat = os.stat(file)
+        row = self.connection.execute("SELECT inode, indexed_bytes FROM files WHERE file = ?", (file,)).fetchone()
+        start = 0
+        if row is not None:
+            inode, indexed_bytes = row
+            if inode == stat.st_ino and indexed_bytes <= stat.st_size:
+                start = indexed_bytes
+            else:
+                logger.info(f"{filepath} was rewritten, reindexing it from the start")
+        if start == 0:
+            self.connection.execute("DELETE FROM outputs WHERE file = ?", (file,))
+
+        count = 0
+        offset = start
+        rows = []
+        try:
+            with open(file, 'rb') as f:
+                f.seek(start)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    if line.strip():
+                        try:
+                            record = json.loads(line)
+                            rows.append(index_row(record) + (file, offset, len(line)))
+                        except (json.JSONDecodeError, UnicodeDecodeError):
+                            logger.warning(f"Skipping unparseable line at byte {offset} of {filepath}")
+                    offset += len(line)
+                    if len(rows) >= INDEX_BATCH_SIZE:
+                        count += self._write(file, stat.st_ino, offset, rows)
+                        rows = []
+            count += self._write(file, stat.st_ino, offset, rows)
+        except Exception as e:
+            logger.error(f"Error indexing {filepath}: {str(e)}")
+            self.connection.rollback()
+            raise
+        if count:
+            logger.info(f"Indexed {count} outputs from {filepath}")
+        return count
+
+    def _write(self, file: str, inode: int, indexed_bytes: int, rows: List[Tuple]) -> int:
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO outputs (id, model, manipulation_type, successful_persuasion, context, score, "
+            "turn_count, fingerprint, prompt_id, file, offset, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (file, inode, indexed_bytes) VALUES (?, ?, ?)", (file, inode, indexed_bytes)
+        )
+        self.connection.commit()
+        return len(rows)
+
+    def _where(self, filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if column.startswith("min_") or column.startswith("max_"):
+                bound, name = column.split("_", 1)
+                if name not in FILTER_COLUMNS:
+                    raise ValueError(f"Unknown filter column: {name}")
+                clauses.append(f"{name} {'>=' if bound == 'min' else '<='} ?")
+            elif column in FILTER_COLUMNS:
+                clauses.append(f"{column} = ?")
+            else:
+                raise ValueError(f"Unknown filter column: {column}")
+            params.append(int(value) if isinstance(value, bool) else value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, **filters) -> int:
+        where, params = self._where(filters)
+        return self.connection.execute(f"SELECT COUNT(*) FROM outputs{where}", params).fetchone()[0]
+
+    def ids(self, limit: Optional[int] = None, **filters) -> List[str]:
+        where, params = self._where(filters)
+        query = f"SELECT id FROM outputs{where} ORDER BY file, offset"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return [row[0] for row in self.connection.execute(query, params)]
+
+    def records(self, limit: Optional[int] = None, **filters) -> Iterator[Dict[str, Any]]:
+        """Yield matching records read from the store at their indexed offsets, in file order."""
+        where, params = self._where(filters)
+        query = f"SELECT file, offset, length FROM outputs{where} ORDER BY file, offset"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        handles = {}
+        try:
+            for file, offset, length in self.connection.execute(query, params).fetchall():
+                if file not in handles:
+                    handles[file] = open(file, 'rb')
+                handles[file].seek(offset)
+                yield json.loads(handles[file].read(length))
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+    def fingerprints(self, **filters) -> Set[str]:
+        """Distinct prompt fingerprints (see utils.dedup.prompt_fingerprint) of the matching outputs."""
+        where, params = self._where(filters)
+        return {row[0] for row in self.connection.execute(f"SELECT DISTINCT fingerprint FROM outputs{where}", params)}
+
+    def counts(self, group_by: List[str], **filters) -> List[Dict[str, Any]]:
+        """Number of matching outputs for each combination of the group_by columns."""
+        for column in group_by:
+            if column not in GROUP_COLUMNS:
+                raise ValueError(f"Cannot group by {column}; choose from {', '.join(GROUP_COLUMNS)}")
+        where, params = self._where(filters)
+        columns = ", ".join(group_by)
+        rows = self.connection.execute(
+            f"SELECT {columns}, COUNT(*) FROM outputs{where} GROUP BY {columns} ORDER BY {columns}", params
+        ).fetchall()
+        return [dict(zip(list(group_by) + ["count"], row)) for row in rows]
+
+
+def set_index_enabled(enabled: bool):
+    global _index_enabled
+    _index_enabled = enabled
+    logger.info(f"Output index {'enabled' if enabled else 'disabled'}")
+
+
+def update_index(filename: str = OUTPUTS_FILENAME):
+    """
+    Bring the index up to date with a store file after outputs were appended to it.
+
+    Index failures are logged rather than raised: the outputs are already safely stored and
+    the index can be rebuilt from them with 'python -m utils.output_index rebuild'.
+    """
+    if not _index_enabled:
+        return
+    try:
+        with OutputIndex() as index:
+            index.sync(get_outputs_path(filename))
+    except Exception as e:
+        logger.warning(f"Could not update output index for {filename}: {str(e)}")
+
+
+def open_index(filename: str = OUTPUTS_FILENAME) -> OutputIndex:
+    """Open the index and catch it up with the store, for querying."""
+    index = OutputIndex()
+    index.sync(get_outputs_path(filename))
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Query the SQLite index of the JSONL output store")
+    parser.add_argument("command", choices=["query", "counts", "rebuild"],
+                        help="query: matching ids, records or a count; counts: totals per group; rebuild: reindex from scratch")
+    parser.add_argument("--input", default=OUTPUTS_FILENAME, help=f"JSONL file in CONVERSATIONS_PATH (default: {OUTPUTS_FILENAME})")
+    parser.add_argument("--model")
+    parser.add_argument("--manipulation-type")
+    parser.add_argument("--successful", dest="successful_persuasion", action="store_true", default=None)
+    parser.add_argument("--unsuccessful", dest="successful_persuasion", action="store_false")
+    parser.add_argument("--context")
+    parser.add_argument("--score", type=int)
+    parser.add_argument("--min-score", type=int)
+    parser.add_argument("--max-score", type=int)
+    parser.add_argument("--min-turns", dest="min_turn_count", type=int)
+    parser.add_argument("--max-turns", dest="max_turn_count", type=int)
+    parser.add_argument("--prompt-id", help="Shared prompt id of a fan-out run: the outputs of every model for that prompt")
+    parser.add_argument("--output", choices=["ids", "records", "count"], default="ids", help="What query prints (default: ids)")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--group-by", nargs="+", default=["model", "manipulation_type", "successful_persuasion"],
+                        choices=GROUP_COLUMNS, help="Columns counts groups by")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        with OutputIndex() as index:
+            index.reset()
+            index.sync(get_outputs_path(args.input))
+            print(index.count())
+    else:
+        filters = {
+            "model": args.model,
+            "manipulation_type": args.manipulation_type,
+            "successful_persuasion": args.successful_persuasion,
+            "context": args.context,
+            "score": args.score,
+            "min_score": args.min_score,
+            "max_score": args.max_score,
+            "min_turn_count": args.min_turn_count,
+            "max_turn_count": args.max_turn_count,
+            "prompt_id": args.prompt_id,
+        }
+        with open_index(args.input) as index:
+            if args.command == "counts":
+                for row in index.counts(args.group_by, **filters):
+                    print(json.dumps(row))
+            elif args.output == "count":
+                print(index.count(**filters))
+            elif args.output == "records":
+                for record in index.records(limit=args.limit, **filters):
+                    print(json.dumps(record))
+            else:
+                for output_id in index.ids(limit=args.limit, **filters):
+                    print(output_id)
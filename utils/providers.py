@@ -0,0 +1,192 @@
+import importlib
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from utils.batch import BatchBackend, DEFAULT_POLL_INTERVAL, run_batch as run_batch_job
+from utils.concurrency import run_prompts, DEFAULT_MAX_CONCURRENCY
+from utils.generate_prompt import build_prompts
+from utils.manifest import RunManifest
+from utils.rate_limit import RateLimiter, RetryPolicy
+from utils.response_cache import log_cache_stats
+from utils.telemetry import ProviderMetrics, write_metrics
+
+logger = logging.getLogger(__name__)
+
+API = "api"
+LOCAL = "local"
+
+# Built-in backends: name -> (module that registers it, mode). A module is imported the first
+# time its provider is looked up, so a run only loads the backend (and SDK) it uses.
+BUILTIN_PROVIDERS = {
+    "claude": ("apis.anthropic_api", API),
+    "fake": ("apis.fake_api", API),
+    "gemini": ("apis.google_api", API),
+    "gpt4": ("apis.openai_api", API),
+    "llama7b": ("local_models.llama3_7b", LOCAL),
+}
+
+_providers: Dict[str, "Provider"] = {}
+
+
+class Provider:
+    """
+    A model backend and the generation run shared by every backend.
+
+    A backend supplies its client setup and process_prompt functions (plus optional streaming,
+    rate limiting, retries and a batch API); run() handles prompt building, the run manifest,
+    concurrency, caching, retries and checkpointing. Backends whose generation does not go
+    prompt by prompt through run_prompts (e.g. batched local models) override generate().
+    Each run records request telemetry in metrics (costed at prices, USD per million
+    input and output tokens) and writes a summary when it ends.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model_name: str,
+        setup_client: Callable[[], Any],
+        process_prompt: Optional[Callable[[Any, Dict], Dict]] = None,
+        process_prompt_streaming: Optional[Callable[[Any, Dict], Dict]] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        batch_backend: Optional[Callable[[Any], BatchBackend]] = None,
+        mode: str = API,
+        api_key_env: Optional[str] = None,
+        prices: Optional[Tuple[float, float]] = None,
+    ):
+        self.name = name
+        self.model_name = model_name
+        self.setup_client = setup_client
+        self.process_prompt = process_prompt
+        self.process_prompt_streaming = process_prompt_streaming
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.batch_backend = batch_backend
+        self.mode = mode
+        self.api_key_env = api_key_env
+        self.metrics = ProviderMetrics(name, model_name, prices)
+
+    @property
+    def supports_batch(self) -> bool:
+        return self.batch_backend is not None
+
+    def generate(self, prompts: List[Dict], on_checkpoint: Callable[[List[Dict]], None],
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, stream: bool = False, **options) -> List[Dict]:
+        """Generate outputs for prompts, handing completed outputs to on_checkpoint as they land."""
+        process_fn = self.process_prompt_streaming if stream else self.process_prompt
+        if process_fn is None:
+            raise ValueError(f"Provider {self.name} does not support {'streaming' if stream else 'per-prompt'} generation")
+        client = self.setup_client()
+        return run_prompts(process_fn, client, prompts, max_concurrency=max_concurrency, on_checkpoint=on_checkpoint,
+                           rate_limiter=self.rate_limiter, retry_policy=self.retry_policy, metrics=self.metrics)
+
+    def run(self, n: int, resume: Optional[str] = None, quota: Union[int, Dict] = None, seed: Optional[int] = None,
+            **options) -> List[Dict]:
+        """
+        Build n prompts (or plan them from quota), record them in a run manifest and generate them.
+
+        With resume, only the unfinished prompts of that run are dispatched. Remaining
+        keyword options (max_concurrency, stream, batch_size, ...) go to generate().
+
+        Returns:
+        List[Dict]: The outputs generated in this call.
+        """
+        logger.info(f"Starting {self.name} model run with n={n}")
+        try:
+            if resume:
+                manifest = RunManifest.load(resume, model=self.model_name)
+                logger.info(f"Resuming run {resume} with {len(manifest.pending_prompts())} pending prompts")
+            else:
+                prompts = build_prompts(n, self.model_name, quota, seed)
+                logger.info(f"Generated {len(prompts)} prompts")
+                manifest = RunManifest.create(self.model_name, prompts)
+        except Exception as e:
+            logger.error(f"Error in {self.name} run: {str(e)}")
+            raise
+        return self.run_manifest(manifest, **options)
+
+    def create_run(self, plan: List[Dict]) -> RunManifest:
+        """
+        Persist a prompt plan shared with other providers as a new run of this provider.
+
+        Each prompt is copied with the plan's id kept as prompt_id, and the run assigns its
+        own output ids, so the outputs of every provider for a prompt can be paired.
+        """
+        return RunManifest.create(self.model_name, [dict(prompt, prompt_id=prompt["id"]) for prompt in plan])
+
+    def run_manifest(self, manifest: RunManifest, **options) -> List[Dict]:
+        """
+        Generate the unfinished prompts of a run. Keyword options go to generate().
+
+        Returns:
+        List[Dict]: The outputs generated in this call.
+        """
+        self.metrics.reset()
+        try:
+            prompts = manifest.pending_prompts()
+            logger.debug(f"Prompts: {prompts}")
+            outputs = self.generate(prompts, manifest.checkpoint, **options)
+            logger.info(f"Saved {len(outputs)} outputs")
+            log_cache_stats()
+            logger.info(f"{self.name} run {manifest.run_id} completed successfully")
+            return outputs
+        except Exception as e:
+            logger.error(f"Error in {self.name} run {manifest.run_id}: {str(e)}")
+            raise
+        finally:
+            write_metrics(self.metrics, manifest.run_id)
+
+    def run_batch(self, n: int, job_id: Optional[str] = None, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                  quota: Union[int, Dict] = None, seed: Optional[int] = None) -> int:
+        """
+        Submit the prompts through the provider's batch API (or pick up job_id) and collect the results.
+
+        Returns:
+        int: The number of outputs saved.
+
+        Raises:
+        ValueError: If the provider has no batch API.
+        """
+        if not self.supports_batch:
+            raise ValueError(f"Provider {self.name} has no batch API")
+        logger.info(f"Starting {self.name} batch run with n={n}")
+        try:
+            backend = self.batch_backend(self.setup_client())
+            prompts = None
+            if not job_id:
+                prompts = build_prompts(n, self.model_name, quota, seed)
+                logger.info(f"Generated {len(prompts)} prompts")
+            saved = run_batch_job(backend, prompts, job_id=job_id, poll_interval=poll_interval)
+            logger.info(f"Batch run completed successfully; saved {saved} outputs")
+            return saved
+        except Exception as e:
+            logger.error(f"Error in {self.name} batch run: {str(e)}")
+            raise
+
+
+def register_provider(provider: Provider) -> Provider:
+    """Add a provider to the registry under its name, replacing any provider of that name."""
+    _providers[provider.name] = provider
+    return provider
+
+
+def get_provider(name: str) -> Provider:
+    """
+    The provider registered under name, importing its backend module first if it is built in.
+
+    Raises:
+    ValueError: If no provider of that name exists.
+    """
+    if name not in _providers and name in BUILTIN_PROVIDERS:
+        importlib.import_module(BUILTIN_PROVIDERS[name][0])
+    try:
+        return _providers[name]
+    except KeyError:
+        logger.error(f"Unknown provider: {name}")
+        raise ValueError(f"Unknown provider {name}; choose from {', '.join(list_providers())}")
+
+
+def list_providers(mode: Optional[str] = None) -> List[str]:
+    """Names of the built-in and registered providers, optionally of one mode, without importing any backend."""
+    modes = {name: provider_mode for name, (_, provider_mode) in BUILTIN_PROVIDERS.items()}
+    modes.update((name, provider.mode) for name, provider in _providers.items())
+    return sorted(name for name, provider_mode in modes.items() if mode is None or provider_mode == mode)
@@ -0,0 +1,211 @@
+import logging
+import random
+import threading
+import time
+from typing import Any, Mapping, Optional
+from utils.prompt_templates import render_prompt
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "RateLimitError",
+    "InternalServerError",
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+}
+
+# Response headers carrying the current limits, per provider
+LIMIT_HEADERS = {
+    "requests": ("x-ratelimit-limit-requests", "anthropic-ratelimit-requests-limit"),
+    "tokens": ("x-ratelimit-limit-tokens", "anthropic-ratelimit-tokens-limit"),
+}
+REMAINING_HEADERS = {
+    "requests": ("x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining"),
+    "tokens": ("x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining"),
+}
+
+
+def _header_number(headers: Mapping[str, str], names) -> Optional[float]:
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            logger.debug(f"Ignoring non-numeric rate limit header {name}: {value}")
+    return None
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """Return the HTTP status of a provider error (OpenAI/Anthropic status_code, Google code)."""
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return int(value)
+    return None
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Return the retry-after delay in seconds from a provider error, if the server sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    return _header_number(headers, ("retry-after",))
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error raised by process_prompt is transient and worth retrying."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if get_status_code(error) in RETRYABLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def is_throttled(error: BaseException) -> bool:
+    return get_status_code(error) == 429 or type(error).__name__ in ("RateLimitError", "ResourceExhausted")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket holding up to `capacity` units, refilled continuously at `rate` units per second.
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.available = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Refill, then return how long until `amount` units are available (0 if they are now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Per-provider requests/min and tokens/min budget shared by all worker threads.
+
+    Limits start at the configured values and adapt: a 429 halves the effective rate and
+    pauses every caller for the server's retry-after, while each success recovers a small
+    step back towards the ceiling. Rate limit headers, when a provider sends them, replace
+    the configured ceiling and the current budget with the server's own numbers.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float] = None,
+        max_output_tokens: int = 0,
+        name: str = "provider",
+    ):
+        self.name = name
+        self.max_output_tokens = max_output_tokens
+        self.max_requests_per_minute = requests_per_minute
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        self.max_tokens_per_minute = tokens_per_minute
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def estimate_tokens(self, prompt: Any) -> int:
+        """Rough token cost of a prompt: ~4 characters per input token plus the output budget."""
+        if isinstance(prompt, dict):
+            text = render_prompt(prompt) if "prompt" in prompt or "template_id" in prompt else ""
+        else:
+            text = str(prompt)
+        return len(text) // 4 + self.max_output_tokens
+
+    def acquire(self, tokens: int = 0):
+        """Block until one request and `tokens` tokens fit in the budget, then consume them."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                delay = max(0.0, self.paused_until - now)
+                delay = max(delay, self.requests.wait_time(1, now))
+                if self.tokens is not None and tokens:
+                    delay = max(delay, self.tokens.wait_time(tokens, now))
+                if delay <= 0:
+                    self.requests.take(1)
+                    if self.tokens is not None and tokens:
+                        self.tokens.take(tokens)
+                    return
+            time.sleep(delay)
+
+    def on_success(self):
+        """Additively recover the request rate after a successful call."""
+        with self.lock:
+            bucket = self.requests
+            if bucket.rate * 60 < self.max_requests_per_minute:
+                bucket.rate = min(self.max_requests_per_minute / 60, bucket.rate + self.max_requests_per_minute / 60 / 20)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Halve the request rate and, if the server said how long to wait, pause all callers."""
+        with self.lock:
+            bucket = self.requests
+            bucket.rate = max(bucket.rate / 2, 1 / 60)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            logger.warning(f"{self.name} throttled; request rate reduced to {bucket.rate * 60:.1f}/min")
+
+    def update_from_headers(self, headers: Optional[Mapping[str, str]]):
+        """Adopt the limits and remaining budget reported in a response's rate limit headers."""
+        if not headers:
+            return
+        with self.lock:
+            now = time.monotonic()
+            for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                if bucket is None:
+                    continue
+                limit = _header_number(headers, LIMIT_HEADERS[kind])
+                if limit:
+                    bucket._refill(now)
+                    bucket.capacity = limit
+                    bucket.rate = limit / 60
+                    if kind == "requests":
+                        self.max_requests_per_minute = limit
+                    else:
+                        self.max_tokens_per_minute = limit
+                remaining = _header_number(headers, REMAINING_HEADERS[kind])
+                if remaining is not None:
+                    bucket._refill(now)
+                    bucket.available = min(bucket.available, remaining)
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff for transient provider errors.
+
+    The delay before attempt k is drawn uniformly from [0, min(max_delay, base_delay * 2**k)]
+    ("full jitter"), unless the server asked for a longer retry-after.
+    """
+
+    def __init__(self, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        return attempt < self.max_retries and is_retryable(error)
+
+    def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = get_retry_after(error) if error is not None else None
+        return max(backoff, retry_after or 0.0)
@@ -0,0 +1,179 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from utils.prompt_templates import render_prompt
+from utils.save_outputs import CONVERSATIONS_PATH
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(CONVERSATIONS_PATH, "cache", "responses.sqlite"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(1024 ** 3)))
+
+_cache = None
+_cache_lock = threading.Lock()
+_cache_enabled = os.getenv("RESPONSE_CACHE", "1") != "0"
+
+
+def cache_key(model: str, temperature: Optional[float], max_tokens: Optional[int], prompt: str, stream: bool = False) -> str:
+    """
+    Content hash of everything that determines a completion.
+
+    Streamed completions stop once the conversation's score line arrives, so they are keyed
+    apart from full ones; non-streamed keys are unchanged from earlier caches.
+    """
+    parts = [model, temperature, max_tokens, prompt] + (["stream"] if stream else [])
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk SQLite cache of completions keyed by cache_key, with size-based LRU eviction.
+
+    Every hit refreshes the entry's last access time; when the stored completions exceed
+    max_bytes the least recently used entries are deleted. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, completion TEXT, size INTEGER, last_access REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute("SELECT completion FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, completion: str):
+        size = len(completion.encode("utf-8"))
+        with self.lock:
+            old = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, completion, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model, completion, size, time.time()),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes,
+        }
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def set_cache_enabled(enabled: bool):
+    global _cache_enabled
+    _cache_enabled = enabled
+    logger.info(f"Response cache {'enabled' if enabled else 'disabled'}")
+
+
+def log_cache_stats():
+    if _cache_enabled and _cache is not None:
+        logger.info(f"Response cache stats: {_cache.stats()}")
+
+
+def cached_completion(model: str, temperature: Optional[float] = None, max_tokens: Optional[int] = None, stream: bool = False) -> Callable:
+    """
+    Decorator for process_prompt(client, prompt) functions.
+
+    Looks the prompt up in the response cache first and, on a hit, returns the output
+    without calling the provider. On a miss the completion is stored after the call.
+    The two halves are also exposed as cache_lookup(prompt) and cache_fill(client, prompt)
+    so run_prompts can serve hits without spending rate limit budget on them, and
+    cache_store(prompt, output) records outputs produced outside process_fn (e.g. batched).
+
+    Pass stream=True for process_prompt_streaming functions, whose early-stopped
+    completions must not be replayed as full ones (or the other way round).
+    """
+    def decorator(process_fn: Callable[[Any, Dict], Dict]) -> Callable[[Any, Dict], Dict]:
+        def cache_lookup(prompt: Dict) -> Optional[Dict]:
+            if not _cache_enabled:
+                return None
+            completion = get_response_cache().get(cache_key(model, temperature, max_tokens, render_prompt(prompt), stream))
+            if completion is None:
+                return None
+            logger.debug(f"Response cache hit for prompt {prompt.get('id')}")
+            output = prompt.copy()
+            output["model"] = model
+            output["chat_completion"] = completion
+            return output
+
+        def cache_store(prompt: Dict, output: Dict):
+            if _cache_enabled and isinstance(output.get("chat_completion"), str):
+                key = cache_key(model, temperature, max_tokens, render_prompt(prompt), stream)
+                get_response_cache().put(key, model, output["chat_completion"])
+
+        def cache_fill(client: Any, prompt: Dict) -> Dict:
+            output = process_fn(client, prompt)
+            cache_store(prompt, output)
+            return output
+
+        @functools.wraps(process_fn)
+        def wrapper(client: Any, prompt: Dict) -> Dict:
+            output = cache_lookup(prompt)
+            if output is not None:
+                return output
+            return cache_fill(client, prompt)
+
+        wrapper.cache_lookup = cache_lookup
+        wrapper.cache_fill = cache_fill
+        wrapper.cache_store = cache_store
+        return wrapper
+    return decorator
@@ -1,64 +1,80 @@
 import logging
 import json
 import os
+import threading
 import uuid
-import re
+import textwrap
+from utils.turns import find_conversation_start
 
 logger = logging.getLogger(__name__)
 CONVERSATIONS_PATH = os.getenv("CONVERSATIONS_PATH", "data")
+OUTPUTS_FILENAME = "outputs.jsonl"
+LEGACY_OUTPUTS_FILENAME = "outputs.json"
+# Serializes appends (and the index update after them) from runs sharing the store, e.g. a fan-out
+_store_lock = threading.Lock()
 
 
 def remove_prompt_from_output(output):
     if "chat_completion" in output and isinstance(output["chat_completion"], str):
-        # Define potential prompt start and end patterns
-        prompt_start_patterns = [
-            r"user: You are the AI in this conversation",
-            r"You are the AI in this context:",
-            r"Generate a realistic conversation between the agent and the user\."
-        ]
-        prompt_end_patterns = [
-            r"\n@@@USER:",
-            r"\n@@@AGENT:",
-            r"\n```\n@@@USER:"
-        ]
-        
         chat_completion = output["chat_completion"]
-        
-        # Find the start of the prompt
-        prompt_start = -1
-        for pattern in prompt_start_patterns:
-            match = re.search(pattern, chat_completion)
-            if match:
-                prompt_start = match.start()
-                break
-        
-        # Find the end of the prompt
-        prompt_end = -1
-        if prompt_start != -1:
-            for pattern in prompt_end_patterns:
-                match = re.search(pattern, chat_completion[prompt_start:])
-                if match:
-                    prompt_end = prompt_start + match.start()
-                    break
-        
-        # Remove the prompt if both start and end are found
-        if prompt_start != -1 and prompt_end != -1:
-            output["chat_completion"] = chat_completion[prompt_end:].strip()
-        else:
-            # If we couldn't find a clear prompt, try a more aggressive approach
-            # Look for the first occurrence of @@@USER: or @@@AGENT:
-            first_turn = re.search(r'@@@(USER|AGENT):', chat_completion)
-            if first_turn:
-                output["chat_completion"] = chat_completion[first_turn.start():].strip()
+
+        # Cut any echoed prompt: keep from the first conversation turn after it, or
+        # failing that from the first @@@USER: / @@@AGENT: turn
+        conversation_start = find_conversation_start(chat_completion)
+        if conversation_start != -1:
+            output["chat_completion"] = chat_completion[conversation_start:].strip()
     
     return output
 
-def save_outputs(outputs, filename="outputs.json"):
+def get_outputs_path(filename=OUTPUTS_FILENAME):
+    return os.path.join(CONVERSATIONS_PATH, filename)
+
+def append_records(records, filepath):
+    """
+    Append records to a JSONL file, one JSON object per line, and fsync the batch.
+
+    Only the new records are serialized; nothing already in the file is read or rewritten.
+    """
+    if not records:
+        return
+    payload = "".join(json.dumps(record) + "\n" for record in records)
+    # Start on a fresh line if a previous batch was torn mid-write
+    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+        with open(filepath, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                payload = "\n" + payload
+    with open(filepath, 'a') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+def iter_outputs(filename=OUTPUTS_FILENAME):
+    """
+    Yield the records stored in a JSONL output file, in the order they were written.
+
+    A line that cannot be parsed (e.g. a batch torn by a crash mid-write) is logged and skipped.
+    """
+    filepath = get_outputs_path(filename)
+    if not os.path.exists(filepath):
+        logger.info(f"No existing file found at {filepath}.")
+        return
+    with open(filepath, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unparseable line {line_number} in {filepath}")
+
+def save_outputs(outputs, filename=OUTPUTS_FILENAME):
     if not isinstance(outputs, list):
         logger.error("Invalid input: outputs must be a list")
         raise ValueError("outputs must be a list")
 
-    filepath = os.path.join(CONVERSATIONS_PATH, filename)
+    filepath = get_outputs_path(filename)
     logger.info(f"Attempting to save outputs to {filepath}")
 
     try:
@@ -66,40 +82,90 @@ def save_outputs(outputs, filename="outputs.json"):
             os.makedirs(CONVERSATIONS_PATH)
             logger.info(f"Created directory: {CONVERSATIONS_PATH}")
 
-        existing_outputs = []
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r') as f:
-                    file_content = f.read().strip()
-                    if file_content:  # Check if the file is not empty
-                        existing_outputs = json.loads(file_content)
-                    else:
-                        logger.warning(f"File {filepath} is empty. Starting with an empty list.")
-                logger.info(f"Loaded {len(existing_outputs)} existing outputs from {filepath}")
-            except json.JSONDecodeError:
-                logger.warning(f"Failed to parse existing JSON in {filepath}. Starting with an empty list.")
-        else:
-            logger.info(f"No existing file found at {filepath}. Starting with empty list.")
-
-        # Check and add UUID to each conversation, and remove prompt from output
-        for conversation in existing_outputs + outputs:
+        # Check and add UUID to each new conversation, and remove prompt from output
+        for conversation in outputs:
             if "id" not in conversation or not conversation["id"]:
                 conversation["id"] = str(uuid.uuid4())
                 logger.info(f"Added UUID {conversation['id']} to a conversation")
-            
+
             # Remove prompt from output
             conversation = remove_prompt_from_output(conversation)
 
-        existing_outputs.extend(outputs)
-        logger.info(f"Added {len(outputs)} new outputs. Total outputs: {len(existing_outputs)}")
-
-        with open(filepath, 'w') as f:
-            json.dump(existing_outputs, f, indent=4)
-        logger.info(f"Successfully saved {len(existing_outputs)} outputs to {filepath}")
+        # Imported here: the index module builds on this one
+        from utils.output_index import update_index
+        with _store_lock:
+            append_records(outputs, filepath)
+            logger.info(f"Successfully appended {len(outputs)} outputs to {filepath}")
+            update_index(filename)
 
     except PermissionError:
         logger.error(f"Permission denied when trying to write to {filepath}")
         raise
     except Exception as e:
         logger.error(f"An unexpected error occurred: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def compact_outputs(filename=OUTPUTS_FILENAME):
+    """
+    Rewrite a JSONL output file without torn lines and with one record per id.
+
+    When an id appears more than once (e.g. a prompt that was retried) the last record wins.
+    Only the ids are held in memory; records are streamed from the old file to the new one.
+
+    Returns:
+    int: The number of records kept.
+    """
+    filepath = get_outputs_path(filename)
+    last_index = {}
+    for i, record in enumerate(iter_outputs(filename)):
+        last_index[record.get("id")] = i
+
+    keep = set(last_index.values())
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, 'w') as f:
+        for i, record in enumerate(iter_outputs(filename)):
+            if i in keep:
+                f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+    logger.info(f"Compacted {filepath} to {len(keep)} outputs")
+    return len(keep)
+
+def export_outputs(filename=OUTPUTS_FILENAME, export_filename=LEGACY_OUTPUTS_FILENAME):
+    """
+    Export a JSONL output file to the legacy pretty-printed JSON array format.
+
+    Records are streamed, so the export never holds the whole store in memory.
+
+    Returns:
+    int: The number of records exported.
+    """
+    export_path = get_outputs_path(export_filename)
+    tmp_path = export_path + ".tmp"
+    count = 0
+    with open(tmp_path, 'w') as f:
+        f.write("[")
+        for record in iter_outputs(filename):
+            f.write(",\n" if count else "\n")
+            f.write(textwrap.indent(json.dumps(record, indent=4), "    "))
+            count += 1
+        f.write("\n]" if count else "]")
+    os.replace(tmp_path, export_path)
+    logger.info(f"Exported {count} outputs to {export_path}")
+    return count
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Maintain the JSONL output store")
+    parser.add_argument("command", choices=["export", "compact"], help="export: write the legacy JSON array; compact: drop torn lines and duplicate ids")
+    parser.add_argument("--input", default=OUTPUTS_FILENAME, help=f"JSONL file in CONVERSATIONS_PATH (default: {OUTPUTS_FILENAME})")
+    parser.add_argument("--output", default=LEGACY_OUTPUTS_FILENAME, help=f"Export file in CONVERSATIONS_PATH (default: {LEGACY_OUTPUTS_FILENAME})")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_outputs(args.input, args.output)
+    else:
+        compact_outputs(args.input)
@@ -0,0 +1,103 @@
+import logging
+import re
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_MARKER = "@@@SYSTEM"
+SCORE_PATTERN = re.compile(r"score\D{0,20}?(10|[1-9])\b[^\n]*\n", re.IGNORECASE)
+# Rough characters per token, used when a provider does not report usage
+CHARS_PER_TOKEN = 4
+
+
+class SystemMessageDetector:
+    """
+    Incrementally scans generated text for the closing '@@@SYSTEM:' message.
+
+    The conversation is complete once the system message has been opened and a line with
+    its 1-10 score has been finished (the newline after the score has arrived). Each feed
+    only rescans the tail that could still contain a partial marker.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.system_start = -1
+        self.end = -1
+        self._scan_from = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end != -1
+
+    def feed(self, chunk: str) -> bool:
+        if self.complete or not chunk:
+            return self.complete
+        self.text += chunk
+        if self.system_start == -1:
+            index = self.text.find(SYSTEM_MARKER, self._scan_from)
+            if index == -1:
+                self._scan_from = max(0, len(self.text) - len(SYSTEM_MARKER) + 1)
+                return False
+            self.system_start = index
+            self._scan_from = index
+        match = SCORE_PATTERN.search(self.text, self._scan_from)
+        if match:
+            self.end = match.end()
+        else:
+            # The score line can only start at the last unfinished line
+            self._scan_from = max(self.system_start, self.text.rfind("\n", self._scan_from) + 1)
+        return self.complete
+
+    def result(self) -> str:
+        """The text up to and including the score line if complete, otherwise everything seen."""
+        return self.text[:self.end].rstrip() if self.complete else self.text
+
+
+class StreamMetrics:
+    """Wall-clock timings of one streamed generation."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+
+    def on_chunk(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def summary(self, text: str, output_tokens: Optional[int] = None, stopped_early: bool = False) -> Dict[str, Any]:
+        self.finished_at = time.perf_counter()
+        estimated = output_tokens is None
+        if estimated:
+            output_tokens = max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+        duration = self.finished_at - self.started
+        generating = self.finished_at - (self.first_token_at or self.started)
+        return {
+            "time_to_first_token": (self.first_token_at - self.started) if self.first_token_at else None,
+            "duration": duration,
+            "output_tokens": output_tokens,
+            "output_tokens_estimated": estimated,
+            "tokens_per_second": output_tokens / generating if generating > 0 else None,
+            "stopped_early": stopped_early,
+        }
+
+
+def consume_stream(chunks: Iterable[str], stop_early: bool = True) -> Tuple[str, Dict[str, Any]]:
+    """
+    Read text chunks from a provider stream, stopping once the system message and score are complete.
+
+    Breaking out of the loop lets the caller close the stream, which ends generation on the
+    provider's side. Returns the text (cut after the score line when stopped early) and the
+    stream metrics; output tokens are estimated from the text length.
+    """
+    metrics = StreamMetrics()
+    detector = SystemMessageDetector()
+    stopped_early = False
+    for chunk in chunks:
+        metrics.on_chunk()
+        if detector.feed(chunk or "") and stop_early:
+            stopped_early = True
+            break
+    text = detector.result() if stopped_early else detector.text
+    return text, metrics.summary(text, stopped_early=stopped_early)
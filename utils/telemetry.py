@@ -0,0 +1,262 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from utils.save_outputs import CONVERSATIONS_PATH
+from utils.streaming import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = os.getenv("METRICS_PATH", os.path.join(CONVERSATIONS_PATH, "metrics"))
+# Directory scraped by node_exporter's textfile collector; no Prometheus file is written when unset
+PROMETHEUS_TEXTFILE_DIR = os.getenv("PROMETHEUS_TEXTFILE_DIR")
+PROMETHEUS_PREFIX = "manipulation_datasets"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+METRIC_TYPES = {
+    "requests_total": "counter",
+    "errors_total": "counter",
+    "retries_total": "counter",
+    "cache_hits_total": "counter",
+    "input_tokens_total": "counter",
+    "output_tokens_total": "counter",
+    "cost_usd_total": "counter",
+    "request_latency_seconds": "histogram",
+    "output_tokens": "histogram",
+}
+
+_metrics: Dict[str, "ProviderMetrics"] = {}
+_metrics_lock = threading.Lock()
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram in the Prometheus layout: cumulative bucket counts, sum and count.
+
+    Observing is a bisect and a few additions, so it can sit on every request. Quantiles are
+    estimated by linear interpolation inside the bucket they fall in, clamped to the observed
+    min and max so a coarse bucket cannot report values that were never seen.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        return min(max(self._interpolate(q), self.min), self.max)
+
+    def _interpolate(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    # Past the last bound there is nothing to interpolate towards
+                    return lower
+                return lower + (self.bounds[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.bounds[-1]
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, count) pairs of the cumulative buckets, ending with +Inf."""
+        pairs, total = [], 0
+        for bound, bucket_count in zip(list(self.bounds) + ["+Inf"], self.counts):
+            total += bucket_count
+            pairs.append((str(bound), total))
+        return pairs
+
+    def summary(self) -> Dict[str, Any]:
+        summary = {"count": self.count, "sum": round(self.sum, 6), "mean": self.sum / self.count if self.count else None,
+                   "min": round(self.min, 6) if self.min is not None else None,
+                   "max": round(self.max, 6) if self.max is not None else None}
+        for q in SUMMARY_QUANTILES:
+            value = self.quantile(q)
+            summary[f"p{int(q * 100)}"] = round(value, 6) if value is not None else None
+        return summary
+
+
+def token_counts(prompt: Dict[str, Any], output: Dict[str, Any]) -> Tuple[int, int, bool]:
+    """
+    Input and output tokens of a request, and whether they were estimated.
+
+    Uses the usage the provider reported in output["usage"] when present; otherwise both
+    are estimated from text length (the prompt is only rendered in that case).
+    """
+    usage = output.get("usage")
+    if usage:
+        return usage.get("input_tokens") or 0, usage.get("output_tokens") or 0, False
+    # Imported here: only needed when the provider did not report usage
+    from utils.prompt_templates import render_prompt
+
+    completion = output.get("chat_completion")
+    input_tokens = len(render_prompt(prompt)) // CHARS_PER_TOKEN if "prompt" in prompt or "template_id" in prompt else 0
+    output_tokens = len(completion) // CHARS_PER_TOKEN if isinstance(completion, str) else 0
+    return input_tokens, output_tokens, True
+
+
+class ProviderMetrics:
+    """
+    Request counters and histograms for one provider.
+
+    Tracks requests, errors, retries, response cache hits, input/output tokens, estimated
+    cost (from the provider's per-million-token prices) and histograms of request latency
+    (failed calls included) and output tokens. Safe to record from the worker threads of run_prompts. reset() starts the
+    counters over, e.g. at the start of each run.
+    """
+
+    def __init__(self, provider: str, model: str, prices: Optional[Tuple[float, float]] = None):
+        self.provider = provider
+        self.model = model
+        self.prices = prices
+        self.lock = threading.Lock()
+        self.reset()
+        # Latest metrics per provider name, for the Prometheus textfile
+        with _metrics_lock:
+            _metrics[provider] = self
+
+    def reset(self):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.estimated_requests = 0
+        self.cost = 0.0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.tokens = Histogram(TOKEN_BUCKETS)
+
+    def record_request(self, latency: float, prompt: Dict[str, Any], output: Dict[str, Any]):
+        input_tokens, output_tokens, estimated = token_counts(prompt, output)
+        with self.lock:
+            self.requests += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.estimated_requests += estimated
+            if self.prices is not None:
+                self.cost += (input_tokens * self.prices[0] + output_tokens * self.prices[1]) / 1_000_000
+            self.latency.observe(latency)
+            self.tokens.observe(output_tokens)
+
+    def record_error(self, latency: float):
+        with self.lock:
+            self.errors += 1
+            self.latency.observe(latency)
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_cache_hit(self):
+        with self.lock:
+            self.cache_hits += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {
+                "provider": self.provider,
+                "model": self.model,
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "cache_hits": self.cache_hits,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "tokens_estimated_requests": self.estimated_requests,
+                "output_tokens_per_second": self.output_tokens / elapsed if elapsed > 0 else None,
+                "estimated_cost_usd": round(self.cost, 6) if self.prices is not None else None,
+                "latency_seconds": self.latency.summary(),
+                "output_tokens_per_request": self.tokens.summary(),
+            }
+
+    def prometheus_samples(self) -> Dict[str, List[str]]:
+        """Sample lines in the Prometheus text format, by metric name (see METRIC_TYPES)."""
+        labels = f'provider="{self.provider}",model="{self.model}"'
+        samples = {}
+        with self.lock:
+            for name, value in (("requests_total", self.requests), ("errors_total", self.errors),
+                                ("retries_total", self.retries), ("cache_hits_total", self.cache_hits),
+                                ("input_tokens_total", self.input_tokens), ("output_tokens_total", self.output_tokens),
+                                ("cost_usd_total", self.cost)):
+                samples[name] = [f"{PROMETHEUS_PREFIX}_{name}{{{labels}}} {value}"]
+            for name, histogram in (("request_latency_seconds", self.latency), ("output_tokens", self.tokens)):
+                samples[name] = [f'{PROMETHEUS_PREFIX}_{name}_bucket{{{labels},le="{le}"}} {count}'
+                                 for le, count in histogram.cumulative()]
+                samples[name].append(f"{PROMETHEUS_PREFIX}_{name}_sum{{{labels}}} {histogram.sum}")
+                samples[name].append(f"{PROMETHEUS_PREFIX}_{name}_count{{{labels}}} {histogram.count}")
+        return samples
+
+
+def prometheus_text(metrics: Optional[List[ProviderMetrics]] = None) -> str:
+    """All provider metrics in the Prometheus text exposition format."""
+    metrics = list(_metrics.values()) if metrics is None else metrics
+    samples = [provider_metrics.prometheus_samples() for provider_metrics in metrics]
+    lines = []
+    for name, kind in METRIC_TYPES.items():
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+        for provider_samples in samples:
+            lines.extend(provider_samples[name])
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, text: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_metrics(metrics: ProviderMetrics, run_id: str) -> str:
+    """
+    Log a provider's metrics and write them as a JSON summary for the run.
+
+    With PROMETHEUS_TEXTFILE_DIR set, the metrics of every provider are also written there
+    as a textfile (replaced atomically, as the textfile collector requires). Failures are
+    logged rather than raised: the run's outputs are already saved.
+
+    Returns:
+    str: Path of the JSON summary.
+    """
+    summary = dict(metrics.summary(), run_id=run_id)
+    latency = summary["latency_seconds"]
+    message = (
+        f"{metrics.provider} metrics: {summary['requests']} requests, {summary['errors']} errors, "
+        f"{summary['retries']} retries, {summary['cache_hits']} cache hits, "
+        f"{summary['input_tokens']}/{summary['output_tokens']} input/output tokens"
+    )
+    if latency["count"]:
+        message += f", p50/p99 latency {latency['p50']:.2f}/{latency['p99']:.2f}s"
+    if summary["estimated_cost_usd"] is not None:
+        message += f", estimated cost ${summary['estimated_cost_usd']:.4f}"
+    logger.info(message)
+    path = os.path.join(METRICS_PATH, f"{run_id}-{metrics.provider}.json")
+    try:
+        _write_atomic(path, json.dumps(summary, indent=4))
+        if PROMETHEUS_TEXTFILE_DIR:
+            _write_atomic(os.path.join(PROMETHEUS_TEXTFILE_DIR, f"{PROMETHEUS_PREFIX}.prom"), prometheus_text())
+    except OSError as e:
+        logger.warning(f"Could not write metrics for run {run_id}: {str(e)}")
+    return path
@@ -0,0 +1,126 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+PROMPT_START_PHRASES = (
+    "user: You are the AI in this conversation",
+    "You are the AI in this context:",
+    "Generate a realistic conversation between the agent and the user.",
+)
+ROLE_PATTERN = re.compile(r"\s*(?:(system)|(agent|user))", re.IGNORECASE)
+MARKER = "@@@"
+SCORE_PATTERN = re.compile(r"score\D{0,20}?(10|[1-9])\b", re.IGNORECASE)
+
+
+class ScanResult:
+    """
+    Turn marker positions found by a single scan of a completion.
+
+    boundaries holds the offsets where text.split('@@@') would cut, and marker_ends the
+    offsets just past each run of three or more '@' (where a role label would follow).
+    """
+
+    def __init__(self, boundaries: List[int], marker_ends: List[int]):
+        self.boundaries = boundaries
+        self.marker_ends = marker_ends
+
+
+def scan(text: str) -> ScanResult:
+    # str.find is a C-level substring search; a regex alternation here is several times slower
+    boundaries = []
+    marker_ends = []
+    start = text.find(MARKER)
+    while start != -1:
+        end = start + len(MARKER)
+        while text.startswith("@", end):
+            end += 1
+        # str.split('@@@') cuts a run of k '@' every three characters
+        boundaries.extend(range(start, end - 2, 3))
+        marker_ends.append(end)
+        start = text.find(MARKER, end)
+    return ScanResult(boundaries, marker_ends)
+
+
+def remove_brackets(content: str) -> str:
+    """
+    Remove '<<' with the whitespace after it and '>>' with the whitespace before it.
+
+    Same result as re.sub(r'<<\\s*|\\s*>>', '', content), but built from str.split and
+    strip, which avoids trying the pattern at every character.
+    """
+    # Markers cannot overlap ('<' vs '>'), so each '>>' segment can be handled on its own
+    segments = content.split(">>")
+    for i, segment in enumerate(segments):
+        if i < len(segments) - 1:
+            segment = segment.rstrip()
+        if "<<" in segment:
+            first, *rest = segment.split("<<")
+            segment = first + "".join(piece.lstrip() for piece in rest)
+        segments[i] = segment
+    return "".join(segments)
+
+
+def find_conversation_start(text: str, result: Optional[ScanResult] = None) -> int:
+    """
+    Offset where the conversation starts in a completion that may echo its prompt, or -1.
+
+    If a prompt opening is found (in PROMPT_START_PHRASES priority order), the conversation
+    starts at the first '\\n@@@USER:' after it, else the first '\\n@@@AGENT:'. Otherwise it
+    starts at the first '@@@USER:' or '@@@AGENT:' anywhere.
+    """
+    result = result or scan(text)
+    prompt_start = -1
+    for phrase in PROMPT_START_PHRASES:
+        prompt_start = text.find(phrase)
+        if prompt_start != -1:
+            break
+
+    if prompt_start != -1:
+        for label in ("USER:", "AGENT:"):
+            for end in result.marker_ends:
+                position = end - len(MARKER) - 1
+                if position >= prompt_start and text[position] == "\n" and text.startswith(label, end):
+                    return position
+
+    for end in result.marker_ends:
+        if text.startswith(("USER:", "AGENT:"), end):
+            return end - len(MARKER)
+    return -1
+
+
+def parse_turns(text: str, result: Optional[ScanResult] = None) -> Tuple[List[Dict[str, str]], Optional[str], List[str]]:
+    """
+    Split a completion into turns in the same way as text.split('@@@')[1:].
+
+    Returns:
+    Tuple: The USER/AGENT turns as {"role", "content"} dicts with any << >> removed,
+    the last SYSTEM message (or None), and the stripped text of turns that had no role.
+    """
+    result = result or scan(text)
+    turns = []
+    system_message = None
+    unparsed = []
+    boundaries = result.boundaries
+    for i, boundary in enumerate(boundaries):
+        start = boundary + len(MARKER)
+        end = boundaries[i + 1] if i + 1 < len(boundaries) else len(text)
+        match = ROLE_PATTERN.match(text, start, end)
+        if match is None:
+            unparsed.append(text[start:end].strip())
+            continue
+        if match.group(1):
+            system_message = text[start:end].strip()
+            continue
+        content = text[match.end():end].strip()
+        if content.startswith(':'):
+            content = content[1:].strip()
+        content = remove_brackets(content)
+        turns.append({"role": match.group(2).upper(), "content": content})
+    return turns, system_message, unparsed
+
+
+def extract_score(system_message: Optional[str]) -> Optional[int]:
+    """The 1-10 persuasion score reported in a system message, or None if there is none."""
+    if not system_message:
+        return None
+    match = SCORE_PATTERN.search(system_message)
+    return int(match.group(1)) if match else None
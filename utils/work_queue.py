@@ -0,0 +1,398 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+if __name__ == "__main__":
+    # Imported here: workers on other hosts need the .env settings (API keys, CONTEXTS_PATH and
+    # CONVERSATIONS_PATH, which the store and queue paths below are read from at import time)
+    from dotenv import load_dotenv
+    load_dotenv()
+
+from utils.generate_prompt import build_prompts
+from utils.manifest import prompt_id
+from utils.providers import get_provider
+from utils.save_outputs import CONVERSATIONS_PATH, save_outputs
+from utils.telemetry import write_metrics
+
+logger = logging.getLogger(__name__)
+
+WORK_QUEUE_PATH = os.getenv("WORK_QUEUE_PATH", os.path.join(CONVERSATIONS_PATH, "queue", "work.sqlite"))
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_CLAIM_SIZE = 16
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds an idle worker waits before looking for reclaimable work again
+IDLE_POLL_INTERVAL = 10
+COLLECT_BATCH_SIZE = 500
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+STATUSES = (PENDING, LEASED, DONE, FAILED)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class WorkQueue:
+    """
+    Prompt work queue in a SQLite file that workers on several hosts share.
+
+    Each item is one prompt for one provider. Workers claim items with a lease, extend it
+    with heartbeats while they generate, and complete items by handing back their outputs,
+    which are kept in the queue until collect() saves them to the output store. An item
+    whose lease expires (its worker crashed or hung) goes back to pending and is claimed
+    again, up to max_attempts times; then it is marked failed. The first output returned
+    for an item wins, so an item completed twice is stored once.
+
+    Every change runs in its own short IMMEDIATE transaction. The rollback journal is used
+    instead of WAL so the file also works on network storage, where WAL's shared memory
+    does not. Leases are wall-clock times: keep lease_seconds well above the clock skew
+    between hosts.
+    """
+
+    def __init__(self, path: str = WORK_QUEUE_PATH, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Shared with the heartbeat thread; the lock serializes use of the connection
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "id TEXT PRIMARY KEY, plan TEXT, provider TEXT, prompt TEXT, status TEXT, worker TEXT, "
+            "lease_expires REAL, attempts INTEGER DEFAULT 0, error TEXT, output TEXT, collected INTEGER DEFAULT 0, "
+            "enqueued_at REAL, finished_at REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS items_claim ON items (provider, status, lease_expires)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS items_collect ON items (status, collected)")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _transaction(self, fn):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self.connection)
+                self.connection.execute("COMMIT")
+                return result
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, prompts: List[Dict[str, Any]], provider: str, plan: Optional[str] = None) -> str:
+        """
+        Add a prompt plan for a provider. Prompts get deterministic ids from the plan id,
+        which become the ids of their outputs; re-enqueueing a plan adds nothing twice.
+
+        Returns:
+        str: The plan id.
+        """
+        plan = plan or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        now = time.time()
+        rows = []
+        for index, prompt in enumerate(prompts):
+            prompt["id"] = prompt_id(plan, index)
+            rows.append((prompt["id"], plan, provider, json.dumps(prompt), PENDING, now))
+
+        def insert(connection):
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO items (id, plan, provider, prompt, status, enqueued_at) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            return connection.total_changes - before
+
+        added = self._transaction(insert)
+        logger.info(f"Enqueued {added} of {len(prompts)} prompts for {provider} in plan {plan}")
+        return plan
+
+    def claim(self, worker: str, provider: str, limit: int = DEFAULT_CLAIM_SIZE,
+              lease_seconds: float = DEFAULT_LEASE_SECONDS) -> List[Dict[str, Any]]:
+        """
+        Lease up to limit pending prompts of a provider to worker, oldest first.
+
+        Expired leases are reclaimed first: their items go back to pending, or are marked
+        failed once they have been attempted max_attempts times.
+        """
+        def claim_items(connection):
+            now = time.time()
+            expired = connection.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL, "
+                "error = 'lease expired' WHERE provider = ? AND status = ? AND lease_expires < ?",
+                (self.max_attempts, FAILED, PENDING, provider, LEASED, now),
+            ).rowcount
+            if expired:
+                logger.warning(f"Reclaimed {expired} expired leases of {provider} items")
+            rows = connection.execute(
+                "SELECT rowid, prompt FROM items WHERE provider = ? AND status = ? ORDER BY rowid LIMIT ?",
+                (provider, PENDING, limit),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE items SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE rowid = ?",
+                [(LEASED, worker, now + lease_seconds, rowid) for rowid, _ in rows],
+            )
+            return [json.loads(prompt) for _, prompt in rows]
+
+        prompts = self._transaction(claim_items)
+        if prompts:
+            logger.info(f"Worker {worker} claimed {len(prompts)} {provider} prompts")
+        return prompts
+
+    def heartbeat(self, worker: str, ids: List[str], lease_seconds: float = DEFAULT_LEASE_SECONDS) -> List[str]:
+        """
+        Extend worker's leases on ids.
+
+        Returns:
+        List[str]: The ids the worker still holds; the others were reclaimed or finished.
+        """
+        def extend(connection):
+            placeholders = ", ".join("?" * len(ids))
+            connection.execute(
+                f"UPDATE items SET lease_expires = ? WHERE worker = ? AND status = ? AND id IN ({placeholders})",
+                [time.time() + lease_seconds, worker, LEASED] + list(ids),
+            )
+            return [row[0] for row in connection.execute(
+                f"SELECT id FROM items WHERE worker = ? AND status = ? AND id IN ({placeholders})", [worker, LEASED] + list(ids)
+            )]
+
+        if not ids:
+            return []
+        held = self._transaction(extend)
+        if len(held) < len(ids):
+            logger.warning(f"Worker {worker} lost the lease on {len(ids) - len(held)} items")
+        return held
+
+    def complete(self, worker: str, outputs: List[Dict[str, Any]]) -> int:
+        """
+        Record outputs as the results of their items (matched by id).
+
+        An item that already has a result keeps it. A result from a worker whose lease was
+        reclaimed is still accepted, since the work is done.
+
+        Returns:
+        int: The number of items completed.
+        """
+        def store(connection):
+            now = time.time()
+            return sum(connection.execute(
+                "UPDATE items SET status = ?, worker = ?, output = ?, error = NULL, finished_at = ? WHERE id = ? AND status != ?",
+                (DONE, worker, json.dumps(output), now, output["id"], DONE),
+            ).rowcount for output in outputs)
+
+        return self._transaction(store)
+
+    def fail(self, worker: str, ids: List[str], error: str):
+        """Give up worker's leases on ids after an error; each goes back to pending unless out of attempts."""
+        def release(connection):
+            placeholders = ", ".join("?" * len(ids))
+            connection.execute(
+                f"UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL, error = ? "
+                f"WHERE worker = ? AND status = ? AND id IN ({placeholders})",
+                [self.max_attempts, FAILED, PENDING, error, worker, LEASED] + list(ids),
+            )
+
+        if ids:
+            self._transaction(release)
+
+    def release(self, worker: str):
+        """Return every lease of worker to pending without counting the attempt, e.g. on shutdown."""
+        self._transaction(lambda connection: connection.execute(
+            "UPDATE items SET status = ?, worker = NULL, attempts = MAX(attempts - 1, 0) WHERE worker = ? AND status = ?",
+            (PENDING, worker, LEASED),
+        ))
+
+    def collect(self, batch_size: int = COLLECT_BATCH_SIZE) -> int:
+        """
+        Save the outputs of finished items to the output store, once each.
+
+        Outputs are saved before they are marked collected, so a crash in between saves a
+        batch twice under the same ids, which compact_outputs (and the index) resolve.
+
+        Returns:
+        int: The number of outputs saved.
+        """
+        saved = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT rowid, output FROM items WHERE status = ? AND collected = 0 ORDER BY rowid LIMIT ?",
+                    (DONE, batch_size),
+                ).fetchall()
+            if not rows:
+                break
+            save_outputs([json.loads(output) for _, output in rows])
+            self._transaction(lambda connection: connection.executemany(
+                "UPDATE items SET collected = 1 WHERE rowid = ?", [(rowid,) for rowid, _ in rows]
+            ))
+            saved += len(rows)
+        logger.info(f"Collected {saved} outputs from {self.path}")
+        return saved
+
+    def stats(self, provider: Optional[str] = None) -> Dict[str, int]:
+        """Number of items in each status (for one provider, if given)."""
+        query = "SELECT status, COUNT(*) FROM items"
+        params = []
+        if provider is not None:
+            query += " WHERE provider = ?"
+            params.append(provider)
+        with self.lock:
+            counts = dict(self.connection.execute(query + " GROUP BY status", params).fetchall())
+        return {status: counts.get(status, 0) for status in STATUSES}
+
+
+class Heartbeat:
+    """Background thread extending a worker's leases every interval seconds while it generates."""
+
+    def __init__(self, queue: WorkQueue, worker: str, lease_seconds: float, interval: float):
+        self.queue = queue
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.ids: List[str] = []
+        self.ids_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"heartbeat-{worker}", daemon=True)
+
+    def hold(self, ids: List[str]):
+        with self.ids_lock:
+            self.ids = list(ids)
+
+    def done(self, ids: List[str]):
+        finished = set(ids)
+        with self.ids_lock:
+            self.ids = [item_id for item_id in self.ids if item_id not in finished]
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with self.ids_lock:
+                ids = list(self.ids)
+            try:
+                self.queue.heartbeat(self.worker, ids, self.lease_seconds)
+            except sqlite3.Error as e:
+                logger.warning(f"Heartbeat of worker {self.worker} failed: {str(e)}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_worker(queue: WorkQueue, provider_name: str, worker: Optional[str] = None, claim_size: int = DEFAULT_CLAIM_SIZE,
+               lease_seconds: float = DEFAULT_LEASE_SECONDS, exit_when_empty: bool = True, **options) -> int:
+    """
+    Drain a provider's items from the queue: claim a batch, generate it with the provider, hand the outputs back.
+
+    Outputs are returned to the queue as each checkpoint of the batch lands, while a
+    heartbeat keeps the remaining leases alive. If generation fails, the unfinished items
+    of the batch are released for another attempt and the error is raised. Once nothing
+    is pending, the worker exits if exit_when_empty and no other worker holds a lease
+    (whose items could still come back); otherwise it polls for work.
+
+    Args:
+    queue: The shared queue.
+    provider_name: Registered provider generating the items.
+    worker: Name of this worker (default: host, pid and a random suffix).
+    claim_size: Items claimed at a time; for local models a multiple of the batch size.
+    lease_seconds: Lease length. Must comfortably exceed the heartbeat interval (a third of it).
+    options: Options for the provider's generate() (max_concurrency, batch_size, server_url, stream).
+
+    Returns:
+    int: The number of items this worker completed.
+    """
+    provider = get_provider(provider_name)
+    worker = worker or worker_name()
+    provider.metrics.reset()
+    completed = 0
+    logger.info(f"Worker {worker} draining {provider_name} items from {queue.path}")
+    try:
+        with Heartbeat(queue, worker, lease_seconds, lease_seconds / 3) as heartbeat:
+            while True:
+                prompts = queue.claim(worker, provider_name, claim_size, lease_seconds)
+                if not prompts:
+                    stats = queue.stats(provider_name)
+                    if exit_when_empty and not stats[PENDING] and not stats[LEASED]:
+                        break
+                    time.sleep(IDLE_POLL_INTERVAL)
+                    continue
+                ids = [prompt["id"] for prompt in prompts]
+                heartbeat.hold(ids)
+
+                def checkpoint(outputs):
+                    nonlocal completed
+                    completed += queue.complete(worker, outputs)
+                    heartbeat.done([output["id"] for output in outputs])
+
+                try:
+                    provider.generate(prompts, checkpoint, **options)
+                except Exception as e:
+                    logger.error(f"Worker {worker} failed generating a batch: {str(e)}")
+                    with heartbeat.ids_lock:
+                        unfinished = list(heartbeat.ids)
+                    queue.fail(worker, unfinished, str(e))
+                    raise
+                heartbeat.hold([])
+    except BaseException:
+        queue.release(worker)
+        raise
+    finally:
+        write_metrics(provider.metrics, f"queue-{worker}")
+    logger.info(f"Worker {worker} completed {completed} items")
+    return completed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Shared prompt work queue: enqueue a plan, run workers on any host, collect the outputs")
+    parser.add_argument("command", choices=["enqueue", "worker", "collect", "stats"],
+                        help="enqueue: add a prompt plan; worker: drain items; collect: save finished outputs to the store; stats: item counts")
+    parser.add_argument("--queue", default=WORK_QUEUE_PATH, help=f"Queue file, on storage every host can reach (default: {WORK_QUEUE_PATH})")
+    parser.add_argument("--model", help="Provider of the items (e.g. llama7b, gpt4); required for enqueue and worker")
+    parser.add_argument("-n", type=int, default=1, help="enqueue: number of prompts")
+    parser.add_argument("--seed", type=int, help="enqueue: seed for prompt sampling")
+    parser.add_argument("--per-cell", type=int, help="enqueue: plan per-cell quotas instead of n random prompts")
+    parser.add_argument("--plan", help="enqueue: plan id (default: a new one)")
+    parser.add_argument("--claim-size", type=int, default=DEFAULT_CLAIM_SIZE, help=f"worker: items claimed at a time (default: {DEFAULT_CLAIM_SIZE})")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help=f"worker: lease seconds (default: {DEFAULT_LEASE_SECONDS})")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help=f"Attempts before an item is failed (default: {DEFAULT_MAX_ATTEMPTS})")
+    parser.add_argument("--max-concurrency", type=int, default=1, help="worker: API requests in flight (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=8, help="worker: generation batch for local models (default: 8)")
+    parser.add_argument("--server", help="worker: local model server URL")
+    parser.add_argument("--keep-polling", action="store_true", help="worker: keep waiting for new items instead of exiting when the queue is drained")
+    args = parser.parse_args()
+
+    if args.command in ("enqueue", "worker") and not args.model:
+        parser.error(f"{args.command} needs --model")
+    with WorkQueue(args.queue, max_attempts=args.max_attempts) as queue:
+        if args.command == "enqueue":
+            prompts = build_prompts(args.n, get_provider(args.model).model_name, args.per_cell, args.seed)
+            print(queue.enqueue(prompts, args.model, plan=args.plan))
+        elif args.command == "worker":
+            run_worker(queue, args.model, claim_size=args.claim_size, lease_seconds=args.lease,
+                       exit_when_empty=not args.keep_polling, max_concurrency=args.max_concurrency,
+                       batch_size=args.batch_size, server_url=args.server)
+        elif args.command == "collect":
+            print(queue.collect())
+        else:
+            print(json.dumps(queue.stats(args.model)))